@@ -0,0 +1,76 @@
+#    common.py
+#    ~~~~~~~~~
+#    This module implements helpers shared by the benchmark scripts.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import os
+import sys
+import time
+import threading
+
+try:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn
+except ImportError:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+sys.path.append(ROOT_DIR)
+
+# Run the specified function the specified number of times and return the
+# average duration of a single call in microseconds.
+def bench(func, iterations):
+	start = time.time()
+	for n in range(0, iterations):
+		func()
+	return (time.time() - start) * 1000000.0 / iterations
+
+# Print a single benchmark result line.
+def report(name, value, unit='us'):
+	print('%-54s %10.2f %s' % (name, value, unit))
+
+# Each keep-alive connection is served on its own thread so that several
+# publishing clients can be connected at once.
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+# The LocalHttpServer class is a stand-in publishing endpoint that accepts
+# every POST with a 200 response. An optional delay in seconds is applied
+# before each response to simulate endpoint latency.
+class LocalHttpServer(object):
+
+	def __init__(self, delay=0):
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			# the headers and body are written separately, which would
+			# otherwise stall each keep-alive response on a delayed ACK
+			disable_nagle_algorithm = True
+
+			def do_POST(self):
+				length = int(self.headers.get('Content-Length', 0))
+				self.rfile.read(length)
+				if delay:
+					time.sleep(delay)
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain')
+				self.send_header('Content-Length', '3')
+				self.end_headers()
+				self.wfile.write(b'Ok\n')
+
+			def log_message(self, format, *args):
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.uri = 'http://127.0.0.1:%d' % self.server.server_address[1]
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
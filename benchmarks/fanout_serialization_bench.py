@@ -0,0 +1,90 @@
+#    fanout_serialization_bench.py
+#    ~~~~~~~~~
+#    This module measures PubControl.publish serialization cost with a mix of
+#    HTTP and ZMQ clients.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from common import bench, report
+from src.format import Format
+from src.item import Item
+from src.pubcontrol import PubControl
+from src.pubcontrolclient import PubControlClient
+from src.zmqpubcontrolclient import ZmqPubControlClient
+
+# The transports of the clients below are replaced so that only the work
+# done before handing a message to the network is measured.
+
+class NullHttpClient(PubControlClient):
+	def _ensure_thread(self):
+		pass
+
+	def _queue_req(self, req):
+		pass
+
+class NullSocket(object):
+	def send(self, data):
+		pass
+
+	def close(self):
+		pass
+
+class NullZmqClient(ZmqPubControlClient):
+	def __init__(self):
+		ZmqPubControlClient.__init__(self, None, push_uri='inproc://null')
+		self._discovery_completed = True
+		self._push_sock.close()
+		self._push_sock = NullSocket()
+
+class NullPubController(object):
+	def publish(self, channel, content):
+		pass
+
+class HttpStreamFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'http-stream'
+
+	def export(self):
+		return {'content': self.content}
+
+class WebSocketMessageFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'ws-message'
+
+	def export(self):
+		return {'content': self.content}
+
+def main():
+	iterations = 20000
+	pub = PubControl()
+	for n in range(0, 3):
+		pub.add_client(NullHttpClient('http://localhost:%d' % (8000 + n)))
+	for n in range(0, 2):
+		pub.add_client(NullZmqClient())
+	pub._zmq_pub_controller = NullPubController()
+	content = u'{"value": 42, "text": "héllo"}' * 4
+	item = Item([HttpStreamFormat(content), WebSocketMessageFormat(content)],
+			id='2', prev_id='1', meta={'room': 'lobby'})
+
+	# the previous behavior: each client serializes the raw item itself
+	def publish_per_client():
+		for client in pub.clients:
+			client.publish('lobby', item)
+		pub._send_to_zmq('lobby', item)
+
+	report('3 http + 2 zmq push + pub controller, per client',
+			bench(publish_per_client, iterations))
+	report('3 http + 2 zmq push + pub controller, shared',
+			bench(lambda: pub.publish('lobby', item), iterations))
+	pub._zmq_pub_controller = None
+	pub.close()
+
+if __name__ == '__main__':
+	main()
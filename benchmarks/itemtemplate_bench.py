@@ -0,0 +1,63 @@
+#    itemtemplate_bench.py
+#    ~~~~~~~~~
+#    This module compares building items directly against ItemTemplate.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from common import bench, report
+from src.format import Format
+from src.item import Item
+from src.itemtemplate import ItemTemplate
+
+class HttpStreamFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'http-stream'
+
+	def export(self):
+		return {'content': self.content}
+
+class WebSocketMessageFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'ws-message'
+
+	def export(self):
+		return {'content': self.content, 'type': 'text'}
+
+META = {'tenant': 'acme', 'room': 'lobby', 'kind': 'update',
+		'tags': ['a', 'b', 'c']}
+
+def build_item(content, id):
+	return Item([HttpStreamFormat(content), WebSocketMessageFormat(content)],
+			id=id, meta=META)
+
+def main():
+	iterations = 50000
+	content = u'{"value": 42, "text": "héllo"}'
+	field = ItemTemplate.Field('content')
+	template = ItemTemplate([HttpStreamFormat(field),
+			WebSocketMessageFormat(field)], meta=META)
+	channel = 'room-lobby'
+	zmq_channel = channel.encode('utf-8')
+
+	report('Item + _export_json',
+			bench(lambda: build_item(content, '1')._export_json(channel),
+			iterations))
+	report('ItemTemplate.fill + _export_json',
+			bench(lambda: template.fill({'content': content}, '1')._export_json(
+			channel), iterations))
+	report('Item + _export_tnetstring',
+			bench(lambda: build_item(content, '1')._export_tnetstring(
+			zmq_channel), iterations))
+	report('ItemTemplate.fill + _export_tnetstring',
+			bench(lambda: template.fill({'content': content}, '1')._export_tnetstring(
+			zmq_channel), iterations))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,63 @@
+#    priority_lanes_bench.py
+#    ~~~~~~~~~
+#    This module measures the queuing latency of important publishes sent
+#    during a burst of bulk publishes with and without priority lanes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from common import report, LocalHttpServer
+from src.format import Format
+from src.item import Item
+from src.pubcontrolclient import PubControlClient
+
+class HttpStreamFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'http-stream'
+
+	def export(self):
+		return {'content': self.content}
+
+# Queue a burst of bulk items with an important item after every 50 of
+# them and report the queuing latency of each lane.
+def run(name, server, bulk, important, weights=None):
+	pcc = PubControlClient(server.uri)
+	if weights is not None:
+		pcc.set_priority_draining(weights)
+	item = Item(HttpStreamFormat('x' * 200))
+	low = 'low' if important else None
+	high = 'high' if important else None
+	for n in range(0, bulk):
+		pcc.publish('bulk', item, priority=low)
+		if n % 50 == 0:
+			pcc.publish('alerts', item, priority=high)
+	pcc.wait_all_sent()
+	stats = pcc.get_lane_stats()
+	if important:
+		report(name + ', high lane avg latency',
+				stats['high']['avg_latency'] * 1000.0, 'ms')
+		report(name + ', high lane max latency',
+				stats['high']['max_latency'] * 1000.0, 'ms')
+		report(name + ', low lane avg latency',
+				stats['low']['avg_latency'] * 1000.0, 'ms')
+	else:
+		report(name + ', avg latency',
+				stats['normal']['avg_latency'] * 1000.0, 'ms')
+		report(name + ', max latency',
+				stats['normal']['max_latency'] * 1000.0, 'ms')
+	pcc.close()
+
+def main():
+	server = LocalHttpServer(delay=0.002)
+	bulk = 5000
+	run('single FIFO lane', server, bulk, False)
+	run('strict priority lanes', server, bulk, True)
+	run('weighted priority lanes 6:3:1', server, bulk, True,
+			{'high': 6, 'normal': 3, 'low': 1})
+	server.close()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,88 @@
+#    process_publish_bench.py
+#    ~~~~~~~~~
+#    This module measures publishing throughput from a CPU-bound process with
+#    and without worker processes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import time
+import multiprocessing
+from common import report, LocalHttpServer
+from src.format import Format
+from src.item import Item
+from src.pubcontrol import PubControl
+
+class HttpStreamFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'http-stream'
+
+	def export(self):
+		return {'content': self.content}
+
+# The endpoint runs in its own process so that it does not compete with the
+# publishing process for the GIL.
+def serve(uris):
+	server = LocalHttpServer()
+	uris.put(server.uri)
+	server.thread.join()
+
+# Stand-in for the business logic of a CPU-bound producer.
+def work(n):
+	total = 0
+	for i in range(0, 2000):
+		total += i * n
+	return total
+
+# Returns the overall throughput and the average time spent within the
+# publish calls of the producing process.
+def run(pub, messages):
+	content = u'{"value": 42, "text": "hello"}' * 8
+	publishing = 0.0
+	start = time.time()
+	for n in range(0, messages):
+		work(n)
+		item = Item(HttpStreamFormat(content), id=str(n))
+		publish_start = time.time()
+		pub.publish('channel-%d' % (n % 50), item)
+		publishing += time.time() - publish_start
+	pub.wait_all_sent()
+	return (messages / (time.time() - start),
+			publishing * 1000000.0 / messages)
+
+def report_run(name, pub, messages):
+	throughput, publish_us = run(pub, messages)
+	report(name + ', throughput', throughput, 'msg/s')
+	report(name + ', publish call', publish_us)
+
+def main():
+	messages = 5000
+	uris = multiprocessing.Queue()
+	servers = list()
+	for n in range(0, 2):
+		server = multiprocessing.Process(target=serve, args=(uris,))
+		server.daemon = True
+		server.start()
+		servers.append(server)
+	config = [{'uri': uris.get()}, {'uri': uris.get()}]
+
+	print('cpus: %d' % multiprocessing.cpu_count())
+	pub = PubControl(config)
+	report_run('2 endpoints, in-process', pub, messages)
+	pub.close()
+
+	for processes in (1, 2):
+		pub = PubControl()
+		pub.apply_config(config, processes=processes)
+		report_run('2 endpoints, %d worker processes' % processes, pub,
+				messages)
+		pub.close()
+
+	for server in servers:
+		server.terminate()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+#    pubsubmonitor_loop_bench.py
+#    ~~~~~~~~~
+#    This module measures the per-event CPU cost of the PubSubMonitor stream
+#    event loop, excluding the network reads.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import json
+import time
+import threading
+from base64 import b64encode
+from common import report
+from src.pubsubmonitor import PubSubMonitor
+
+def encode_cursor(n):
+	return b64encode(('bench_%d' % n).encode('ascii')).decode('ascii')
+
+# Serves the recorded stream from memory, both through iter_lines and
+# through read1.
+class ResponseTestClass(object):
+	def __init__(self, data):
+		self.data = data
+		self.raw = self
+
+	def iter_lines(self, chunk_size=512):
+		return iter(self.data.split(b'\n'))
+
+	def read1(self, amt):
+		data = self.data[:amt]
+		self.data = self.data[amt:]
+		return data
+
+# Build a stream of alternating subscribe and unsubscribe events where each
+# event carries the cursor of the previous one.
+def record_stream(events):
+	lines = list()
+	for n in range(1, events + 1):
+		state = 'subscribed' if n % 2 == 0 else 'unsubscribed'
+		lines.append(json.dumps({'item': {'channel': 'room-%d' % (n % 1000),
+				'state': state}, 'cursor': encode_cursor(n),
+				'prev_cursor': encode_cursor(n - 1)}))
+	return ('\n'.join(lines) + '\n').encode('utf-8')
+
+# Create a monitor without starting its threads, positioned at the cursor
+# preceding the recorded stream.
+def create_monitor(data):
+	monitor = PubSubMonitor.__new__(PubSubMonitor)
+	monitor.__dict__.update({'_lock': threading.Lock(), '_callback': None,
+			'_channels': set(), '_closed': False,
+			'_catch_stream_up_to_last_cursor': False,
+			'_last_cursor': encode_cursor(0),
+			'_last_cursor_cache': (None, None),
+			'_stream_response': ResponseTestClass(data)})
+	return monitor
+
+def main():
+	events = 100000
+	data = record_stream(events)
+	for run in range(0, 3):
+		monitor = create_monitor(data)
+		start = time.process_time()
+		monitor._monitor()
+		elapsed = time.process_time() - start
+		assert monitor._last_cursor == encode_cursor(events)
+		report('monitor loop, cpu per event (run %d)' % (run + 1),
+				elapsed * 1000000.0 / events)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,96 @@
+#    pubsubmonitor_stream_bench.py
+#    ~~~~~~~~~
+#    This module measures the cost of reading a high-churn subscription
+#    stream line by line.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import json
+import time
+import multiprocessing
+from base64 import b64encode
+from common import report
+from src.pubsubmonitor import _iter_stream_lines
+from src.utilities import requests
+
+try:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+# Build a recorded stream of alternating subscribe and unsubscribe events
+# in the format served by the subscriptions/stream/ endpoint.
+def record_stream(events):
+	lines = list()
+	for n in range(0, events):
+		cursor = b64encode(('bench_%d' % n).encode('ascii')).decode('ascii')
+		prev = b64encode(('bench_%d' % (n - 1)).encode('ascii')).decode(
+				'ascii')
+		state = 'subscribed' if n % 2 == 0 else 'unsubscribed'
+		lines.append(json.dumps({'item': {'channel': 'room-%d' % (n % 1000),
+				'state': state}, 'cursor': cursor, 'prev_cursor': prev}))
+	return ('\n'.join(lines) + '\n').encode('utf-8')
+
+# The stand-in endpoint serves the recorded stream with chunked encoding in
+# 4 KB chunks, as a busy stream would arrive.
+def serve(uris, data):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def do_GET(self):
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/plain')
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+			for pos in range(0, len(data), 4096):
+				chunk = data[pos:pos + 4096]
+				self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii') +
+						chunk + b'\r\n')
+			self.wfile.write(b'0\r\n\r\n')
+
+		def log_message(self, format, *args):
+			pass
+
+	server = HTTPServer(('127.0.0.1', 0), Handler)
+	uris.put('http://127.0.0.1:%d/' % server.server_address[1])
+	server.serve_forever()
+
+# Returns the number of lines read along with the elapsed and CPU time per
+# line in microseconds.
+def run(uri, reader):
+	session = requests.session()
+	response = session.get(uri, stream=True)
+	start = time.time()
+	cpu_start = time.process_time()
+	count = 0
+	for line in reader(response):
+		if line:
+			count += 1
+	elapsed = time.time() - start
+	cpu = time.process_time() - cpu_start
+	response.close()
+	return (count, elapsed * 1000000.0 / count, cpu * 1000000.0 / count)
+
+def main():
+	events = 50000
+	uris = multiprocessing.Queue()
+	server = multiprocessing.Process(target=serve,
+			args=(uris, record_stream(events)))
+	server.daemon = True
+	server.start()
+	uri = uris.get()
+
+	readers = [('iter_lines(chunk_size=1)',
+			lambda response: response.iter_lines(chunk_size=1)),
+			('buffered line reader', _iter_stream_lines)]
+	for name, reader in readers:
+		count, elapsed, cpu = run(uri, reader)
+		assert count == events
+		report('%s, per event' % name, elapsed)
+		report('%s, cpu per event' % name, cpu)
+
+	server.terminate()
+
+if __name__ == '__main__':
+	main()
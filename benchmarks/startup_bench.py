@@ -0,0 +1,66 @@
+#    startup_bench.py
+#    ~~~~~~~~~
+#    This module measures package import time and first publish latency.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import sys
+import time
+import subprocess
+from common import ROOT_DIR, report, LocalHttpServer
+
+# Each measurement runs in a fresh interpreter so that nothing is cached
+# from a previous import.
+IMPORT_SCRIPT = '''
+import sys, time
+sys.path.insert(0, %r)
+start = time.time()
+import src
+elapsed = time.time() - start
+loaded = [m for m in ('requests', 'jwt', 'zmq', 'tnetstring') if m in sys.modules]
+print('%%f %%s' %% (elapsed, ','.join(loaded)))
+'''
+
+FIRST_PUBLISH_SCRIPT = '''
+import sys, time, threading
+sys.path.insert(0, %r)
+start = time.time()
+from src import PubControl, Item, Format
+class F(Format):
+	def name(self):
+		return 'json-object'
+	def export(self):
+		return {'value': 1}
+pub = PubControl({'uri': %r})
+pub.publish('bench', Item(F()), blocking=True)
+elapsed = time.time() - start
+print('%%f %%d' %% (elapsed, threading.active_count()))
+pub.close()
+'''
+
+def run(script, runs):
+	results = []
+	for n in range(0, runs):
+		out = subprocess.check_output([sys.executable, '-c', script])
+		results.append(out.decode('utf-8').split())
+	return results
+
+def main():
+	runs = 10
+	results = run(IMPORT_SCRIPT % ROOT_DIR, runs)
+	times = sorted(float(r[0]) for r in results)
+	report('import pubcontrol (median)', times[len(times) // 2] * 1000, 'ms')
+	loaded = results[0][1] if len(results[0]) > 1 else ''
+	print('heavy modules loaded at import: %s' % (loaded or 'none'))
+
+	server = LocalHttpServer()
+	results = run(FIRST_PUBLISH_SCRIPT % (ROOT_DIR, server.uri), runs)
+	server.close()
+	times = sorted(float(r[0]) for r in results)
+	report('import + first blocking http publish (median)',
+			times[len(times) // 2] * 1000, 'ms')
+	print('threads alive after http-only publish: %s' % results[0][1])
+
+if __name__ == '__main__':
+	main()
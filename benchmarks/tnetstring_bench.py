@@ -0,0 +1,71 @@
+#    tnetstring_bench.py
+#    ~~~~~~~~~
+#    This module compares the tnetstring encoding paths used for ZMQ publishing.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from common import bench, report
+from src import tnetstringcodec
+from src.format import Format
+from src.item import Item
+from src.utilities import _ensure_utf8
+
+try:
+	import tnetstring
+except ImportError:
+	tnetstring = None
+
+class HttpStreamFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'http-stream'
+
+	def export(self):
+		return {'content': self.content}
+
+class WebSocketMessageFormat(Format):
+	def __init__(self, content):
+		self.content = content
+
+	def name(self):
+		return 'ws-message'
+
+	def export(self):
+		return {'content': self.content}
+
+def main():
+	iterations = 50000
+	item = Item([HttpStreamFormat(u'event: update\ndata: {"value": 1}\n\n'),
+			WebSocketMessageFormat(u'{"value": 1, "text": "héllo"}')],
+			id='id-2', prev_id='id-1', meta={'user': 'abc', 'room': 'r1'})
+	raw = item._export(True)
+	encoded = item.export(True, True)
+	data = tnetstringcodec.dumps(raw)
+
+	tnetstringcodec._c_backend = False
+	report('export + codec (pure python)',
+			bench(lambda: tnetstringcodec.dumps(item._export(True)), iterations))
+	report('export + _ensure_utf8 + codec (pure python)',
+			bench(lambda: tnetstringcodec.dumps(item.export(True, True)),
+			iterations))
+	report('codec loads (pure python)',
+			bench(lambda: tnetstringcodec.loads(data), iterations))
+	tnetstringcodec._c_backend = None
+
+	if tnetstring is None:
+		print('tnetstring package not installed, skipping C backend results')
+		return
+	report('export + _ensure_utf8 + tnetstring.dumps (old path)',
+			bench(lambda: tnetstring.dumps(item.export(True, True)), iterations))
+	report('export + codec (C backend)',
+			bench(lambda: tnetstringcodec.dumps(item._export(True)), iterations))
+	report('codec on utf8 tree (C backend)',
+			bench(lambda: tnetstringcodec.dumps(encoded), iterations))
+	report('codec loads (C backend)',
+			bench(lambda: tnetstringcodec.loads(data), iterations))
+
+if __name__ == '__main__':
+	main()
@@ -7,9 +7,21 @@
 
 from .pcccbhandler import PubControlClientCallbackHandler
 from .item import Item
+from .itemtemplate import ItemTemplate
 from .format import Format
 from .pubcontrolclient import PubControlClient
 from .zmqpubcontrolclient import ZmqPubControlClient
 from .pubcontrol import PubControl
 from .zmqpubcontroller import ZmqPubController
+from .processpublisher import ProcessPublisher
+from .replicaclient import ReplicaPubControlClient
 from .pubsubmonitor import PubSubMonitor
+from .channelindex import ChannelIndex
+from .reconnectscheduler import ReconnectScheduler
+from .sharedpubsubmonitor import SharedPubSubMonitor
+
+try:
+	from .asyncpubsubmonitor import AsyncPubSubMonitor
+except SyntaxError:
+	# asyncio support requires Python 3
+	pass
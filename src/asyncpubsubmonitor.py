@@ -0,0 +1,308 @@
+#    asyncpubsubmonitor.py
+#    ~~~~~~~~~
+#    This module implements the AsyncPubSubMonitor class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import asyncio
+import json
+import threading
+import logging
+from .pubsubmonitor import PubSubMonitor, _LineSplitter
+from .utilities import _ensure_unicode, _verify_aiohttp, aiohttp
+
+logger = logging.getLogger(__name__)
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+# An internal method for getting the event loop that is shared by the
+# AsyncPubSubMonitor instances that are not given a loop. The loop runs in a
+# daemon thread that is started on first use.
+def _get_shared_loop():
+	global _shared_loop
+	_shared_loop_lock.acquire()
+	try:
+		if _shared_loop is None:
+			loop = asyncio.new_event_loop()
+			thread = threading.Thread(target=loop.run_forever)
+			thread.daemon = True
+			thread.start()
+			_shared_loop = loop
+		return _shared_loop
+	finally:
+		_shared_loop_lock.release()
+
+# The AsyncPubSubMonitor class monitors subscriptions to channels via an
+# HTTP interface like the PubSubMonitor class, with the same cursor and
+# catch-up semantics, except that the stream connection and the historical
+# fetches run as a task on an asyncio event loop rather than in threads, so
+# that any number of endpoints can be monitored from a single thread. The
+# subscription state can be read from any thread. The aiohttp package is
+# required.
+class AsyncPubSubMonitor(PubSubMonitor):
+
+	# Initialize with the same parameters as the PubSubMonitor class and the
+	# event loop to run on. If no loop is specified then a loop that is
+	# shared by all such instances is run in a separate thread. The instance
+	# can be created from any thread, including the thread of the loop.
+	def __init__(self, base_stream_uri, auth_jwt_claim=None, auth_jwt_key=None, callback=None, auth_bearer=None,
+			batch_callback=None, loop=None, state_file=None, state_interval=5.0):
+		_verify_aiohttp()
+		self._init_state(base_stream_uri, auth_jwt_claim, auth_jwt_key,
+				callback, auth_bearer, batch_callback, state_file,
+				state_interval)
+		if loop is None:
+			loop = _get_shared_loop()
+		self._loop = loop
+		self._session = None
+		self._task = None
+		self._stopped = threading.Event()
+		asyncio.run_coroutine_threadsafe(self._run_stream(), loop)
+
+	# Close this instance. This method can be called from any thread. If
+	# blocking is set to True then the method blocks until the task is
+	# complete, unless it is called from the thread of the loop, where the
+	# aclose method should be awaited instead.
+	def close(self, blocking=False):
+		self._lock.acquire()
+		self._closed = True
+		self._callback = None
+		self._batch_callback = None
+		self._lock.release()
+		try:
+			self._loop.call_soon_threadsafe(self._cancel)
+		except RuntimeError:
+			# the loop is closed so the task is no longer running
+			return
+		if blocking and not self._is_loop_thread():
+			self._stopped.wait()
+
+	# Close this instance and wait until the task is complete. This method
+	# must be awaited on the loop of this instance.
+	async def aclose(self):
+		self.close()
+		task = self._task
+		if task is not None and task is not asyncio.current_task():
+			try:
+				await task
+			except (asyncio.CancelledError, Exception):
+				pass
+
+	# An internal method for cancelling the task. Called on the loop.
+	def _cancel(self):
+		if self._task is not None:
+			self._task.cancel()
+
+	# An internal method for determining if the calling thread is running
+	# the loop of this instance.
+	def _is_loop_thread(self):
+		try:
+			return asyncio.get_running_loop() is self._loop
+		except RuntimeError:
+			return False
+
+	# Run the stream connection.
+	async def _run_stream(self):
+		self._task = asyncio.current_task()
+		logger.debug('stream task started')
+		try:
+			if self._closed:
+				return
+			self._session = aiohttp.ClientSession()
+			try:
+				await self._run_stream_connections()
+			finally:
+				await self._session.close()
+		except asyncio.CancelledError:
+			pass
+		except Exception:
+			logger.exception('error monitoring stream')
+		finally:
+			self._save_state(True)
+			self._stopped.set()
+			logger.debug('stream task ended')
+
+	# An internal method for connecting the stream, running the historical
+	# fetch and monitoring the stream until this instance is closed. The
+	# first connection is made right away while reconnections are spread
+	# out by the reconnect scheduler.
+	async def _run_stream_connections(self):
+		wait_interval = 0
+		while not self._closed:
+			response = None
+			while response is None:
+				if self._closed:
+					return
+				await asyncio.sleep(wait_interval)
+				wait_interval = self.reconnect_scheduler.get_wait_interval(
+						wait_interval or None)
+				try:
+					response = await self._open_stream()
+				except (asyncio.TimeoutError, aiohttp.ClientError):
+					continue
+			wait_interval = self.reconnect_scheduler.get_wait_interval()
+			try:
+				if await self._historical_fetch():
+					await self._monitor_stream(response)
+			except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+				logger.debug('stream ended: %s', e)
+			finally:
+				response.close()
+
+	# An internal method for opening the stream connection. Returns the
+	# response, or None if the connection should be retried.
+	async def _open_stream(self):
+		logger.debug('stream get %s', self._stream_uri)
+		response = await self._session.get(self._stream_uri,
+				headers=self._get_headers(),
+				timeout=aiohttp.ClientTimeout(sock_connect=5, sock_read=60))
+		status = response.status
+		if status >= 200 and status < 300:
+			logger.debug('stream open')
+			return response
+		response.close()
+		if status < 500 or status == 501 or status >= 600:
+			self.close()
+			raise ValueError(
+					'pubsubmonitor stream connection resulted in status code: %d' %
+					status)
+		return None
+
+	# Monitor the specified stream response. Whatever data is available is
+	# read at once and the lines it completed are processed together.
+	async def _monitor_stream(self, response):
+		splitter = _LineSplitter()
+		while True:
+			data = await response.content.readany()
+			if data:
+				lines = splitter.feed(data)
+			else:
+				lines = splitter.flush()
+			if lines and not await self._process_stream_lines(lines):
+				return
+			if not data:
+				return
+
+	# Process the specified list of stream lines like the PubSubMonitor class
+	# does, except that a cursor mismatch is handled by awaiting the
+	# historical fetch. Returns False if monitoring should stop.
+	async def _process_stream_lines(self, lines):
+		items = list()
+		try:
+			for line in lines:
+				if self._closed or self._is_catch_up_timed_out():
+					return False
+
+				if not line:
+					continue
+
+				content = json.loads(_ensure_unicode(line))
+				action = self._check_stream_event(content)
+				if action == 'skip':
+					continue
+				if action == 'mismatch':
+					self._parse_items(items)
+					items = list()
+					if not await self._historical_fetch():
+						return False
+				else:
+					items.append(content['item'])
+				self._set_stream_cursor(content['cursor'])
+			return True
+		finally:
+			self._parse_items(items)
+			self._save_state()
+
+	# Run the historical fetch starting at the last cursor once the reconnect
+	# scheduler allows it. Each page is applied as soon as it arrives and the
+	# last cursor is advanced after each page. Returns True once the last
+	# page was applied.
+	async def _historical_fetch(self):
+		await self._acquire_fetch()
+		try:
+			return await self._run_historical_fetch()
+		finally:
+			self.reconnect_scheduler.release_fetch()
+
+	# An internal method for waiting until the reconnect scheduler allows a
+	# historical fetch to start. If the waiting task is cancelled then the
+	# fetch is released as soon as it is allowed.
+	async def _acquire_fetch(self):
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		scheduler = self.reconnect_scheduler
+		def start(future):
+			if future.cancelled():
+				scheduler.release_fetch()
+			else:
+				future.set_result(None)
+		def grant():
+			try:
+				loop.call_soon_threadsafe(start, future)
+			except RuntimeError:
+				# the loop is closed
+				scheduler.release_fetch()
+		scheduler.request_fetch(grant)
+		try:
+			await future
+		except asyncio.CancelledError:
+			if future.done() and not future.cancelled():
+				scheduler.release_fetch()
+			raise
+
+	# An internal method for running the historical fetch (see the
+	# _historical_fetch method).
+	async def _run_historical_fetch(self):
+		logger.debug('catching up')
+		while True:
+			result, value = await self._fetch_history_page(self._last_cursor)
+			if result == 'not_found':
+				self._unsub_and_clear_channels()
+				return False
+			elif result == 'error':
+				self.close()
+				raise ValueError(
+						'pubsubmonitor historical fetch connection resulted in status code: %d' %
+						value)
+			elif result != 'page':
+				return False
+			self._parse_items(value['items'])
+			self._last_cursor = value['last_cursor']
+			self._save_state()
+			if not value['items']:
+				break
+		self._start_catch_up()
+		return True
+
+	# Download the page of the historical fetch that follows the specified
+	# cursor, retrying with jittered wait intervals. Returns a (result,
+	# value) tuple as described for the PubSubMonitor._fetch_history_pages
+	# method.
+	async def _fetch_history_page(self, cursor):
+		uri = self._get_history_uri(cursor)
+		wait_interval = None
+		for attempt in range(0, self._history_attempts):
+			if self._closed:
+				break
+			if attempt > 0:
+				wait_interval = self.reconnect_scheduler.get_wait_interval(
+						wait_interval, self._history_max_interval)
+				await asyncio.sleep(wait_interval)
+			try:
+				logger.debug('history get %s', uri)
+				response = await self._session.get(uri,
+						headers=self._get_headers(),
+						timeout=aiohttp.ClientTimeout(total=30))
+				try:
+					content = await response.read()
+				finally:
+					response.close()
+				result = PubSubMonitor._parse_history_response(
+						response.status, content)
+				if result is not None:
+					return result
+			except (asyncio.TimeoutError, aiohttp.ClientError):
+				pass
+		return ('failed', None)
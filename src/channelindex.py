@@ -0,0 +1,246 @@
+#    channelindex.py
+#    ~~~~~~~~~
+#    This module implements the ChannelIndex class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+from fnmatch import fnmatchcase
+
+# The _Node class is used internally for the nodes of the radix tree of the
+# ChannelIndex class. The label is the part of the channel name on the edge
+# leading to the node and the count is the number of channels at or below
+# the node.
+class _Node(object):
+	__slots__ = ('label', 'children', 'terminal', 'count')
+
+	def __init__(self, label):
+		self.label = label
+		self.children = dict()
+		self.terminal = False
+		self.count = 0
+
+# The ChannelIndex class keeps a set of channel names in a radix tree so that
+# the channels under a prefix, such as 'tenant/room/' for hierarchical
+# channel names, can be checked, counted and listed without scanning every
+# channel. Counting takes time proportional to the length of the prefix and
+# listing additionally takes time proportional to the number of channels
+# listed. Channel names are either all strings or all bytes. Instances are
+# thread-safe.
+class ChannelIndex(object):
+
+	# Initialize with an optional iterable of channels.
+	def __init__(self, channels=None):
+		self._lock = threading.Lock()
+		self._root = _Node(None)
+		if channels:
+			for channel in channels:
+				self._add(channel)
+
+	# Add the specified channel. Returns False if it was already present.
+	def add(self, channel):
+		self._lock.acquire()
+		try:
+			return self._add(channel)
+		finally:
+			self._lock.release()
+
+	# Remove the specified channel. Returns False if it was not present.
+	def remove(self, channel):
+		self._lock.acquire()
+		try:
+			return self._remove(channel)
+		finally:
+			self._lock.release()
+
+	# Apply the specified list of ('sub' or 'unsub', channel) tuples.
+	def apply(self, events):
+		self._lock.acquire()
+		try:
+			for event_type, channel in events:
+				if event_type == 'sub':
+					self._add(channel)
+				else:
+					self._remove(channel)
+		finally:
+			self._lock.release()
+
+	# Determine if any channel starts with the specified prefix.
+	def has_prefix(self, prefix):
+		return self.count(prefix) > 0
+
+	# Get the number of channels that start with the specified prefix, which
+	# defaults to all channels.
+	def count(self, prefix=None):
+		self._lock.acquire()
+		try:
+			node = self._find_prefix(prefix)[0]
+			if node is None:
+				return 0
+			return node.count
+		finally:
+			self._lock.release()
+
+	# Get a sorted list of the channels that start with the specified
+	# prefix, which defaults to all channels.
+	def get(self, prefix=None):
+		self._lock.acquire()
+		try:
+			node, path = self._find_prefix(prefix)
+			out = list()
+			if node is not None:
+				ChannelIndex._collect(node, path, out)
+			return out
+		finally:
+			self._lock.release()
+
+	# Get a sorted list of the channels that match the specified shell-style
+	# pattern (see the fnmatch module). Only the channels that start with the
+	# part of the pattern before its first wildcard are compared.
+	def match(self, pattern):
+		prefix = pattern
+		for n in range(0, len(pattern)):
+			if pattern[n:n + 1] in ('*', '?', '[', b'*', b'?', b'['):
+				prefix = pattern[:n]
+				break
+		return [channel for channel in self.get(prefix)
+				if fnmatchcase(channel, pattern)]
+
+	def __contains__(self, channel):
+		self._lock.acquire()
+		try:
+			node = self._find(channel)
+			return node is not None and node.terminal
+		finally:
+			self._lock.release()
+
+	def __len__(self):
+		return self._root.count
+
+	# An internal method for adding the specified channel. Must be called
+	# while holding the lock.
+	def _add(self, channel):
+		node = self._find(channel)
+		if node is not None and node.terminal:
+			return False
+		node = self._root
+		node.count += 1
+		pos = 0
+		while pos < len(channel):
+			key = channel[pos]
+			child = node.children.get(key)
+			if child is None:
+				child = _Node(channel[pos:])
+				child.terminal = True
+				child.count = 1
+				node.children[key] = child
+				return True
+			label = child.label
+			common = 1
+			end = min(len(label), len(channel) - pos)
+			while common < end and label[common] == channel[pos + common]:
+				common += 1
+			if common < len(label):
+				# split the edge at the end of the common part
+				middle = _Node(label[:common])
+				middle.count = child.count
+				child.label = label[common:]
+				middle.children[child.label[0]] = child
+				node.children[key] = middle
+				child = middle
+			child.count += 1
+			pos += common
+			node = child
+		node.terminal = True
+		return True
+
+	# An internal method for removing the specified channel. Nodes that no
+	# longer lead to a channel are removed and nodes that are left with a
+	# single child are merged with it. Must be called while holding the
+	# lock.
+	def _remove(self, channel):
+		path = list()
+		node = self._root
+		pos = 0
+		while pos < len(channel):
+			child = node.children.get(channel[pos])
+			if child is None or not channel.startswith(child.label, pos):
+				return False
+			path.append((node, child))
+			pos += len(child.label)
+			node = child
+		if not node.terminal:
+			return False
+		node.terminal = False
+		self._root.count -= 1
+		for parent, child in path:
+			child.count -= 1
+		for parent, child in reversed(path):
+			if child.count == 0:
+				del parent.children[child.label[0]]
+			elif not child.terminal and len(child.children) == 1:
+				only = list(child.children.values())[0]
+				only.label = child.label + only.label
+				parent.children[only.label[0]] = only
+		return True
+
+	# An internal method for finding the node of the specified channel.
+	# Returns None if there is no such node. Must be called while holding
+	# the lock.
+	def _find(self, channel):
+		node = self._root
+		pos = 0
+		while pos < len(channel):
+			child = node.children.get(channel[pos])
+			if child is None or not channel.startswith(child.label, pos):
+				return None
+			pos += len(child.label)
+			node = child
+		return node
+
+	# An internal method for finding the node whose subtree holds the
+	# channels that start with the specified prefix. Returns a tuple of the
+	# node and the channel name leading to it, or (None, None) if no channel
+	# starts with the prefix. Must be called while holding the lock.
+	def _find_prefix(self, prefix):
+		node = self._root
+		if not prefix:
+			return (node, self._get_empty())
+		path = prefix[:0]
+		pos = 0
+		while pos < len(prefix):
+			child = node.children.get(prefix[pos])
+			if child is None:
+				return (None, None)
+			label = child.label
+			if prefix.startswith(label, pos):
+				pos += len(label)
+			elif not label.startswith(prefix[pos:]):
+				return (None, None)
+			else:
+				pos = len(prefix)
+			path += label
+			node = child
+		return (node, path)
+
+	# An internal method for getting an empty channel name of the type of
+	# the indexed channels. Must be called while holding the lock.
+	def _get_empty(self):
+		for child in self._root.children.values():
+			return child.label[:0]
+		return ''
+
+	# An internal method for appending the channels at and below the
+	# specified node, whose channel name is the specified path, to the
+	# specified list in sorted order.
+	@staticmethod
+	def _collect(node, path, out):
+		stack = [(node, path)]
+		while stack:
+			node, path = stack.pop()
+			if node.terminal:
+				out.append(path)
+			for key in sorted(node.children, reverse=True):
+				child = node.children[key]
+				stack.append((child, path + child.label))
@@ -0,0 +1,105 @@
+#    hashring.py
+#    ~~~~~~~~~
+#    This module implements the HashRing class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import hashlib
+import struct
+import threading
+from bisect import bisect
+from .utilities import _ensure_utf8
+
+# An internal method for hashing the specified string into a 64-bit integer.
+def _hash(value):
+	return struct.unpack('>Q', hashlib.md5(_ensure_utf8(value)).digest()[:8])[0]
+
+# The HashRing class assigns channels to nodes using consistent hashing.
+# Each node is placed on the ring at a number of points proportional to its
+# weight, and a channel belongs to the first node found clockwise from the
+# hash of the channel. Adding or removing a node only moves the channels
+# that belong to the points of that node. The points of a node are derived
+# from its key, so a node given the same key is placed at the same points
+# across processes and restarts. Nodes can be looked up from any thread
+# while the ring is being changed.
+class HashRing(object):
+
+	# Initialize with the number of points to place on the ring per unit of
+	# node weight.
+	def __init__(self, points_per_weight=160):
+		self.points_per_weight = points_per_weight
+		self._lock = threading.Lock()
+		self._nodes = dict()
+		# the sorted hashes of the points on the ring and the nodes they
+		# belong to, replaced as a whole so that readers see one snapshot
+		self._points = ([], [], 0)
+
+	# Add the specified node to the ring using the specified key and weight.
+	# If the node is already in the ring then its key and weight are updated.
+	def add(self, node, key, weight=1):
+		if weight <= 0:
+			raise ValueError('weight must be greater than 0')
+		self._lock.acquire()
+		try:
+			nodes = dict(self._nodes)
+			nodes[node] = (key, weight)
+			self._rebuild(nodes)
+		finally:
+			self._lock.release()
+
+	# Remove the specified node from the ring if it is present.
+	def remove(self, node):
+		self._lock.acquire()
+		try:
+			if node in self._nodes:
+				nodes = dict(self._nodes)
+				del nodes[node]
+				self._rebuild(nodes)
+		finally:
+			self._lock.release()
+
+	# Remove all nodes from the ring.
+	def clear(self):
+		self._lock.acquire()
+		try:
+			self._rebuild(dict())
+		finally:
+			self._lock.release()
+
+	# Return a list of up to count distinct nodes that own the specified
+	# channel, starting with the primary owner.
+	def get_nodes(self, channel, count=1):
+		hashes, hash_nodes, node_count = self._points
+		if not hash_nodes:
+			return []
+		count = min(count, node_count)
+		out = list()
+		start = bisect(hashes, _hash(channel))
+		for n in range(0, len(hash_nodes)):
+			node = hash_nodes[(start + n) % len(hash_nodes)]
+			if node not in out:
+				out.append(node)
+				if len(out) == count:
+					break
+		return out
+
+	def __len__(self):
+		return len(self._nodes)
+
+	def __contains__(self, node):
+		return node in self._nodes
+
+	# An internal method for replacing the nodes with the specified dict and
+	# rebuilding the sorted list of points on the ring. Must be called while
+	# holding the lock.
+	def _rebuild(self, nodes):
+		points = list()
+		for node, (key, weight) in nodes.items():
+			count = max(1, int(round(self.points_per_weight * weight)))
+			for n in range(0, count):
+				points.append((_hash('%s-%d' % (key, n)), key, node))
+		points.sort(key=lambda p: (p[0], p[1]))
+		self._points = ([p[0] for p in points], [p[2] for p in points],
+				len(nodes))
+		self._nodes = nodes
@@ -5,8 +5,10 @@
 #    :copyright: (c) 2015 by Fanout, Inc.
 #    :license: MIT, see LICENSE for more details.
 
+import threading
 from .format import Format
-from .utilities import _ensure_utf8, _ensure_unicode
+from .utilities import _ensure_utf8, _ensure_unicode, _json_dumps_utf8
+from . import tnetstringcodec
 
 # The Item class is a container used to contain one or more format
 # implementation instances where each implementation instance is of a
@@ -36,6 +38,17 @@ class Item(object):
 	# encoded at UTF8. Conversely, if the tnetstring parameter is set to
 	# false then all keys and values are encoded as unicode.
 	def export(self, formats_field=False, tnetstring=False):
+		out = self._export(formats_field)
+		if tnetstring:
+			out = _ensure_utf8(out)
+		else:
+			out = _ensure_unicode(out)
+		return out
+
+	# An internal method for serializing the item into a hash without
+	# normalizing the encoding of its keys and values. This is used when the
+	# serializer encodes text itself, such as the built-in tnetstring codec.
+	def _export(self, formats_field=False):
 		format_types = []
 		for format in self.formats:
 			if format.__class__.__name__ in format_types:
@@ -56,8 +69,61 @@ class Item(object):
 		else:
 			for f in self.formats:
 				out[f.name()] = f.export()
-		if tnetstring:
-			out = _ensure_utf8(out)
-		else:
-			out = _ensure_unicode(out)
 		return out
+
+	# An internal method for serializing the item along with the specified
+	# channel as UTF8 encoded JSON. This is the form published to HTTP
+	# endpoints.
+	def _export_json(self, channel):
+		out = self.export()
+		out['channel'] = channel
+		return _json_dumps_utf8(out)
+
+	# An internal method for serializing the item with its formats in their
+	# own 'formats' key as a tnetstring. This is the form published to ZMQ
+	# sockets. The channel is only included if specified.
+	def _export_tnetstring(self, channel=None):
+		out = self._export(True)
+		if channel is not None:
+			out[_ensure_utf8('channel')] = channel
+		return tnetstringcodec.dumps(out)
+
+# The PreparedItem class is used internally by PubControl for publishing a
+# single item to many clients. It wraps an Item and computes each of its
+# wire encodings (JSON for HTTP endpoints and tnetstring for ZMQ sockets)
+# at most once, no matter how many clients request it.
+class PreparedItem(Item):
+
+	# Initialize with the Item instance to wrap.
+	def __init__(self, item):
+		super(PreparedItem, self).__init__(item.formats, item.id,
+				item.prev_id, item.meta)
+		self.item = item
+		self._encodings = dict()
+		self._lock = threading.Lock()
+
+	def _export(self, formats_field=False):
+		return self.item._export(formats_field)
+
+	def _export_json(self, channel):
+		return self._get_encoding(('json', channel),
+				self.item._export_json, channel)
+
+	def _export_tnetstring(self, channel=None):
+		return self._get_encoding(('tnetstring', channel),
+				self.item._export_tnetstring, channel)
+
+	# An internal method for returning the cached encoding with the specified
+	# key or computing it with the specified method if it does not exist yet.
+	# The lock is held while computing so that concurrent clients wait for
+	# the first one rather than repeating the work.
+	def _get_encoding(self, key, method, channel):
+		self._lock.acquire()
+		try:
+			out = self._encodings.get(key)
+			if out is None:
+				out = method(channel)
+				self._encodings[key] = out
+			return out
+		finally:
+			self._lock.release()
@@ -0,0 +1,230 @@
+#    itemtemplate.py
+#    ~~~~~~~~~
+#    This module implements the ItemTemplate and TemplateItem classes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import re
+from .item import Item
+from .utilities import (_ensure_unicode, _json_dumps_utf8, is_python3,
+		collections)
+from . import tnetstringcodec
+
+if is_python3:
+	_string_types = (str, bytes)
+else:
+	_string_types = (basestring,)
+
+# The pattern used for locating field placeholders in the JSON produced
+# while compiling a template.
+_json_field_pattern = re.compile(r'"\\u0000field:(\d+)\\u0000"')
+
+# The ItemTemplate class is used for publishing many items that share the
+# same formats and metadata where only a few values change between publishes.
+# Values that change are marked with ItemTemplate.Field placeholders within
+# the data exported by the formats or within the metadata. The static parts
+# of the JSON and tnetstring encodings are compiled once when the template
+# is created, and the fill method then returns an Item whose encodings are
+# produced by splicing the encoded field values into those fragments.
+class ItemTemplate(object):
+
+	# The Field class marks a value that is provided when filling the
+	# template. The name identifies the value in the dict passed to fill.
+	class Field(object):
+		def __init__(self, name):
+			self.name = name
+
+	# Initialize with either a single Format implementation instance or an
+	# array of Format implementation instances and optional metadata. An
+	# error will be raised if more than one instance of the same type of
+	# Format implementation is specified.
+	def __init__(self, formats, meta={}):
+		item = Item(formats, meta=meta)
+		self.formats = item.formats
+		self.meta = meta
+		self._flat_tree = item._export()
+		self._formats_tree = item._export(True)
+		self.field_names = set()
+		ItemTemplate._collect_field_names(self._flat_tree, self.field_names)
+		self._compile_json()
+		self._tnetstring_children = ItemTemplate._compile_tnetstring_children(
+				self._formats_tree)
+
+	# Return an Item using this template where the fields dict contains a
+	# value for each field placeholder in the template. Optionally specify an
+	# ID and previous ID. An error will be raised if a field is missing or
+	# if an unknown field is specified.
+	def fill(self, fields, id=None, prev_id=None):
+		for name in self.field_names:
+			if name not in fields:
+				raise ValueError('missing template field: %s' % name)
+		if len(fields) != len(self.field_names):
+			for name in fields:
+				if name not in self.field_names:
+					raise ValueError('unknown template field: %s' % name)
+		return TemplateItem(self, fields, id, prev_id)
+
+	# An internal method for compiling the JSON encoding of the template into
+	# a list of static UTF8 encoded fragments with the field names that
+	# belong between each of them. The surrounding braces are left out so
+	# that the ID, previous ID and channel can be added around them.
+	def _compile_json(self):
+		names = list()
+		def placeholder(field):
+			names.append(field.name)
+			return u'\x00field:%d\x00' % (len(names) - 1)
+		tree = _ensure_unicode(ItemTemplate._substitute(self._flat_tree,
+				placeholder))
+		body = _json_dumps_utf8(tree).decode('utf-8')[1:-1]
+		parts = _json_field_pattern.split(body)
+		self._json_parts = [p.encode('utf-8') for p in parts[0::2]]
+		self._json_fields = [names[int(n)] for n in parts[1::2]]
+		self._json_has_body = len(body) > 0
+
+	# An internal method for compiling the entries of the specified dict into
+	# a list of tnetstring nodes. Subtrees that do not contain any fields are
+	# encoded in full. Subtrees containing fields become a tuple of the
+	# tnetstring type tag and the compiled nodes of their entries.
+	@staticmethod
+	def _compile_tnetstring_children(value):
+		children = list()
+		if isinstance(value, collections.Mapping):
+			entries = list()
+			for k, v in value.items():
+				entries.append(k)
+				entries.append(v)
+		else:
+			entries = value
+		for v in entries:
+			if isinstance(v, ItemTemplate.Field):
+				node = v
+			elif not ItemTemplate._has_fields(v):
+				node = tnetstringcodec.dumps(v)
+			elif isinstance(v, collections.Mapping):
+				node = (b'}', ItemTemplate._compile_tnetstring_children(v))
+			else:
+				node = (b']', ItemTemplate._compile_tnetstring_children(v))
+			if (isinstance(node, bytes) and children and
+					isinstance(children[-1], bytes)):
+				children[-1] += node
+			else:
+				children.append(node)
+		return children
+
+	# An internal method for determining if the specified value contains any
+	# field placeholders.
+	@staticmethod
+	def _has_fields(value):
+		if isinstance(value, ItemTemplate.Field):
+			return True
+		if isinstance(value, collections.Mapping):
+			for v in value.values():
+				if ItemTemplate._has_fields(v):
+					return True
+		elif (isinstance(value, collections.Iterable) and
+				not isinstance(value, _string_types)):
+			for v in value:
+				if ItemTemplate._has_fields(v):
+					return True
+		return False
+
+	# An internal method for collecting the names of all field placeholders
+	# in the specified value.
+	@staticmethod
+	def _collect_field_names(value, names):
+		ItemTemplate._substitute(value, lambda f: names.add(f.name))
+
+	# An internal method for copying the specified value while replacing
+	# each field placeholder with the result of the specified method.
+	@staticmethod
+	def _substitute(value, replace):
+		if isinstance(value, ItemTemplate.Field):
+			return replace(value)
+		if isinstance(value, collections.Mapping):
+			out = dict()
+			for k, v in value.items():
+				out[k] = ItemTemplate._substitute(v, replace)
+			return out
+		if (isinstance(value, collections.Iterable) and
+				not isinstance(value, _string_types)):
+			return type(value)(ItemTemplate._substitute(v, replace)
+					for v in value)
+		return value
+
+	# An internal method for rendering the specified compiled tnetstring
+	# nodes into the specified bytearray.
+	@staticmethod
+	def _render_tnetstring(children, values, buf):
+		for node in children:
+			if isinstance(node, bytes):
+				buf += node
+			elif isinstance(node, ItemTemplate.Field):
+				tnetstringcodec.dump_into(buf, values[node.name])
+			else:
+				start = len(buf)
+				ItemTemplate._render_tnetstring(node[1], values, buf)
+				buf[start:start] = str(len(buf) - start).encode('ascii') + b':'
+				buf += node[0]
+
+# The TemplateItem class is the Item returned by ItemTemplate.fill. It can be
+# used anywhere an Item can. Its JSON and tnetstring encodings are rendered
+# from the precompiled fragments of its template.
+class TemplateItem(Item):
+
+	def __init__(self, template, fields, id=None, prev_id=None):
+		super(TemplateItem, self).__init__(template.formats, id, prev_id,
+				template.meta)
+		self.template = template
+		self.fields = fields
+
+	def _export(self, formats_field=False):
+		out = dict()
+		if self.id:
+			out['id'] = self.id
+		if self.prev_id:
+			out['prev-id'] = self.prev_id
+		if formats_field:
+			tree = self.template._formats_tree
+		else:
+			tree = self.template._flat_tree
+		out.update(ItemTemplate._substitute(tree,
+				lambda f: self.fields[f.name]))
+		return out
+
+	def _export_json(self, channel):
+		template = self.template
+		parts = template._json_parts
+		segments = list()
+		if self.id:
+			segments.append(b'"id": ' + _json_dumps_utf8(
+					_ensure_unicode(self.id)))
+		if self.prev_id:
+			segments.append(b'"prev-id": ' + _json_dumps_utf8(
+					_ensure_unicode(self.prev_id)))
+		if template._json_has_body:
+			body = bytearray(parts[0])
+			for n, name in enumerate(template._json_fields):
+				body += _json_dumps_utf8(_ensure_unicode(self.fields[name]))
+				body += parts[n + 1]
+			segments.append(bytes(body))
+		segments.append(b'"channel": ' + _json_dumps_utf8(
+				_ensure_unicode(channel)))
+		return b'{' + b', '.join(segments) + b'}'
+
+	def _export_tnetstring(self, channel=None):
+		buf = bytearray()
+		if self.id:
+			tnetstringcodec.dump_into(buf, 'id')
+			tnetstringcodec.dump_into(buf, self.id)
+		if self.prev_id:
+			tnetstringcodec.dump_into(buf, 'prev-id')
+			tnetstringcodec.dump_into(buf, self.prev_id)
+		ItemTemplate._render_tnetstring(self.template._tnetstring_children,
+				self.fields, buf)
+		if channel is not None:
+			tnetstringcodec.dump_into(buf, 'channel')
+			tnetstringcodec.dump_into(buf, channel)
+		buf[0:0] = str(len(buf)).encode('ascii') + b':'
+		buf += b'}'
+		return bytes(buf)
@@ -0,0 +1,463 @@
+#    processpublisher.py
+#    ~~~~~~~~~
+#    This module implements the ProcessPublisher class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import atexit
+import json
+import struct
+import threading
+import weakref
+import zlib
+from .pcccbhandler import PubControlClientCallbackHandler
+from .utilities import _ensure_utf8
+
+# The record types written to a RingBuffer by ProcessPublisher.
+_RECORD_PUBLISH = b'p'
+_RECORD_FLUSH = b'f'
+_RECORD_STOP = b's'
+_RECORD_CONFIG = b'c'
+
+# Each record is preceded by its length and starts with its type, request
+# ID and the length of the channel name, followed by the channel name and
+# the JSON encoded item.
+_length_header = struct.Struct('>I')
+_record_header = struct.Struct('>cQI')
+
+# The set of open ProcessPublisher instances that are closed on exit. The
+# set only holds weak references so that instances that are no longer used
+# can still be garbage collected.
+_publishers = weakref.WeakSet()
+_publishers_lock = threading.Lock()
+_publishers_registered = False
+
+# An internal method for closing all open ProcessPublisher instances.
+def _close_publishers():
+	_publishers_lock.acquire()
+	publishers = list(_publishers)
+	_publishers_lock.release()
+	for publisher in publishers:
+		publisher.close()
+
+# An internal method for adding the specified ProcessPublisher instance to
+# the set of instances closed on exit. The exit hook is registered once, when
+# the first instance is added, which is after multiprocessing has been
+# imported so that the queued items are flushed before multiprocessing
+# terminates the worker processes at exit.
+def _add_publisher(publisher):
+	global _publishers_registered
+	_publishers_lock.acquire()
+	_publishers.add(publisher)
+	if not _publishers_registered:
+		atexit.register(_close_publishers)
+		_publishers_registered = True
+	_publishers_lock.release()
+
+# The RingBuffer class is used internally for passing records from a single
+# producer process to a single consumer process through shared memory. The
+# read and write positions are only updated while holding the lock, and a
+# side that has to wait for records or free space sleeps on a semaphore that
+# the other side only releases when it knows someone is waiting. This keeps
+# the common case to a single lock acquisition per call.
+class RingBuffer(object):
+
+	# Initialize with the capacity of the buffer in bytes.
+	def __init__(self, size):
+		import ctypes
+		context = _get_context()
+		self.size = size
+		self._buf = context.RawArray(ctypes.c_char, size)
+		self._head = context.RawValue(ctypes.c_ulonglong, 0)
+		self._tail = context.RawValue(ctypes.c_ulonglong, 0)
+		self._producer_waiting = context.RawValue(ctypes.c_int, 0)
+		self._consumer_waiting = context.RawValue(ctypes.c_int, 0)
+		self._lock = context.Lock()
+		self._space_available = context.Semaphore(0)
+		self._records_available = context.Semaphore(0)
+		self._view = None
+
+	# Append the specified record to the buffer, blocking until there is
+	# enough free space. An error is raised if the record can never fit.
+	# Optionally specify a method that returns whether the consumer is still
+	# running, in which case an error is raised rather than waiting forever
+	# for space that will never be freed.
+	def put(self, data, is_alive=None):
+		needed = _length_header.size + len(data)
+		if needed > self.size:
+			raise ValueError('record of %d bytes exceeds buffer size' % needed)
+		while True:
+			self._lock.acquire()
+			head = self._head.value
+			if self.size - (head - self._tail.value) >= needed:
+				break
+			self._producer_waiting.value = 1
+			self._lock.release()
+			if is_alive is None:
+				self._space_available.acquire()
+			elif not self._space_available.acquire(True, 0.5):
+				if not is_alive():
+					raise ValueError('ring buffer consumer exited')
+		self._write(head, _length_header.pack(len(data)))
+		self._write(head + _length_header.size, data)
+		self._head.value = head + needed
+		if self._consumer_waiting.value:
+			self._consumer_waiting.value = 0
+			self._records_available.release()
+		self._lock.release()
+
+	# Remove and return all of the records in the buffer as a list, blocking
+	# until at least one is available.
+	def get_all(self):
+		while True:
+			self._lock.acquire()
+			head = self._head.value
+			tail = self._tail.value
+			if head != tail:
+				break
+			self._consumer_waiting.value = 1
+			self._lock.release()
+			self._records_available.acquire()
+		data = self._read(tail, head - tail)
+		self._tail.value = head
+		if self._producer_waiting.value:
+			self._producer_waiting.value = 0
+			self._space_available.release()
+		self._lock.release()
+		out = list()
+		pos = 0
+		while pos < len(data):
+			length = _length_header.unpack_from(data, pos)[0]
+			pos += _length_header.size
+			out.append(data[pos:pos + length])
+			pos += length
+		return out
+
+	# The view of the shared memory is created in each process on first use
+	# since it cannot be passed to the worker processes.
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['_view'] = None
+		return state
+
+	# An internal method for getting a byte view of the shared memory.
+	# Copying through a memoryview is much faster than slicing the ctypes
+	# array directly, which is only done where memoryview cannot be cast.
+	def _get_view(self):
+		if self._view is None:
+			try:
+				self._view = memoryview(self._buf).cast('B')
+			except AttributeError:
+				self._view = self._buf
+		return self._view
+
+	# An internal method for copying the specified bytes into the buffer at
+	# the specified stream position, wrapping around the end if necessary.
+	def _write(self, pos, data):
+		view = self._get_view()
+		start = pos % self.size
+		first = min(len(data), self.size - start)
+		view[start:start + first] = data[:first]
+		if first < len(data):
+			view[0:len(data) - first] = data[first:]
+
+	# An internal method for copying the specified number of bytes out of
+	# the buffer at the specified stream position.
+	def _read(self, pos, length):
+		view = self._get_view()
+		start = pos % self.size
+		first = min(length, self.size - start)
+		data = bytes(view[start:start + first])
+		if first < length:
+			data += bytes(view[0:length - first])
+		return data
+
+# The ExportedItem class is used internally within the worker processes for
+# passing an item that was already serialized by the parent process to a
+# PubControlClient.
+class ExportedItem(object):
+	def __init__(self, data):
+		self.data = data
+
+	def _export_json(self, channel):
+		return self.data
+
+# The ProcessPublisher class publishes to one or more HTTP endpoints from a
+# pool of worker processes so that the HTTP requests do not compete with the
+# publishing process for the GIL. Items are serialized to JSON in the
+# publishing process and the resulting records are passed to the workers
+# through shared memory ring buffers, one per worker. Each channel is always
+# handled by the same worker so the publishing order within a channel is
+# preserved. Each worker owns a PubControlClient instance per endpoint and
+# reports the publishing results back to the publishing process, where the
+# callbacks are executed on a separate thread. A ProcessPublisher instance
+# can be added to a PubControl instance like any other client.
+class ProcessPublisher(object):
+
+	# Initialize with a list of configuration dicts, each containing a 'uri'
+	# key along with the optional 'iss' and 'key' authentication keys as
+	# accepted by PubControl.apply_config. Optionally specify the number of
+	# worker processes and the size of each worker's ring buffer in bytes.
+	def __init__(self, config, processes=2, buffer_size=4 * 1024 * 1024):
+		if processes < 1:
+			raise ValueError('processes must be at least 1')
+		context = _get_context()
+		self.config = config
+		self.closed = False
+		self._lock = threading.Lock()
+		self._pending = dict()
+		self._next_id = 1
+		self._results = context.Queue()
+		self._rings = list()
+		self._processes = list()
+		for n in range(0, processes):
+			ring = RingBuffer(buffer_size)
+			process = context.Process(target=_worker_main,
+					args=(config, ring, self._results))
+			process.daemon = True
+			process.start()
+			self._rings.append((threading.Lock(), ring, process))
+			self._processes.append(process)
+		self._results_thread = threading.Thread(target=self._results_worker)
+		self._results_thread.daemon = True
+		self._results_thread.start()
+		_add_publisher(self)
+
+	# Apply the specified list of configuration dicts in place of the current
+	# one without restarting the worker processes. Each worker keeps the
+	# clients of the endpoints that are still configured, along with their
+	# connections, closes the clients of the endpoints that were removed and
+	# creates clients for the new ones. The change takes effect in each
+	# worker after the items that were published before this call.
+	def reconfigure(self, config):
+		self._verify_not_closed()
+		data = _ensure_utf8(json.dumps(config))
+		for n in range(0, len(self._rings)):
+			self._send(_RECORD_CONFIG, b'', data, None, n)
+		self.config = config
+
+	# The publish method for publishing the specified item to the specified
+	# channel on all of the configured endpoints. The blocking parameter
+	# indicates whether the call should block until the worker process has
+	# published the item. The callback method is optional and will be passed
+	# the publishing results once they are reported by the worker process.
+	def publish(self, channel, item, blocking=False, callback=None):
+		self._verify_not_closed()
+		data = item._export_json(channel)
+		channel = _ensure_utf8(channel)
+		if blocking:
+			event = threading.Event()
+			result = list()
+			def done(success, message):
+				result.append((success, message))
+				event.set()
+			self._send(_RECORD_PUBLISH, channel, data, done)
+			if not self._wait(event):
+				raise ValueError('failed to publish: worker process exited')
+			if not result[0][0]:
+				raise ValueError(result[0][1])
+		else:
+			self._send(_RECORD_PUBLISH, channel, data, callback)
+
+	# This method is a blocking method that ensures that all of the items
+	# published so far have been sent by the worker processes.
+	def wait_all_sent(self):
+		if self.closed:
+			return
+		events = list()
+		for n in range(0, len(self._rings)):
+			event = threading.Event()
+			events.append(event)
+			self._send(_RECORD_FLUSH, b'', b'',
+					lambda success, message, e=event: e.set(), n)
+		for event in events:
+			self._wait(event)
+
+	# DEPRECATED: The finish method is now deprecated in favor of the more
+	# descriptive wait_all_sent() method.
+	def finish(self):
+		self.wait_all_sent()
+
+	# The close method is a blocking call that waits for all of the published
+	# items to be sent and stops the worker processes.
+	def close(self):
+		self._lock.acquire()
+		if self.closed:
+			self._lock.release()
+			return
+		self._lock.release()
+		self.wait_all_sent()
+		self._lock.acquire()
+		self.closed = True
+		self._lock.release()
+		for lock, ring, process in self._rings:
+			lock.acquire()
+			try:
+				ring.put(_record_header.pack(_RECORD_STOP, 0, 0),
+						process.is_alive)
+			except ValueError:
+				pass
+			finally:
+				lock.release()
+		for process in self._processes:
+			process.join()
+		self._results.put(None)
+		self._results_thread.join()
+		_publishers_lock.acquire()
+		_publishers.discard(self)
+		_publishers_lock.release()
+
+	# An internal method for writing a record to the ring buffer of the
+	# worker that handles the specified channel, or to the ring buffer at the
+	# specified index. If a callback is specified then it is registered to
+	# receive the result of the record.
+	def _send(self, record_type, channel, data, callback=None, index=None):
+		req_id = 0
+		if callback:
+			self._lock.acquire()
+			req_id = self._next_id
+			self._next_id += 1
+			self._pending[req_id] = callback
+			self._lock.release()
+		if index is None:
+			index = (zlib.crc32(channel) & 0xffffffff) % len(self._rings)
+		lock, ring, process = self._rings[index]
+		record = (_record_header.pack(record_type, req_id, len(channel)) +
+				channel + data)
+		lock.acquire()
+		try:
+			ring.put(record, process.is_alive)
+		except:
+			if req_id:
+				self._lock.acquire()
+				del self._pending[req_id]
+				self._lock.release()
+			raise
+		finally:
+			lock.release()
+
+	# An internal method for waiting until the specified event is set.
+	# Returns False without waiting further if any of the worker processes
+	# has exited.
+	def _wait(self, event):
+		while not event.wait(0.5):
+			for process in self._processes:
+				if not process.is_alive():
+					return False
+		return True
+
+	# An internal method that is meant to run as a separate thread and
+	# execute the callbacks of the results reported by the worker processes.
+	def _results_worker(self):
+		while True:
+			result = self._results.get()
+			if result is None:
+				break
+			req_id, success, message = result
+			self._lock.acquire()
+			callback = self._pending.pop(req_id, None)
+			self._lock.release()
+			if callback:
+				callback(success, message)
+
+	# An internal method for verifying that the ProcessPublisher instance
+	# has not been closed via the close() method. If it has then an error
+	# is raised.
+	def _verify_not_closed(self):
+		if self.closed:
+			raise ValueError('processpublisher instance is closed')
+
+# An internal method for getting the multiprocessing context used for the
+# worker processes. Worker processes are spawned rather than forked where
+# supported since forking a process that is already running publishing
+# threads can leave locks held by those threads locked in the child. The
+# multiprocessing package is only imported once worker processes are used.
+def _get_context():
+	import multiprocessing
+	try:
+		return multiprocessing.get_context('spawn')
+	except AttributeError:
+		return multiprocessing
+
+# An internal method for creating the PubControlClient instance described by
+# the specified configuration dict.
+def _create_client(entry):
+	from .pubcontrolclient import PubControlClient
+	claim = None
+	key = None
+	bearer = None
+	if 'key' in entry:
+		if 'iss' in entry:
+			claim = {'iss': entry['iss']}
+			key = entry['key']
+		else:
+			bearer = entry['key']
+	return PubControlClient(entry['uri'], claim, key, auth_bearer=bearer)
+
+# An internal method for getting a key identifying the client described by
+# the specified configuration dict.
+def _get_entry_key(entry):
+	return json.dumps(entry, sort_keys=True)
+
+# An internal method for creating the list of (key, PubControlClient) tuples
+# for the specified configuration. Clients in the specified list of current
+# tuples whose configuration is unchanged are reused and the others are
+# closed.
+def _create_clients(config, current=None):
+	available = dict()
+	for key, client in current or list():
+		available.setdefault(key, list()).append(client)
+	clients = list()
+	for entry in config:
+		key = _get_entry_key(entry)
+		if available.get(key):
+			clients.append((key, available[key].pop(0)))
+		else:
+			clients.append((key, _create_client(entry)))
+	for unused in available.values():
+		for client in unused:
+			client.close()
+	return clients
+
+# An internal method for creating a callback that reports the result of the
+# specified request ID to the publishing process.
+def _make_result_callback(results, req_id):
+	def callback(success, message):
+		results.put((req_id, success, message))
+	return callback
+
+# An internal method that is meant to run as the main method of a worker
+# process. Records are read from the ring buffer and published to each of
+# the configured endpoints until a stop record is received.
+def _worker_main(config, ring, results):
+	clients = _create_clients(config)
+	while True:
+		for record in ring.get_all():
+			record_type, req_id, channel_length = _record_header.unpack(
+					record[:_record_header.size])
+			if record_type == _RECORD_STOP:
+				for key, client in clients:
+					client.close()
+				return
+			start = _record_header.size
+			if record_type == _RECORD_CONFIG:
+				clients = _create_clients(json.loads(
+						record[start + channel_length:].decode('utf-8')), clients)
+				continue
+			callback = None
+			if req_id:
+				callback = _make_result_callback(results, req_id)
+			if record_type == _RECORD_FLUSH:
+				for key, client in clients:
+					client.wait_all_sent()
+				if callback:
+					callback(True, '')
+				continue
+			channel = record[start:start + channel_length]
+			item = ExportedItem(record[start + channel_length:])
+			if callback:
+				callback = PubControlClientCallbackHandler(len(clients),
+						callback).handler
+			for key, client in clients:
+				client.publish(channel, item, blocking=False, callback=callback)
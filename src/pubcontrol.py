@@ -8,20 +8,15 @@
 import threading
 import atexit
 from .pcccbhandler import PubControlClientCallbackHandler
+from .item import Item, PreparedItem
 from .pubcontrolclient import PubControlClient
 from .zmqpubcontrolclient import ZmqPubControlClient
-from .utilities import _ensure_utf8, _verify_zmq
+from .utilities import _ensure_utf8, _ensure_unicode, _verify_zmq, zmq
 from .zmqpubcontroller import ZmqPubController
-
-try:
-	import zmq
-except ImportError:
-	zmq = None
-
-try:
-	import tnetstring
-except ImportError:
-	tnetstring = None
+from .workerpool import get_shared_pool
+from .hashring import HashRing
+from .processpublisher import ProcessPublisher
+from .replicaclient import ReplicaPubControlClient
 
 # The global list of PubControl instances used to ensure that each instance
 # is properly closed on exit.
@@ -70,17 +65,26 @@ class PubControl(object):
 	# subscribed to or unsubscribed from. The callback accepts two parameters:
 	# the first parameter a string containing 'sub' or 'unsub' and the second
 	# parameter containing the channel name. Optionally specify a ZMQ context
-	# to use otherwise the global ZMQ context will be used.
+	# to use otherwise the global ZMQ context will be used. The global ZMQ
+	# context is only obtained once a ZMQ endpoint is actually configured.
+	# Optionally specify the asyncio event loop that HTTP endpoints requiring
+	# subscribers are monitored on, or True to use a loop shared by all
+	# monitors (see the PubControlClient class).
 	def __init__(self, config=None, sub_callback=None,
-			zmq_context=None):
+			zmq_context=None, sub_monitor_loop=None):
 		self._lock = threading.Lock()
 		self._sub_callback = sub_callback
+		self._sub_monitor_loop = sub_monitor_loop
 		self._zmq_pub_controller = None
 		self.clients = list()
 		self.closed = False
 		self._zmq_ctx = zmq_context
-		if zmq_context is None and zmq:
-			self._zmq_ctx = zmq.Context.instance()
+		self._ring = None
+		self._replicas = 1
+		self._subscribers = dict()
+		self._indexed_clients = set()
+		self._client_entries = dict()
+		self._client_weights = dict()
 		if config:
 			self.apply_config(config)
 		_lock.acquire()
@@ -92,13 +96,48 @@ class PubControl(object):
 		self._verify_not_closed()
 		for client in self.clients:
 			client.close()
+		self._remove_subscriptions(self.clients)
+		self._indexed_clients.clear()
+		self._client_entries = dict()
+		self._client_weights = dict()
 		self.clients = list()
+		if self._ring is not None:
+			self._ring.clear()
 
 	# Add the specified PubControlClient or ZmqPubControlClient instance to
-	# the list of clients.
-	def add_client(self, client):
+	# the list of clients. When consistent hash routing is enabled, either
+	# now or later, the client is added to the hash ring with the specified
+	# weight.
+	def add_client(self, client, weight=1):
 		self._verify_not_closed()
 		self.clients.append(client)
+		self._client_weights[client] = weight
+		if self._ring is not None:
+			self._ring.add(client, PubControl._get_client_key(client), weight)
+
+	# Enable consistent hash routing. Rather than broadcasting every publish
+	# to every client, each channel is assigned to the clients that own it on
+	# a hash ring and is only published to those. The replicas parameter is
+	# the number of distinct clients that each channel is published to. All
+	# existing clients are added to the ring with the weight they were added
+	# or configured with. Note that routing cannot be disabled once it has
+	# been enabled.
+	def enable_routing(self, replicas=1):
+		self._verify_not_closed()
+		if replicas < 1:
+			raise ValueError('replicas must be at least 1')
+		self._replicas = replicas
+		if self._ring is None:
+			ring = HashRing()
+			for client in self.clients:
+				key = PubControl._get_client_key(client)
+				weight = self._client_weights.get(client, 1)
+				entry = self._client_entries.get(client)
+				if entry is not None:
+					key = entry.get('shard_key', key)
+					weight = entry.get('weight', 1)
+				ring.add(client, key, weight)
+			self._ring = ring
 
 	# Apply the specified configuration to this PubControl instance. The
 	# configuration object can either be a dict or an array of dicts where
@@ -107,51 +146,97 @@ class PubControl(object):
 	# Specify a 'uri' dict key along with optional JWT authentication 'iss' and
 	# 'key' dict keys for a PubControlClient configuration. Specify a combination
 	# of 'zmq_uri', 'zmq_pub_uri', or 'zmq_push_uri' dict keys for a
-	# ZmqPubControlClient configuration.
-	def apply_config(self, config):
+	# ZmqPubControlClient configuration. Set the routing parameter to
+	# 'consistent-hash' to enable consistent hash routing (see the
+	# enable_routing method) with the specified number of replicas. When
+	# routing is enabled, each dict may include a 'weight' key controlling the
+	# share of channels assigned to the client (defaulting to 1) and a
+	# 'shard_key' key identifying its position on the hash ring (defaulting to
+	# its URI). Keeping the shard keys stable keeps channel assignments stable
+	# across restarts. Set the processes parameter to the number of worker
+	# processes that should publish to the HTTP endpoints on behalf of this
+	# process (see the ProcessPublisher class). HTTP endpoints that require
+	# subscribers are always published to from this process since their
+	# subscription information is needed here. Worker processes cannot be
+	# combined with routing. An entry with a 'replicas' key describes
+	# redundant HTTP endpoints of the same cluster, and each publish is sent
+	# to only one of them (see the ReplicaPubControlClient class). The value
+	# is a list of dicts with a 'uri' key and optional 'weight', 'iss' and
+	# 'key' keys, and the entry may specify a 'hedge_percentile' key. An
+	# HTTP entry that requires subscribers may specify a 'sub_state_file'
+	# key with the path of a file that its subscriptions are saved to (see
+	# the PubSubMonitor class).
+	def apply_config(self, config, routing=None, replicas=1, processes=None):
 		self._verify_not_closed()
+		if routing is not None:
+			if routing != 'consistent-hash':
+				raise ValueError('unsupported routing mode: %s' % routing)
+			self.enable_routing(replicas)
+		if processes and self._ring is not None:
+			raise ValueError('worker processes cannot be combined with routing')
 		if not isinstance(config, list):
 			config = [config]
-		clients = list()
-		try:
-			for entry in config:
-				client = None
-				require_subscribers = entry.get('require_subscribers', False)
-				if 'uri' in entry:
-					claim = None
-					key = None
-					bearer = None
-					if 'key' in entry:
-						if 'iss' in entry:
-							claim = {'iss': entry['iss']}
-							key = entry['key']
-						else:
-							bearer = entry['key']
-					handler = PubControl.SubCallbackHandler(self._client_sub_callback)
-					try:
-						handler.lock.acquire()
-						client = PubControlClient(entry['uri'],
-								claim, key, require_subscribers,
-								handler.handle, auth_bearer=bearer)
-						handler.client = client
-					finally:
-						handler.lock.release()
-				if ('zmq_uri' in entry or 'zmq_push_uri' in entry or
-						'zmq_pub_uri' in entry):
-					_verify_zmq()
-					client = ZmqPubControlClient(entry.get('zmq_uri'),
-							entry.get('zmq_push_uri'), entry.get('zmq_pub_uri'),
-							require_subscribers, True, None, self._zmq_ctx,
-							self._discovery_callback)
-					if not entry.get('zmq_uri') and entry.get('zmq_pub_uri') and require_subscribers:
-						self._connect_zmq_pub_uri(entry['zmq_pub_uri'])
-				if client:
-					clients.append(client)
-		except:
-			for client in clients:
-				client.close()
-			raise
-		self.clients.extend(clients)
+		for client, entry in self._create_clients(config, processes):
+			self._add_configured_client(client, entry)
+
+	# Apply the specified configuration in place of the configuration that
+	# is currently applied. The configuration is specified as with the
+	# apply_config method and is compared against the clients that were
+	# created from previously applied configurations. Clients whose
+	# configuration is unchanged are kept along with their connections and
+	# subscription information, clients that are no longer configured are
+	# closed, and clients are only created for new configuration entries.
+	# Changes to only the 'weight' or 'shard_key' of an entry are applied to
+	# the existing client. When worker processes are used, changes to the
+	# endpoints they publish to are applied without restarting them unless
+	# the number of processes changed. Clients added via the add_client
+	# method are not affected.
+	def reconfigure(self, config, processes=None):
+		self._verify_not_closed()
+		if processes and self._ring is not None:
+			raise ValueError('worker processes cannot be combined with routing')
+		if not isinstance(config, list):
+			config = [config]
+		available = dict()
+		for client in self.clients:
+			entry = self._client_entries.get(client)
+			if entry is not None:
+				available.setdefault(PubControl._get_entry_key(entry),
+						list()).append(client)
+		kept = list()
+		create = list()
+		process_entries = list()
+		for entry in config:
+			if PubControl._is_process_entry(entry, processes):
+				process_entries.append(entry)
+				continue
+			matches = available.get(PubControl._get_entry_key(entry))
+			if matches:
+				kept.append((matches.pop(0), entry))
+			else:
+				create.append(entry)
+		if process_entries:
+			entry = PubControl._make_process_entry(process_entries, processes)
+			publisher = self._take_process_publisher(available, processes)
+			if publisher is not None:
+				if publisher.config != process_entries:
+					publisher.reconfigure(process_entries)
+				kept.append((publisher, entry))
+			else:
+				create.extend(process_entries)
+		added = self._create_clients(create, processes)
+		removed = list()
+		for clients in available.values():
+			removed.extend(clients)
+		self._remove_clients(removed, [client for client, entry in added])
+		for client, entry in kept:
+			self._client_entries[client] = entry
+			if self._ring is not None:
+				self._ring.add(client, entry.get('shard_key',
+						PubControl._get_client_key(client)),
+						entry.get('weight', 1))
+		for client, entry in added:
+			self._add_configured_client(client, entry)
 
 	# The publish method for publishing the specified item to the specified
 	# channel on the configured endpoint. The blocking parameter indicates
@@ -159,18 +244,94 @@ class PubControl(object):
 	# is optional and will be passed the publishing results after publishing is
 	# complete. Note that a failure to publish in any of the configured
 	# client instances will result in a failure result being passed to the
-	# callback method along with the first encountered error message.
-	def publish(self, channel, item, blocking=False, callback=None):
+	# callback method along with the first encountered error message. When
+	# blocking, all of the clients are published to concurrently and an error
+	# is raised with the first encountered error message if any of them fail.
+	# The optional timeout parameter is the maximum number of seconds to wait
+	# for a blocking publish to complete across all clients. If every client
+	# requires subscribers and the channel has none then the item is dropped
+	# without being exported and a successful result is passed to the
+	# callback. Rather than an item, a method that takes no parameters and
+	# returns an item can be specified. It is only called if the item would
+	# be sent by at least one client and is called a single time regardless
+	# of the number of clients. If it raises an error then nothing is
+	# published and the error is passed to the callback, or raised if no
+	# callback was specified. The priority parameter is the name of the lane
+	# ('high', 'normal' or 'low') that asynchronous publishes are queued in by
+	# PubControlClient instances and is ignored by other client types.
+	def publish(self, channel, item, blocking=False, callback=None,
+			timeout=None, priority=None):
 		self._verify_not_closed()
-		cb = callback
-		if not blocking:
+		PubControl._verify_priority(priority)
+		clients = self._get_clients(channel)
+		if not self._would_send(channel, clients):
+			if callback:
+				callback(True, '')
+			return
+		try:
+			item = PubControl._build_item(item)
+		except Exception as e:
+			if callback:
+				callback(False, 'failed to build item: ' + str(e))
+				return
+			raise
+		item = self._prepare_item(item, len(clients))
+		if blocking:
+			self._publish_blocking([(client, channel, item)
+					for client in clients], timeout)
+		else:
+			cb = callback
 			if callback:
-				cb = PubControlClientCallbackHandler(len(self.clients),
+				cb = PubControlClientCallbackHandler(len(clients),
 						callback).handler
-		for client in self.clients:
-			client.publish(channel, item, blocking=blocking, callback=cb)
+			for client in clients:
+				PubControl._publish_async(client, channel, item, cb,
+						priority)
 		self._send_to_zmq(channel, item)
 
+	# The publish_many method for publishing a list of (channel, item) tuples.
+	# The blocking, callback, timeout and priority parameters behave as they
+	# do for the publish method, except that the callback is called a single time after
+	# all of the items have been published. Items may be specified as methods
+	# that return an item, as with the publish method. All of them are built
+	# before anything is published, so nothing is published if any of them
+	# raises an error.
+	def publish_many(self, items, blocking=False, callback=None,
+			timeout=None, priority=None):
+		self._verify_not_closed()
+		PubControl._verify_priority(priority)
+		targets = list()
+		prepared = list()
+		for channel, item in items:
+			clients = self._get_clients(channel)
+			if not self._would_send(channel, clients):
+				continue
+			try:
+				item = PubControl._build_item(item)
+			except Exception as e:
+				if callback:
+					callback(False, 'failed to build item: ' + str(e))
+					return
+				raise
+			item = self._prepare_item(item, len(clients))
+			prepared.append((channel, item))
+			for client in clients:
+				targets.append((client, channel, item))
+		if blocking:
+			self._publish_blocking(targets, timeout)
+		else:
+			cb = callback
+			if callback and not targets:
+				callback(True, '')
+			elif callback:
+				cb = PubControlClientCallbackHandler(len(targets),
+						callback).handler
+			for client, channel, item in targets:
+				PubControl._publish_async(client, channel, item, cb,
+						priority)
+		for channel, item in prepared:
+			self._send_to_zmq(channel, item)
+
 	# The close method is a blocking call that closes all ZMQ sockets and
 	# ensures that all PubControlClient async publishing is completed prior
 	# to returning and allowing the consumer to proceed. Note that the
@@ -218,6 +379,339 @@ class PubControl(object):
 				out[client] = ret
 		return out
 
+	# An internal method for creating the clients described by the specified
+	# list of configuration entries. Returns a list of (client, entry)
+	# tuples. If creating any of the clients fails then the clients that were
+	# already created are closed.
+	def _create_clients(self, config, processes=None):
+		clients = list()
+		process_entries = list()
+		try:
+			for entry in config:
+				client = None
+				require_subscribers = entry.get('require_subscribers', False)
+				if PubControl._is_process_entry(entry, processes):
+					process_entries.append(entry)
+				elif 'replicas' in entry:
+					client = PubControl._create_replica_client(entry)
+				elif 'uri' in entry:
+					claim, key, bearer = PubControl._get_entry_auth(entry)
+					handler = PubControl.SubCallbackHandler(self._client_sub_callback)
+					try:
+						handler.lock.acquire()
+						client = PubControlClient(entry['uri'],
+								claim, key, require_subscribers,
+								handler.handle, auth_bearer=bearer,
+								sub_monitor_loop=self._sub_monitor_loop,
+								sub_state_file=entry.get('sub_state_file'))
+						handler.client = client
+					finally:
+						handler.lock.release()
+				if ('zmq_uri' in entry or 'zmq_push_uri' in entry or
+						'zmq_pub_uri' in entry):
+					_verify_zmq()
+					if self._ring is None:
+						client = ZmqPubControlClient(entry.get('zmq_uri'),
+								entry.get('zmq_push_uri'), entry.get('zmq_pub_uri'),
+								require_subscribers, True, None,
+								self._get_zmq_context(), self._discovery_callback)
+						if (not entry.get('zmq_uri') and entry.get('zmq_pub_uri') and
+								require_subscribers):
+							self._connect_zmq_pub_uri(entry['zmq_pub_uri'])
+					else:
+						# the shared ZmqPubController publishes to every
+						# connected PUB socket, so when routing each client
+						# maintains its own
+						client = self._create_routed_zmq_client(entry,
+								require_subscribers)
+				if client:
+					clients.append((client, entry))
+			if process_entries:
+				clients.append((ProcessPublisher(process_entries, processes),
+						PubControl._make_process_entry(process_entries,
+						processes)))
+		except:
+			for client, entry in clients:
+				client.close()
+			raise
+		return clients
+
+	# An internal method for getting a tuple of the JWT claim, JWT key and
+	# bearer token from the authentication keys of the specified
+	# configuration entry.
+	@staticmethod
+	def _get_entry_auth(entry):
+		claim = None
+		key = None
+		bearer = None
+		if 'key' in entry:
+			if 'iss' in entry:
+				claim = {'iss': entry['iss']}
+				key = entry['key']
+			else:
+				bearer = entry['key']
+		return (claim, key, bearer)
+
+	# An internal method for creating a ReplicaPubControlClient from the
+	# specified configuration entry. Each replica dict contains a 'uri' key
+	# and optional 'weight', 'iss' and 'key' keys, where the authentication
+	# keys default to those of the entry itself.
+	@staticmethod
+	def _create_replica_client(entry):
+		if entry.get('require_subscribers', False):
+			raise ValueError('replicas cannot be combined with ' +
+					'require_subscribers')
+		clients = list()
+		weights = list()
+		try:
+			for replica in entry['replicas']:
+				auth = replica
+				if 'key' not in replica:
+					auth = entry
+				claim, key, bearer = PubControl._get_entry_auth(auth)
+				clients.append(PubControlClient(replica['uri'], claim, key,
+						auth_bearer=bearer))
+				weights.append(replica.get('weight', 1))
+			return ReplicaPubControlClient(clients, weights,
+					entry.get('hedge_percentile'))
+		except:
+			for client in clients:
+				client.close()
+			raise
+
+	# An internal method for adding a client created from the specified
+	# configuration entry.
+	def _add_configured_client(self, client, entry):
+		self.clients.append(client)
+		self._client_entries[client] = entry
+		if isinstance(client, PubControlClient) or (self._ring is not None
+				and entry.get('require_subscribers', False)):
+			self._indexed_clients.add(client)
+		if self._ring is not None:
+			self._ring.add(client, entry.get('shard_key',
+					PubControl._get_client_key(client)),
+					entry.get('weight', 1))
+
+	# An internal method for taking the ProcessPublisher with the specified
+	# number of processes out of the specified dict of the lists of clients
+	# available for reuse. Returns None if there is no such client.
+	def _take_process_publisher(self, available, processes):
+		for clients in available.values():
+			for client in clients:
+				if self._client_entries[client].get('processes') == processes:
+					clients.remove(client)
+					return client
+		return None
+
+	# An internal method for closing and removing the specified clients.
+	# Optionally specify a list of clients that were created but not added
+	# yet, whose PUB sockets are considered to still be in use.
+	def _remove_clients(self, clients, added=None):
+		if not clients:
+			return
+		for client in clients:
+			client.close()
+		remaining = [c for c in self.clients if c not in clients]
+		in_use = remaining + list(added or list())
+		for client in clients:
+			self._client_entries.pop(client, None)
+			self._client_weights.pop(client, None)
+			self._indexed_clients.discard(client)
+			if self._ring is not None:
+				self._ring.remove(client)
+			# PUB sockets of clients that are not routed are connected to by
+			# the shared ZmqPubController
+			pub_uri = getattr(client, 'pub_uri', None)
+			if (self._ring is None and pub_uri and
+					getattr(client, '_require_subscribers', False) and
+					not [c for c in in_use
+					if getattr(c, 'pub_uri', None) == pub_uri]):
+				self._disconnect_zmq_pub_uri(pub_uri)
+		self._remove_subscriptions(clients)
+		self.clients = remaining
+
+	# An internal method for determining if the specified configuration
+	# entry is published to by worker processes.
+	@staticmethod
+	def _is_process_entry(entry, processes):
+		return bool(processes and 'uri' in entry and
+				not entry.get('require_subscribers', False))
+
+	# An internal method for making the configuration entry that describes
+	# a ProcessPublisher.
+	@staticmethod
+	def _make_process_entry(entries, processes):
+		return {'processes': processes, 'entries': entries}
+
+	# An internal method for getting a hashable key identifying the client
+	# described by the specified configuration entry. The weight and shard
+	# key do not affect the client itself and are left out.
+	@staticmethod
+	def _get_entry_key(entry):
+		def freeze(value):
+			if isinstance(value, dict):
+				return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+			if isinstance(value, (list, tuple)):
+				return tuple(freeze(v) for v in value)
+			return value
+		return freeze(dict((k, v) for k, v in entry.items()
+				if k not in ('weight', 'shard_key')))
+
+	# An internal method for getting the list of clients that the specified
+	# channel should be published to. Unless routing is enabled this is every
+	# client.
+	def _get_clients(self, channel):
+		if self._ring is None:
+			return self.clients
+		return self._ring.get_nodes(channel, self._replicas)
+
+	# An internal method for determining if publishing to the specified
+	# channel would result in any of the specified clients or the
+	# ZmqPubController sending a message. This is the case unless every client
+	# only publishes to subscribed channels and no subscribers are known.
+	# Subscriptions are indexed by text, so byte string channels are decoded
+	# first; channels that are not valid UTF8 are always sent.
+	def _would_send(self, channel, clients):
+		if not clients:
+			return True
+		try:
+			channel = _ensure_unicode(channel)
+		except ValueError:
+			return True
+		if channel in self._subscribers:
+			return True
+		for client in clients:
+			if not self._is_dropping_client(client, channel):
+				return True
+		return False
+
+	# An internal method for determining if the specified client is known to
+	# drop messages published to the specified channel because the channel
+	# has no subscribers. Clients whose subscription events feed the
+	# subscriber index have already been accounted for by the caller.
+	def _is_dropping_client(self, client, channel):
+		indexed = client in self._indexed_clients
+		sub_monitor = getattr(client, 'sub_monitor', None)
+		if sub_monitor is not None:
+			if sub_monitor.is_closed():
+				return False
+			return indexed or not sub_monitor.is_channel_subscribed_to(channel)
+		if (isinstance(client, ZmqPubControlClient) and
+				client._require_subscribers and client._discovery_completed):
+			pub_controller = client._pub_controller
+			if pub_controller is None or indexed:
+				return True
+			return not pub_controller.is_channel_subscribed_to(channel)
+		return False
+
+	# An internal method for getting the default hash ring key of the
+	# specified client.
+	@staticmethod
+	def _get_client_key(client):
+		for attr in ('uri', 'push_uri', 'pub_uri'):
+			key = getattr(client, attr, None)
+			if key:
+				return key
+		return str(id(client))
+
+	# An internal method for creating a ZmqPubControlClient from the specified
+	# configuration entry that publishes to its own PUB socket rather than
+	# the shared ZmqPubController.
+	def _create_routed_zmq_client(self, entry, require_subscribers):
+		sub_callback = None
+		handler = None
+		if require_subscribers:
+			handler = PubControl.SubCallbackHandler(self._client_sub_callback)
+			sub_callback = handler.handle
+			handler.lock.acquire()
+		try:
+			client = ZmqPubControlClient(entry.get('zmq_uri'),
+					entry.get('zmq_push_uri'), entry.get('zmq_pub_uri'),
+					require_subscribers, False, sub_callback,
+					self._get_zmq_context())
+			if handler:
+				handler.client = client
+		finally:
+			if handler:
+				handler.lock.release()
+		return client
+
+	# An internal method for calling the specified item factory method. Items
+	# that are not factories are returned as-is.
+	@staticmethod
+	def _build_item(item):
+		if callable(item) and not isinstance(item, Item):
+			return item()
+		return item
+
+	# An internal method for wrapping the specified item so that each wire
+	# encoding is computed only once when it is published to more than one
+	# client (including the ZmqPubController).
+	def _prepare_item(self, item, num_clients):
+		consumers = num_clients
+		if self._zmq_pub_controller:
+			consumers += 1
+		if (consumers > 1 and isinstance(item, Item) and
+				not isinstance(item, PreparedItem)):
+			return PreparedItem(item)
+		return item
+
+	# An internal method for ensuring that the specified priority is one of
+	# the PubControlClient priority lanes.
+	@staticmethod
+	def _verify_priority(priority):
+		if (priority is not None and
+				priority not in PubControlClient.PRIORITIES):
+			raise ValueError('unknown priority: %s' % priority)
+
+	# An internal method for publishing the specified item asynchronously
+	# using the specified client. The priority is only passed to
+	# PubControlClient instances since the other client types do not queue
+	# their publishes.
+	@staticmethod
+	def _publish_async(client, channel, item, callback, priority):
+		if priority is not None and isinstance(client, PubControlClient):
+			client.publish(channel, item, blocking=False, callback=callback,
+					priority=priority)
+		else:
+			client.publish(channel, item, blocking=False, callback=callback)
+
+	# An internal method for publishing to the specified list of (client,
+	# channel, item) targets concurrently using the shared worker pool. A
+	# single target is published to directly on the calling thread. The
+	# per-target outcomes are gathered and an error is raised if any of them
+	# failed or did not complete within the timeout.
+	def _publish_blocking(self, targets, timeout=None):
+		if len(targets) == 1 and timeout is None:
+			client, channel, item = targets[0]
+			client.publish(channel, item, blocking=True)
+			return
+		funcs = list()
+		for client, channel, item in targets:
+			funcs.append(PubControl._make_blocking_publish(client, channel,
+					item))
+		results = get_shared_pool().run(funcs, timeout)
+		error = None
+		timed_out = 0
+		for result in results:
+			if result is None:
+				timed_out += 1
+			elif not result[0] and error is None:
+				error = result[1]
+		if error is not None:
+			raise ValueError(error)
+		if timed_out > 0:
+			raise ValueError('failed to publish: timed out waiting for ' +
+					'%d of %d clients' % (timed_out, len(targets)))
+
+	# An internal method for creating a method that publishes the specified
+	# item using the specified client in blocking mode.
+	@staticmethod
+	def _make_blocking_publish(client, channel, item):
+		def func():
+			client.publish(channel, item, blocking=True)
+		return func
+
 	# An internal method used as a callback for discovery within the ZMQ clients.
 	# If a PUB URI was discovered then it is connected to via the ZmqPubController.
 	def _discovery_callback(self, push_uri, pub_uri, require_subscribers):
@@ -231,10 +725,18 @@ class PubControl(object):
 		self._lock.acquire()
 		if self._zmq_pub_controller is None:
 			self._zmq_pub_controller = ZmqPubController(
-                    self._pub_controller_callback, self._zmq_ctx)
+                    self._pub_controller_callback, self._get_zmq_context())
 		self._zmq_pub_controller.connect(_ensure_utf8(uri))
 		self._lock.release()
 
+	# An internal method for getting the ZMQ context used by this instance.
+	# If no context was specified then the global ZMQ context is obtained on
+	# first use so that HTTP-only configurations never start ZMQ I/O threads.
+	def _get_zmq_context(self):
+		if self._zmq_ctx is None:
+			self._zmq_ctx = zmq.Context.instance()
+		return self._zmq_ctx
+
 	# An internal method for disconnecting from a ZMQ PUB URI.
 	def _disconnect_zmq_pub_uri(self, uri):
 		if self._zmq_pub_controller:
@@ -248,9 +750,8 @@ class PubControl(object):
 		self._lock.acquire()
 		if self._zmq_pub_controller:
 			channel = _ensure_utf8(channel)
-			content = item.export(True, True)
 			self._zmq_pub_controller.publish(channel,
-					tnetstring.dumps(content))
+					item._export_tnetstring())
 		self._lock.release()
 
 	# An internal method used as a callback for the ZmqPubController
@@ -259,46 +760,58 @@ class PubControl(object):
 		# use the ZmqPubController instance as the "client"
 		self._client_sub_callback(self._zmq_pub_controller, eventType, channel)
 
+	# Determine if the specified channel has subscribers across any of the
+	# clients or the ZmqPubController. The answer comes from an index that is
+	# updated as subscription events arrive, so it does not query the
+	# clients.
+	def is_channel_subscribed_to(self, channel):
+		return channel in self._subscribers
+
 	# An internal method for processing subscription callbacks from
 	# PubControlClient (and, indirectly, ZmqPubController). The purpose of
 	# this callback is to aggregate sub and unsub events. The consumer's
 	# sub_callback is executed when a channel is subscribed to for the first
 	# time across any clients or when a channel is unsubscribed from all
-	# clients.
-	# NOTE: this method assumes that PubControlClient and ZmqPubController
-	# will execute their callbacks before the change would be reflected
-	# in calls to their is_channel_subscribed_to() methods.
+	# clients. The set of clients subscribed to each channel is kept in an
+	# index so that each event is processed in constant time regardless of
+	# the number of clients.
 	def _client_sub_callback(self, client, eventType, channel):
 		do_callback = False
 		self._lock.acquire()
+		clients = self._subscribers.get(channel)
 		if eventType == 'sub':
-			# check if no clients were subscribed yet
-			if not self._is_subscribed(channel):
+			if clients is None:
+				self._subscribers[channel] = set([client])
 				do_callback = True
+			else:
+				clients.add(client)
 		elif eventType == 'unsub':
-			# check if this was the only client with a subscription:
-			if not self._is_subscribed(channel, skip_client=client):
-				do_callback = True
+			if clients is not None and client in clients:
+				clients.remove(client)
+				if not clients:
+					del self._subscribers[channel]
+					do_callback = True
 		self._lock.release()
 		if do_callback and self._sub_callback:
 			self._sub_callback(eventType, channel)
 
-	def _is_subscribed(self, channel, skip_client=None):
-		if (self._zmq_pub_controller and
-				(skip_client is None or
-				self._zmq_pub_controller != skip_client) and
-				self._zmq_pub_controller.is_channel_subscribed_to(channel)):
-			return True
-		for client in self.clients:
-			if skip_client is not None and client == skip_client:
-				continue
-			if (getattr(client, 'sub_monitor', None) and
-					client.sub_monitor.is_channel_subscribed_to(channel)):
-				return True
-			if (getattr(client, '_pub_controller', None) and
-					client._pub_controller.is_channel_subscribed_to(channel)):
-				return True
-		return False
+	# An internal method for removing the specified clients from the
+	# subscription index. Closed clients no longer report unsubscribes, so
+	# their subscriptions are dropped here and the consumer's sub_callback is
+	# executed for each channel that is left without subscribers.
+	def _remove_subscriptions(self, clients):
+		unsubscribed = list()
+		self._lock.acquire()
+		for channel in list(self._subscribers.keys()):
+			subscribers = self._subscribers[channel]
+			subscribers.difference_update(clients)
+			if not subscribers:
+				del self._subscribers[channel]
+				unsubscribed.append(channel)
+		self._lock.release()
+		if self._sub_callback:
+			for channel in unsubscribed:
+				self._sub_callback('unsub', channel)
 
 	# An internal method for verifying that the PubControl instance has
 	# not been closed via the close() method. If it has then an error
@@ -5,16 +5,14 @@
 #    :copyright: (c) 2015 by Fanout, Inc.
 #    :license: MIT, see LICENSE for more details.
 
-import json
 import copy
+import time
 from base64 import b64encode
 import threading
 from collections import deque
-import requests
-from requests.packages.urllib3.util import Retry
-from requests.adapters import HTTPAdapter
-from .pubsubmonitor import PubSubMonitor
-from .utilities import _gen_auth_jwt_header
+from .sharedpubsubmonitor import SharedPubSubMonitor
+from .ratelimiter import RateLimiter
+from .utilities import _gen_auth_jwt_header, requests
 
 # The PubControlClient class allows consumers to publish either synchronously
 # or asynchronously to an endpoint of their choice. The consumer wraps a Format
@@ -24,17 +22,38 @@ from .utilities import _gen_auth_jwt_header
 # result. Optionally provide JWT authentication claim and key information.
 # If require_subscribers is set to True then channel subscription monitoring
 # will be enabled and only channels that are subscribed to will be published
-# to.
+# to. Instances that monitor the same endpoint with the same credentials
+# share a single monitor (see the SharedPubSubMonitor class). Optionally
+# provide a sub_batch_callback that is passed lists of subscription events
+# (see the PubSubMonitor class). Set sub_monitor_loop to an asyncio event
+# loop, or to True for a loop shared by all monitors, to monitor
+# subscriptions on an event loop instead of separate threads (see the
+# AsyncPubSubMonitor class). Set sub_state_file to the path of a file that
+# the subscriptions are saved to so that a restarted process resumes
+# monitoring where it left off (see the PubSubMonitor class).
 class PubControlClient(object):
 
+	# The priority lanes of asynchronous publish requests in the order in
+	# which they are drained when strict draining is used.
+	PRIORITIES = ('high', 'normal', 'low')
+
 	# Initialize this class with a URL representing the publishing endpoint.
 	def __init__(self, uri, auth_jwt_claim=None,
-			auth_jwt_key=None, require_subscribers=False, sub_callback=None, auth_bearer=None):
+			auth_jwt_key=None, require_subscribers=False, sub_callback=None, auth_bearer=None,
+			sub_batch_callback=None, sub_monitor_loop=None, sub_state_file=None):
 		self.uri = uri
 		self.lock = threading.Lock()
 		self.thread = None
 		self.thread_cond = None
 		self.req_queue = deque()
+		self._lanes = {'high': deque(), 'normal': self.req_queue,
+				'low': deque()}
+		self._lane_weights = None
+		self._batch_size = 10
+		self._lane_stats = dict((p, [0, 0.0, 0.0])
+				for p in PubControlClient.PRIORITIES)
+		self._lane_stats_lock = threading.Lock()
+		self._rate_limiter = None
 		self.auth_basic_user = None
 		self.auth_basic_pass = None
 		self.auth_jwt_claim = auth_jwt_claim
@@ -43,6 +62,11 @@ class PubControlClient(object):
 		self.sub_monitor = None
 		self.closed = False
 
+		# imported here so that requests is only loaded once an HTTP
+		# client is actually created
+		from requests.packages.urllib3.util import Retry
+		from requests.adapters import HTTPAdapter
+
 		retry = Retry(
 			total=1,
 			backoff_factor=0.5,
@@ -57,7 +81,8 @@ class PubControlClient(object):
 		self.requests_session.mount('https://', adapter)
 
 		if require_subscribers:
-			self.sub_monitor = PubSubMonitor(uri, auth_jwt_claim, auth_jwt_key, sub_callback, auth_bearer)
+			self.sub_monitor = SharedPubSubMonitor(uri, auth_jwt_claim, auth_jwt_key, sub_callback,
+					auth_bearer, sub_batch_callback, sub_monitor_loop, sub_state_file)
 
 	# Call this method and pass a username and password to use basic
 	# authentication with the configured endpoint.
@@ -85,6 +110,76 @@ class PubControlClient(object):
 		self.auth_jwt_key = key
 		self.lock.release()
 
+	# Call this method to configure how asynchronous publish requests are
+	# taken from the priority lanes when building each batch. By default the
+	# lanes are drained strictly in priority order. Specify a dict of lane
+	# weights (for example {'high': 6, 'normal': 3, 'low': 1}) to instead
+	# reserve a share of each batch for each lane with pending requests,
+	# which keeps the lower priority lanes from being starved. Any part of a
+	# batch left unused by a lane is filled in priority order. The batch_size
+	# parameter is the maximum number of items published per HTTP request.
+	def set_priority_draining(self, weights=None, batch_size=10):
+		if weights is not None:
+			for lane, weight in weights.items():
+				if lane not in self._lanes:
+					raise ValueError('unknown priority: %s' % lane)
+				if weight < 0:
+					raise ValueError('priority weights must not be negative')
+		if batch_size < 1:
+			raise ValueError('batch_size must be at least 1')
+		self.lock.acquire()
+		self._lane_weights = weights
+		self._batch_size = batch_size
+		self.lock.release()
+
+	# Get the latency statistics of the asynchronous publish requests that
+	# were sent from each priority lane. Returns a dict of lane name to a
+	# dict with the 'count' of requests sent along with the 'avg_latency' and
+	# 'max_latency' in seconds from queuing a request until it was sent. If
+	# reset is set to True then the statistics are cleared.
+	def get_lane_stats(self, reset=False):
+		out = dict()
+		self._lane_stats_lock.acquire()
+		for lane, (count, total, maximum) in self._lane_stats.items():
+			out[lane] = {'count': count,
+					'avg_latency': total / count if count else 0.0,
+					'max_latency': maximum}
+			if reset:
+				self._lane_stats[lane] = [0, 0.0, 0.0]
+		self._lane_stats_lock.release()
+		return out
+
+	# Call this method to limit the rate at which items are published to the
+	# configured endpoint. Specify the maximum number of items and/or bytes
+	# per second, along with an optional dict of channel to maximum items per
+	# second for individual channels. Bursts of up to the specified number of
+	# seconds worth of traffic are sent without delay. Publishes that exceed
+	# a limit are delayed rather than rejected: asynchronous publishes are
+	# held back by the worker thread, and the items queued before a delayed
+	# item are sent first, while blocking publishes wait before being sent.
+	# Call this method without any limits to remove them.
+	def set_rate_limit(self, items_per_second=None, bytes_per_second=None,
+			channel_limits=None, burst=1.0):
+		limiter = None
+		if (items_per_second is not None or bytes_per_second is not None or
+				channel_limits):
+			limiter = RateLimiter(items_per_second, bytes_per_second,
+					channel_limits, burst)
+		self.lock.acquire()
+		self._rate_limiter = limiter
+		self.lock.release()
+
+	# Get the statistics of the configured rate limit as a dict with the
+	# number of 'items' and 'bytes' published, how many of them were delayed
+	# ('delayed_items' and 'delayed_bytes') and the 'total_delay' and
+	# 'max_delay' in seconds. Returns None if no rate limit is configured. If
+	# reset is set to True then the statistics are cleared.
+	def get_rate_limit_stats(self, reset=False):
+		limiter = self._rate_limiter
+		if limiter is None:
+			return None
+		return limiter.get_stats(reset)
+
 	# The publish method for publishing the specified item to the specified
 	# channel on the configured endpoint. The blocking parameter indicates
 	# whether the the callback method should be blocking or non-blocking. The
@@ -93,9 +188,14 @@ class PubControlClient(object):
 	# separate thread. If require_subscribers was set to True then the message
 	# will only be published if the channel is subscribed to. If the sub_monitor
 	# instance failed to retrieve subscriber information then an error will be
-	# raised.
-	def publish(self, channel, item, blocking=False, callback=None):
+	# raised. The priority parameter is the name of the lane ('high',
+	# 'normal' or 'low') that an asynchronous publish is queued in, defaulting
+	# to 'normal'.
+	def publish(self, channel, item, blocking=False, callback=None,
+			priority=None):
 		self._verify_notclosed()
+		if priority is not None and priority not in self._lanes:
+			raise ValueError('unknown priority: %s' % priority)
 		if self.sub_monitor and self.sub_monitor.is_closed():
 			if callback:
 				callback(False, 'failed to retrieve channel subscribers')
@@ -105,13 +205,15 @@ class PubControlClient(object):
 			if callback:
 				callback(True, '')
 			return
-		i = item.export()
-		i['channel'] = channel
+		i = item._export_json(channel)
 		if blocking:
 			self.lock.acquire()
 			uri = self.uri
 			auth = self._gen_auth_header()
+			limiter = self._rate_limiter
 			self.lock.release()
+			if limiter is not None:
+				PubControlClient._sleep_until(limiter.reserve(channel, len(i)))
 			self._pubcall(uri, auth, [i])
 		else:
 			self.lock.acquire()
@@ -119,7 +221,8 @@ class PubControlClient(object):
 			auth = self._gen_auth_header()
 			self._ensure_thread()
 			self.lock.release()
-			self._queue_req(('pub', uri, auth, i, callback))
+			self._queue_req(('pub', uri, auth, i, callback, priority,
+					time.time(), channel))
 
 	# This method is a blocking method that ensures that all asynchronous
 	# publishing is complete prior to returning and allowing the consumer to
@@ -198,18 +301,23 @@ class PubControlClient(object):
 			self.thread.start()
 
 	# An internal method for adding an asynchronous publish request to the
-	# publishing queue. This method will also activate the pubworker worker
-	# thread to make sure that it process any and all requests added to
-	# the queue.
+	# publishing queue of its priority lane. This method will also activate
+	# the pubworker worker thread to make sure that it process any and all
+	# requests added to the queue. Requests without a priority, including
+	# the 'stop' command, are added to the normal lane.
 	def _queue_req(self, req):
+		lane = self.req_queue
+		if len(req) > 5 and req[5] is not None:
+			lane = self._lanes[req[5]]
 		self.thread_cond.acquire()
-		self.req_queue.append(req)
+		lane.append(req)
 		self.thread_cond.notify()
 		self.thread_cond.release()
 
 	# An internal method for preparing the HTTP POST request for publishing
 	# data to the endpoint. This method accepts the URI endpoint, authorization
-	# header, and a list of items to publish.
+	# header, and a list of items to publish where each item has already been
+	# serialized as UTF8 encoded JSON.
 	def _pubcall(self, uri, auth_header, items):
 		uri = uri + '/publish/'
 
@@ -218,16 +326,7 @@ class PubControlClient(object):
 			headers['Authorization'] = auth_header
 		headers['Content-Type'] = 'application/json'
 
-		content = dict()
-		content['items'] = items
-		content_raw = json.dumps(content)
-
-		try:
-			if isinstance(content_raw, unicode):
-				content_raw = content_raw.encode('utf-8')
-		except NameError:
-			if isinstance(content_raw, str):
-				content_raw = content_raw.encode('utf-8')
+		content_raw = b'{"items": [' + b', '.join(items) + b']}'
 
 		try:
 			self._make_http_request(uri, content_raw, headers)
@@ -279,32 +378,123 @@ class PubControlClient(object):
 
 	# An internal method that is meant to run as a separate thread and process
 	# asynchronous publishing requests. The method runs continously and
-	# publishes requests in batches containing a maximum of 10 requests. The
-	# method completes and the thread is terminated only when a 'stop' command
-	# is provided in the request queue.
+	# publishes requests in batches taken from the priority lanes (see the
+	# set_priority_draining method). The method completes and the thread is
+	# terminated only when a 'stop' command is provided in the request queue.
+	# The requests queued in the normal lane after the 'stop' command are
+	# left for the next worker thread while the other lanes are emptied before
+	# terminating.
 	def _pubworker(self):
-		quit = False
-		while not quit:
+		stopping = False
+		while True:
 			self.thread_cond.acquire()
 
-			# if no requests ready, wait for one
-			if len(self.req_queue) == 0:
+			if not self._has_pending_reqs(stopping):
+				if stopping:
+					self.thread_cond.release()
+					break
+
+				# if no requests ready, wait for one
 				self.thread_cond.wait()
 
 				# still no requests after notification? start over
-				if len(self.req_queue) == 0:
+				if not self._has_pending_reqs(stopping):
 					self.thread_cond.release()
 					continue
 
-			reqs = list()
-			while len(self.req_queue) > 0 and len(reqs) < 10:
-				m = self.req_queue.popleft()
-				if m[0] == 'stop':
-					quit = True
-					break
-				reqs.append((m[1], m[2], m[3], m[4]))
+			batch, stopping = self._take_batch(stopping)
 
 			self.thread_cond.release()
 
-			if len(reqs) > 0:
-				self._pubbatch(reqs)
+			if len(batch) > 0:
+				self._pubbatch_limited(batch)
+
+	# An internal method for publishing the specified batch of (lane,
+	# request) tuples while honoring the configured rate limit. The batch is
+	# split before each item that has to be delayed so that the items ahead
+	# of it are not held back.
+	def _pubbatch_limited(self, batch):
+		limiter = self._rate_limiter
+		segment = list()
+		for entry in batch:
+			m = entry[1]
+			if limiter is not None and len(m) > 7:
+				ready = limiter.reserve(m[7], len(m[3]))
+				if ready > time.time() and len(segment) > 0:
+					self._pubsegment(segment)
+					segment = list()
+				PubControlClient._sleep_until(ready)
+			segment.append(entry)
+		if len(segment) > 0:
+			self._pubsegment(segment)
+
+	# An internal method for publishing the specified list of (lane, request)
+	# tuples in a single batch and recording their latency.
+	def _pubsegment(self, segment):
+		self._pubbatch([(m[1], m[2], m[3], m[4]) for lane, m in segment])
+		self._record_latency(segment)
+
+	# An internal method for sleeping until the specified time.
+	@staticmethod
+	def _sleep_until(ready):
+		delay = ready - time.time()
+		if delay > 0:
+			time.sleep(delay)
+
+	# An internal method for determining if any of the priority lanes have
+	# requests. The normal lane is skipped once the 'stop' command was taken
+	# from it.
+	def _has_pending_reqs(self, stopping):
+		for queue in self._lanes.values():
+			if len(queue) > 0 and not (stopping and queue is self.req_queue):
+				return True
+		return False
+
+	# An internal method for taking the next batch of requests from the
+	# priority lanes. Returns a tuple of the list of (lane, request) tuples
+	# and whether the 'stop' command has been taken.
+	def _take_batch(self, stopping):
+		weights = self._lane_weights
+		batch_size = self._batch_size
+		quotas = dict()
+		if weights:
+			pending = [p for p in PubControlClient.PRIORITIES
+					if len(self._lanes[p]) > 0 and weights.get(p, 0) > 0]
+			total = sum(weights[p] for p in pending)
+			for p in pending:
+				quotas[p] = max(1, batch_size * weights[p] // total)
+		batch = list()
+		# the quotas are taken first and the rest of the batch is then
+		# filled in priority order
+		for use_quotas in (True, False):
+			for p in PubControlClient.PRIORITIES:
+				queue = self._lanes[p]
+				taken = 0
+				while (len(queue) > 0 and len(batch) < batch_size and
+						not (stopping and queue is self.req_queue)):
+					if use_quotas and taken >= quotas.get(p, 0):
+						break
+					m = queue.popleft()
+					if m[0] == 'stop':
+						stopping = True
+						break
+					batch.append((p, m))
+					taken += 1
+		return (batch, stopping)
+
+	# An internal method for adding the time that the requests in the
+	# specified batch spent queued to the latency statistics of their lanes.
+	# A separate lock is used since wait_all_sent holds the main lock while
+	# waiting for the worker thread to exit.
+	def _record_latency(self, batch):
+		now = time.time()
+		self._lane_stats_lock.acquire()
+		for lane, m in batch:
+			if len(m) > 6:
+				stats = self._lane_stats[lane]
+				latency = now - m[6]
+				stats[0] += 1
+				stats[1] += latency
+				if latency > stats[2]:
+					stats[2] = latency
+		self._lane_stats_lock.release()
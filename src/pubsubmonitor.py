@@ -5,18 +5,20 @@
 #    :copyright: (c) 2015 by Fanout, Inc.
 #    :license: MIT, see LICENSE for more details.
 
-import requests
 import threading
 import json
 import copy
 import urllib
 import time
+import os
 import socket
 import logging
 from base64 import b64decode
 from ssl import SSLError
-from .utilities import _gen_auth_jwt_header, _ensure_unicode
-from requests.exceptions import ConnectionError
+from .channelindex import ChannelIndex
+from .reconnectscheduler import ReconnectScheduler
+from .utilities import (_gen_auth_jwt_header, _ensure_unicode,
+		_apply_subscription_events, requests)
 
 logger = logging.getLogger(__name__)
 
@@ -25,50 +27,211 @@ try:
 except:
 	from httplib import IncompleteRead
 
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+# The _LineSplitter class is used internally for splitting a byte stream
+# into lines as data arrives. Lines are terminated by LF, optionally preceded
+# by CR, and are returned without their terminators.
+class _LineSplitter(object):
+	def __init__(self):
+		self._pending = b''
+
+	# Add the specified data and return the list of lines it completed.
+	def feed(self, data):
+		if self._pending:
+			data = self._pending + data
+		lines = data.split(b'\n')
+		self._pending = lines.pop()
+		for n, line in enumerate(lines):
+			if line[-1:] == b'\r':
+				lines[n] = line[:-1]
+		return lines
+
+	# Return the list containing the unterminated line at the end of the
+	# stream, if any.
+	def flush(self):
+		pending = self._pending
+		self._pending = b''
+		if pending[-1:] == b'\r':
+			pending = pending[:-1]
+		if pending:
+			return [pending]
+		return []
+
+# An internal method for iterating over the lines of the specified streaming
+# requests response in batches. Whatever data is available is read at once,
+# up to the specified chunk size, and the lines it completed are delivered
+# together as a list, so each line is delivered as soon as it arrives
+# without reading the stream a byte at a time. Errors are raised as the
+# same requests exceptions as the iter_lines method raises. Where the
+# response cannot read partial data (urllib3 1.x), iter_lines is used and
+# each batch is a single line.
+def _iter_stream_line_batches(response, chunk_size=65536):
+	read1 = getattr(response.raw, 'read1', None)
+	if read1 is None:
+		for line in response.iter_lines(chunk_size=1):
+			yield [line]
+		return
+	from requests.packages.urllib3.exceptions import (ProtocolError,
+			DecodeError, ReadTimeoutError)
+	splitter = _LineSplitter()
+	while True:
+		try:
+			data = read1(chunk_size)
+		except ProtocolError as e:
+			raise requests.exceptions.ChunkedEncodingError(e)
+		except DecodeError as e:
+			raise requests.exceptions.ContentDecodingError(e)
+		except ReadTimeoutError as e:
+			raise requests.exceptions.ConnectionError(e)
+		if not data:
+			break
+		lines = splitter.feed(data)
+		if lines:
+			yield lines
+	lines = splitter.flush()
+	if lines:
+		yield lines
+
+# An internal method for iterating over the lines of the specified streaming
+# requests response one at a time (see _iter_stream_line_batches).
+def _iter_stream_lines(response, chunk_size=65536):
+	for lines in _iter_stream_line_batches(response, chunk_size):
+		for line in lines:
+			yield line
+
 # The PubSubMonitor class monitors subscriptions to channels via an HTTP interface.
 class PubSubMonitor(object):
 
+	# The scheduler that spreads out the reconnections and limits the
+	# concurrent historical fetches of all monitors in the process. Its
+	# limits can be changed, for example with
+	# PubSubMonitor.reconnect_scheduler.set_max_fetches(2).
+	reconnect_scheduler = ReconnectScheduler()
+
+	# The number of attempts made to download a page of the historical
+	# fetch and the maximum wait interval in seconds between them.
+	_history_attempts = 7
+	_history_max_interval = 32.0
+
 	# Initialize with base stream URI, JWT auth info, and callback used for indicating
-	# when a subscription event occurs.
-	def __init__(self, base_stream_uri, auth_jwt_claim=None, auth_jwt_key=None, callback=None, auth_bearer=None):
+	# when a subscription event occurs. Optionally specify a batch callback
+	# that is passed a list of ('sub' or 'unsub', channel) tuples for each
+	# batch of subscription events, such as a page of the historical fetch.
+	# Optionally specify the path of a state file that the subscribed
+	# channels and the cursor they correspond to are saved to, at most once
+	# every state_interval seconds and when monitoring ends. If the file
+	# exists when the instance is created then the saved channels are
+	# announced to the callbacks right away and the historical fetch only
+	# downloads the changes since the saved cursor. The file is replaced
+	# atomically so that it always holds a consistent state.
+	def __init__(self, base_stream_uri, auth_jwt_claim=None, auth_jwt_key=None, callback=None, auth_bearer=None,
+			batch_callback=None, state_file=None, state_interval=5.0):
+		self._init_state(base_stream_uri, auth_jwt_claim, auth_jwt_key,
+				callback, auth_bearer, batch_callback, state_file,
+				state_interval)
+		self._requests_session = requests.session()
+		self._stream_response = None
+		self._historical_fetch_thread_result = False
+		self._historical_fetch_thread = None
+		self._thread_event = threading.Event()
+		self._stream_thread = threading.Thread(target=self._run_stream)
+		self._stream_thread.daemon = True
+		self._stream_thread.start()
+
+	# An internal method for initializing the subscription state and the
+	# connection parameters, which do not depend on how the connections are
+	# run.
+	def _init_state(self, base_stream_uri, auth_jwt_claim, auth_jwt_key,
+			callback, auth_bearer, batch_callback, state_file=None,
+			state_interval=5.0):
 		if base_stream_uri[-1:] != '/':
 			base_stream_uri += '/'
 		self._stream_uri = base_stream_uri + 'subscriptions/stream/'
 		self._items_uri = base_stream_uri + 'subscriptions/items/'
+		self._auth_bearer = None
 		self._auth_jwt_claim = None
+		self._auth_jwt_key = None
 		if auth_bearer:
 			self._auth_bearer = auth_bearer
 		elif auth_jwt_claim:
 			self._auth_jwt_claim = copy.deepcopy(auth_jwt_claim)
 			self._auth_jwt_key = auth_jwt_key
 		self._callback = callback
+		self._batch_callback = batch_callback
 		self._lock = threading.Lock()
-		self._requests_session = requests.session()
-		self._stream_response = None
 		self._channels = set()
+		self._channel_index = ChannelIndex()
 		self._last_cursor = None
+		self._last_cursor_cache = (None, None)
 		self._closed = False
-		self._historical_fetch_thread_result = False
-		self._historical_fetch_thread = None
-		self._thread_event = threading.Event()
-		self._stream_thread = threading.Thread(target=self._run_stream)
-		self._stream_thread.daemon = True
-		self._stream_thread.start()
+		self._catch_stream_up_to_last_cursor = False
+		self._catch_stream_up_start_time = 0
+		self._state_file = state_file
+		self._state_interval = state_interval
+		self._saved_state = (None, self._channels)
+		self._state_saved_time = 0
+		if state_file:
+			self._load_state()
+
+	# An internal method for getting the headers of the stream and historical
+	# fetch requests.
+	def _get_headers(self):
+		headers = {}
+		if self._auth_bearer:
+			headers['Authorization'] = 'Bearer ' + self._auth_bearer
+		elif self._auth_jwt_claim:
+			headers['Authorization'] = _gen_auth_jwt_header(
+					self._auth_jwt_claim, self._auth_jwt_key)
+		return headers
 
-	# Determine if the specified channel has been subscribed to.
+	# An internal method for building the URI of the historical fetch page
+	# that follows the specified cursor.
+	def _get_history_uri(self, cursor):
+		uri = self._items_uri
+		if cursor:
+			try:
+				uri += "?" + urllib.urlencode({'since': 'cursor:%s' % cursor})
+			except AttributeError:
+				uri += "?" + urllib.parse.urlencode({'since': 'cursor:%s' % cursor})
+		return uri
+
+	# Determine if the specified channel has been subscribed to. The set of
+	# subscribed channels is replaced rather than modified when changes are
+	# applied, so it is read here without taking the lock.
 	def is_channel_subscribed_to(self, channel):
-		found_channel = False
-		self._lock.acquire()
-		if channel in self._channels:
-			found_channel = True
-		self._lock.release()
-		return found_channel
+		return channel in self._channels
+
+	# Determine if any channel that starts with the specified prefix has
+	# been subscribed to.
+	def is_prefix_subscribed_to(self, prefix):
+		return self._channel_index.has_prefix(prefix)
+
+	# Get the number of subscribed channels that start with the specified
+	# prefix, or of all subscribed channels if no prefix is specified.
+	def count_subscribed_channels(self, prefix=None):
+		return self._channel_index.count(prefix)
+
+	# Get a sorted list of the subscribed channels that start with the
+	# specified prefix, or of all subscribed channels if no prefix is
+	# specified.
+	def get_subscribed_channels(self, prefix=None):
+		return self._channel_index.get(prefix)
+
+	# Get a sorted list of the subscribed channels that match the specified
+	# shell-style pattern (see the ChannelIndex class).
+	def get_subscribed_channels_matching(self, pattern):
+		return self._channel_index.match(pattern)
 
 	# Close this instance and block until all threads are complete.
 	def close(self, blocking=False):
 		self._lock.acquire()
 		self._closed = True
 		self._callback = None
+		self._batch_callback = None
 		stream_thread = self._stream_thread
 		self._stream_thread = None
 		self._lock.release()
@@ -82,113 +245,175 @@ class PubSubMonitor(object):
 	# Run the stream connection.
 	def _run_stream(self):
 		logger.debug('stream thread started')
-		while not self._closed:
-			wait_interval = 0
-			retry_connection = True
-			while retry_connection:
-				time.sleep(wait_interval)
-				wait_interval = PubSubMonitor._increase_wait_interval(wait_interval)
-				try:
-					logger.debug('stream get %s' % self._stream_uri)
-					timeout = (5,60)
-					headers = {}
-					if self._auth_bearer:
-						headers['Authorization'] = 'Bearer ' + self._auth_bearer
-					else:
-						headers['Authorization'] = _gen_auth_jwt_header(
-								self._auth_jwt_claim, self._auth_jwt_key)
-					self._stream_response = self._requests_session.get(
-							self._stream_uri, headers=headers, stream=True,
-							timeout=timeout)
-					# No concern about a race condition here since there's 5 full
-					# seconds between the .get() method above returning and the
-					# timeout exception being thrown. The lines below are guaranteed
-					# to execute within 5 seconds.
-					if (self._stream_response.status_code >= 200 and
-							self._stream_response.status_code < 300):
-						retry_connection = False
-					elif (self._stream_response.status_code < 500 or
-							self._stream_response.status_code == 501 or
-							self._stream_response.status_code >= 600):
-						self.close()
-						raise ValueError(
-								'pubsubmonitor stream connection resulted in status code: %d' %
-								self._stream_response.status_code)
-					else:
-						continue
-					logger.debug('stream open')
-					self._try_historical_fetch()
-				except (socket.timeout, requests.exceptions.RequestException):
-					continue
-				got_subscribers = False
-				while not self._closed:
+		# the first connection is made right away while reconnections are
+		# spread out
+		wait_interval = 0
+		try:
+			while not self._closed:
+				retry_connection = True
+				while retry_connection:
+					time.sleep(wait_interval)
+					wait_interval = self.reconnect_scheduler.get_wait_interval(
+							wait_interval or None)
 					try:
-						self._thread_event.wait()
-						if not got_subscribers and self._historical_fetch_thread_result:
-							got_subscribers = True
-						if not got_subscribers:
+						logger.debug('stream get %s', self._stream_uri)
+						timeout = (5,60)
+						headers = self._get_headers()
+						self._stream_response = self._requests_session.get(
+								self._stream_uri, headers=headers, stream=True,
+								timeout=timeout)
+						# No concern about a race condition here since there's 5 full
+						# seconds between the .get() method above returning and the
+						# timeout exception being thrown. The lines below are guaranteed
+						# to execute within 5 seconds.
+						if (self._stream_response.status_code >= 200 and
+								self._stream_response.status_code < 300):
+							retry_connection = False
+						elif (self._stream_response.status_code < 500 or
+								self._stream_response.status_code == 501 or
+								self._stream_response.status_code >= 600):
+							self.close()
+							raise ValueError(
+									'pubsubmonitor stream connection resulted in status code: %d' %
+									self._stream_response.status_code)
+						else:
+							continue
+						logger.debug('stream open')
+						self._try_historical_fetch()
+					except (socket.timeout, requests.exceptions.RequestException):
+						continue
+					got_subscribers = False
+					wait_interval = self.reconnect_scheduler.get_wait_interval()
+					while not self._closed:
+						try:
+							self._thread_event.wait()
+							if not got_subscribers and self._historical_fetch_thread_result:
+								got_subscribers = True
+							if not got_subscribers:
+								break
+							self._monitor()
 							break
-						self._monitor()
-						break
-					except (socket.timeout, requests.exceptions.Timeout, IncompleteRead):
-						logger.debug('stream timed out')
-						break
-					except (SSLError, OSError, ConnectionError) as e:
-						if 'timed out' in str(e):
+						except (socket.timeout, requests.exceptions.Timeout, IncompleteRead):
 							logger.debug('stream timed out')
 							break
-						self._callback = None
-						raise
-					except:
-						logger.exception('error processing stream')
-				self._stream_response.close()
+						except (SSLError, OSError,
+								requests.exceptions.ConnectionError) as e:
+							if 'timed out' in str(e):
+								logger.debug('stream timed out')
+								break
+							self._callback = None
+							raise
+						except:
+							logger.exception('error processing stream')
+					self._stream_response.close()
+		finally:
+			self._save_state(True)
 		logger.debug('stream thread ended')
 
 	# Monitor the stream connection.
 	def _monitor(self):
-		for line in self._stream_response.iter_lines(chunk_size=1):
-			if self._closed:
+		for lines in _iter_stream_line_batches(self._stream_response):
+			if not self._process_stream_lines(lines):
 				break
 
-			now = time.time()
-			if (self._catch_stream_up_to_last_cursor and
-					now >= self._catch_stream_up_start_time + 60):
-				logger.debug('timed out waiting to catch up')
-				break
+	# Process the specified list of stream lines. The subscription changes
+	# of consecutive events are applied together. Returns False if
+	# monitoring should stop.
+	def _process_stream_lines(self, lines):
+		items = list()
+		try:
+			for line in lines:
+				if self._closed or self._is_catch_up_timed_out():
+					return False
 
-			if not line:
-				continue
+				if not line:
+					continue
 
-			content = json.loads(_ensure_unicode(line))
+				content = json.loads(_ensure_unicode(line))
+				action = self._check_stream_event(content)
+				if action == 'skip':
+					continue
+				if action == 'mismatch':
+					self._parse_items(items)
+					items = list()
+					self._try_historical_fetch()
+					self._thread_event.wait()
+					if not self._historical_fetch_thread_result:
+						return False
+				else:
+					items.append(content['item'])
+				self._set_stream_cursor(content['cursor'])
+			return True
+		finally:
+			self._parse_items(items)
+			self._save_state()
 
-			last_cursor_parsed = PubSubMonitor._parse_cursor(
-					self._last_cursor)
+	# An internal method for determining if catching the stream up to the
+	# last cursor of the historical fetch is taking too long.
+	def _is_catch_up_timed_out(self):
+		if (self._catch_stream_up_to_last_cursor and
+				time.time() >= self._catch_stream_up_start_time + 60):
+			logger.debug('timed out waiting to catch up')
+			return True
+		return False
 
-			prev_cursor_parsed = None
-			if 'prev_cursor' in content:
-				prev_cursor_parsed = PubSubMonitor._parse_cursor(
-						content['prev_cursor'])
+	# An internal method for checking the previous cursor of the specified
+	# stream event against the last cursor. Returns 'item' if the item of
+	# the event should be applied, 'skip' if the event precedes the last
+	# cursor while catching the stream up, or 'mismatch' if events were
+	# missed and a historical fetch is needed.
+	def _check_stream_event(self, content):
+		# consecutive events carry the previous cursor unchanged, so the
+		# cursors only need to be decoded when they differ
+		prev_cursor = content.get('prev_cursor')
+		cursor_mismatch = False
+		if prev_cursor and prev_cursor != self._last_cursor:
+			prev_cursor_parsed = PubSubMonitor._parse_cursor(prev_cursor)
+			cursor_mismatch = bool(prev_cursor_parsed and
+					prev_cursor_parsed != self._parse_last_cursor())
 
-			if self._catch_stream_up_to_last_cursor:
-				if (prev_cursor_parsed and
-						prev_cursor_parsed != last_cursor_parsed):
-					continue
-				logger.debug('stream caught up to last cursor')
-				self._catch_stream_up_to_last_cursor = False
-			if (prev_cursor_parsed and
-					prev_cursor_parsed != last_cursor_parsed):
-				logger.debug('stream cursor mismatch: got=%s expected=%s' % (
-						prev_cursor_parsed, last_cursor_parsed))
-				self._try_historical_fetch()
-				self._thread_event.wait()
-				if not self._historical_fetch_thread_result:
-					break
-			else:
-				self._parse_items([content['item']])
+		if self._catch_stream_up_to_last_cursor:
+			if cursor_mismatch:
+				return 'skip'
+			logger.debug('stream caught up to last cursor')
+			self._catch_stream_up_to_last_cursor = False
+		if cursor_mismatch:
+			if logger.isEnabledFor(logging.DEBUG):
+				logger.debug('stream cursor mismatch: got=%s expected=%s',
+						PubSubMonitor._parse_cursor(prev_cursor),
+						self._parse_last_cursor())
+			return 'mismatch'
+		return 'item'
 
-			self._last_cursor = content['cursor']
-			logger.debug('last cursor: %s' %
-					PubSubMonitor._parse_cursor(self._last_cursor))
+	# An internal method for setting the last cursor to the specified cursor
+	# of a stream event.
+	def _set_stream_cursor(self, cursor):
+		self._last_cursor = cursor
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug('last cursor: %s', self._parse_last_cursor())
+
+	# An internal method for starting to catch the stream up to the last
+	# cursor once a historical fetch completed.
+	def _start_catch_up(self):
+		self._catch_stream_up_to_last_cursor = True
+		self._catch_stream_up_start_time = time.time()
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug('last cursor: %s', self._parse_last_cursor())
+
+	# An internal method for parsing the body of a historical fetch response
+	# with the specified status code. Returns a (result, value) tuple as
+	# described for the _fetch_history_pages method, or None if the request
+	# should be retried.
+	@staticmethod
+	def _parse_history_response(status_code, content):
+		if status_code >= 200 and status_code < 300:
+			return ('page', json.loads(_ensure_unicode(content)))
+		elif status_code == 404:
+			return ('not_found', None)
+		elif (status_code < 500 or status_code == 501 or
+				status_code >= 600):
+			return ('error', status_code)
+		return None
 
 	# Try to complete the historical fetch.
 	def _try_historical_fetch(self):
@@ -198,113 +423,218 @@ class PubSubMonitor(object):
 		self._historical_fetch_thread.daemon = True
 		self._historical_fetch_thread.start()
 
-	# Run the historical fetch.
+	# Run the historical fetch once the reconnect scheduler allows it. The
+	# pages are downloaded by a separate thread that fetches the next page
+	# while the current one is applied, and each page is applied as soon as
+	# it arrives so that only the pages in flight are held in memory. The
+	# last cursor is advanced after each page is applied so that it always
+	# matches the subscription state.
 	def _run_historical_fetch(self):
+		self.reconnect_scheduler.acquire_fetch()
+		pages = queue.Queue(1)
+		stop = threading.Event()
 		try:
+			fetcher = threading.Thread(target=self._fetch_history_pages,
+					args=(self._last_cursor, pages, stop))
+			fetcher.daemon = True
+			fetcher.start()
 			self._last_stream_cursor = None
 			logger.debug('catching up')
-			items = []
-			more_items_available = True
-			while more_items_available:
-				uri = self._items_uri
-				if self._last_cursor:
-					try:
-						uri += "?" + urllib.urlencode({'since': 'cursor:%s' % self._last_cursor})
-					except AttributeError:
-						uri += "?" + urllib.parse.urlencode({'since': 'cursor:%s' % self._last_cursor})
-				wait_interval = 0
-				retry_connection = True
-				while retry_connection:
-					if wait_interval == 64:
-						self._historical_fetch_thread_result = False
-						return
-					time.sleep(wait_interval)
-					wait_interval = PubSubMonitor._increase_wait_interval(wait_interval)
-					try:
-						if self._last_cursor:
-							logger.debug('history get %s (%s)' % (
-									uri, PubSubMonitor._parse_cursor(
-									self._last_cursor)))
-						else:
-							logger.debug('history get %s' % uri)
-						headers = {}
-						if self._auth_bearer:
-							headers['Authorization'] = 'Bearer ' + self._auth_bearer
-						else:
-							headers['Authorization'] = _gen_auth_jwt_header(
-									self._auth_jwt_claim, self._auth_jwt_key)
-						res = self._requests_session.get(uri, headers=headers,
-								timeout=30)
-						if (res.status_code >= 200 and
-								res.status_code < 300):
-							retry_connection = False
-						elif res.status_code == 404:
-							self._unsub_and_clear_channels()
-							self._historical_fetch_thread_result = False
-							return
-						elif (res.status_code < 500 or
-								res.status_code == 501 or
-								res.status_code >= 600):
-							self._historical_fetch_thread_result = False
-							self.close()
-							raise ValueError(
-									'pubsubmonitor historical fetch connection resulted in status code: %d' %
-									res.status_code)
-					except (socket.timeout, requests.exceptions.RequestException):
-						pass
-				content = json.loads(_ensure_unicode(res.content))
-				self._last_cursor = content['last_cursor']
-				if not content['items']:
-					more_items_available = False
-				else:
-					items.extend(content['items'])
-			self._parse_items(items)
+			while True:
+				result, value = pages.get()
+				if result == 'not_found':
+					self._unsub_and_clear_channels()
+					self._historical_fetch_thread_result = False
+					return
+				elif result == 'error':
+					self._historical_fetch_thread_result = False
+					self.close()
+					raise ValueError(
+							'pubsubmonitor historical fetch connection resulted in status code: %d' %
+							value)
+				elif result != 'page':
+					self._historical_fetch_thread_result = False
+					return
+				self._parse_items(value['items'])
+				self._last_cursor = value['last_cursor']
+				self._save_state()
+				if not value['items']:
+					break
 			self._historical_fetch_thread_result = True
-			self._catch_stream_up_to_last_cursor = True
-			self._catch_stream_up_start_time = time.time()
-			logger.debug('last cursor: %s' % PubSubMonitor._parse_cursor(self._last_cursor))
+			self._start_catch_up()
 		finally:
+			stop.set()
+			self.reconnect_scheduler.release_fetch()
 			self._thread_event.set()
 
+	# Download the pages of the historical fetch starting at the specified
+	# cursor and put a (result, value) tuple for each of them in the
+	# specified queue until the last page, an error, or until the specified
+	# stop event is set. The result is 'page' with the parsed page as the
+	# value, 'not_found', 'error' with the status code as the value, or
+	# 'failed' if the retries were exhausted.
+	def _fetch_history_pages(self, cursor, pages, stop):
+		while not stop.is_set():
+			result = self._fetch_history_page(cursor)
+			while not stop.is_set():
+				try:
+					pages.put(result, True, 1)
+					break
+				except queue.Full:
+					pass
+			if result[0] != 'page' or not result[1]['items']:
+				return
+			cursor = result[1]['last_cursor']
+
+	# Download the page of the historical fetch that follows the specified
+	# cursor, retrying with jittered wait intervals (see the
+	# ReconnectScheduler class). Returns a (result, value) tuple as described
+	# for the _fetch_history_pages method.
+	def _fetch_history_page(self, cursor):
+		uri = self._get_history_uri(cursor)
+		wait_interval = None
+		for attempt in range(0, self._history_attempts):
+			if attempt > 0:
+				wait_interval = self.reconnect_scheduler.get_wait_interval(
+						wait_interval, self._history_max_interval)
+				time.sleep(wait_interval)
+			try:
+				if cursor and logger.isEnabledFor(logging.DEBUG):
+					logger.debug('history get %s (%s)', uri,
+							PubSubMonitor._parse_cursor(cursor))
+				else:
+					logger.debug('history get %s', uri)
+				headers = self._get_headers()
+				res = self._requests_session.get(uri, headers=headers,
+						timeout=30)
+				result = PubSubMonitor._parse_history_response(
+						res.status_code, res.content)
+				if result is not None:
+					return result
+			except (socket.timeout, requests.exceptions.RequestException):
+				pass
+		return ('failed', None)
+
 	# Unsubscribe from and clear all channels.
 	def _unsub_and_clear_channels(self):
 		logger.debug('unsubbing and clearing channels')
-		if self._callback:
-			for channel in self._channels:
-				try:
-					self._callback('unsub', channel)
-				except Exception:
-					logger.exception('error calling callback')
 		self._lock.acquire()
-		self._channels.clear()
+		events = [('unsub', channel) for channel in self._channels]
+		self._channels = set()
+		self._channel_index = ChannelIndex()
 		self._last_cursor = None
 		self._lock.release()
+		self._save_state(True)
+		self._deliver_events(events)
+
+	# An internal method for loading the subscribed channels and the last
+	# cursor from the state file. The loaded channels are announced to the
+	# callbacks. A state file that is missing, unreadable or that was saved
+	# for another URI is ignored.
+	def _load_state(self):
+		try:
+			with open(self._state_file, 'r') as f:
+				state = json.load(f)
+			if state.get('uri') != self._stream_uri or not state.get('cursor'):
+				return
+			channels = set(state['channels'])
+			cursor = state['cursor']
+		except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+			logger.debug('not loading state file %s: %s', self._state_file, e)
+			return
+		logger.debug('loaded %d channels from state file %s', len(channels),
+				self._state_file)
+		self._channels = channels
+		self._channel_index = ChannelIndex(channels)
+		self._last_cursor = cursor
+		self._saved_state = (cursor, channels)
+		self._deliver_events([('sub', channel) for channel in channels])
 
-	# Parse the specified items by updating the internal list and calling callbacks.
+	# An internal method for saving the subscribed channels and the last
+	# cursor to the state file if they changed since they were last saved
+	# and the state interval has passed, or regardless of the interval if
+	# force is set to True. Must only be called while the channels and the
+	# cursor correspond to each other. The file is written next to the state
+	# file and then renamed over it.
+	def _save_state(self, force=False):
+		if not self._state_file:
+			return
+		cursor = self._last_cursor
+		channels = self._channels
+		saved = self._saved_state
+		if cursor == saved[0] and channels is saved[1]:
+			return
+		now = time.time()
+		if not force and now < self._state_saved_time + self._state_interval:
+			return
+		tmp_file = '%s.%d.tmp' % (self._state_file, os.getpid())
+		try:
+			with open(tmp_file, 'w') as f:
+				json.dump({'uri': self._stream_uri, 'cursor': cursor,
+						'channels': list(channels)}, f)
+				f.flush()
+				os.fsync(f.fileno())
+			getattr(os, 'replace', os.rename)(tmp_file, self._state_file)
+		except (IOError, OSError):
+			logger.warning('failed to save state file %s', self._state_file,
+					exc_info=True)
+			return
+		self._saved_state = (cursor, channels)
+		self._state_saved_time = now
+
+	# Parse the specified items by updating the internal set and calling
+	# callbacks. The whole list is applied to a copy of the set under a
+	# single lock acquisition and the copy then replaces the set. The
+	# callbacks are called once the lock is released.
 	def _parse_items(self, items):
+		events = list()
 		for item in items:
-			if (item['state'] == 'subscribed' and
-					item['channel'] not in self._channels):
-				logger.debug('added %s' % item['channel'])
-				if self._callback:
-					try:
-						self._callback('sub', item['channel'])
-					except Exception:
-						logger.exception('error calling callback')
-				self._lock.acquire()
-				self._channels.add(item['channel'])
-				self._lock.release()
-			elif (item['state'] == 'unsubscribed' and
-					item['channel'] in self._channels):
-				logger.debug('removed %s' % item['channel'])
-				if self._callback:
-					try:
-						self._callback('unsub', item['channel'])
-					except Exception:
-						logger.exception('error calling callback')
-				self._lock.acquire()
-				self._channels.remove(item['channel'])
-				self._lock.release()
+			if item['state'] == 'subscribed':
+				events.append(('sub', item['channel']))
+			elif item['state'] == 'unsubscribed':
+				events.append(('unsub', item['channel']))
+		self._lock.acquire()
+		self._channels, events = _apply_subscription_events(self._channels,
+				events)
+		self._channel_index.apply(events)
+		self._lock.release()
+		if logger.isEnabledFor(logging.DEBUG):
+			for event_type, channel in events:
+				logger.debug('%s %s', 'added' if event_type == 'sub' else
+						'removed', channel)
+		self._deliver_events(events)
+
+	# Pass the specified list of (event type, channel) tuples to the batch
+	# callback and then to the callback one event at a time.
+	def _deliver_events(self, events):
+		if not events:
+			return
+		batch_callback = self._batch_callback
+		if batch_callback:
+			try:
+				batch_callback(events)
+			except Exception:
+				logger.exception('error calling batch callback')
+		callback = self._callback
+		if callback:
+			for event_type, channel in events:
+				try:
+					callback(event_type, channel)
+				except Exception:
+					logger.exception('error calling callback')
+
+	# Parse the last cursor. The parsed cursor is cached along with the raw
+	# cursor it was parsed from.
+	def _parse_last_cursor(self):
+		raw_cursor = self._last_cursor
+		cache = self._last_cursor_cache
+		if cache[0] != raw_cursor:
+			parsed = None
+			if raw_cursor:
+				parsed = PubSubMonitor._parse_cursor(raw_cursor)
+			cache = (raw_cursor, parsed)
+			self._last_cursor_cache = cache
+		return cache[1]
 
 	# Parse the specified cursor.
 	@staticmethod
@@ -312,11 +642,3 @@ class PubSubMonitor(object):
 		decoded_cursor = b64decode(raw_cursor).decode('UTF-8')
 		return decoded_cursor[decoded_cursor.index('_')+1:]
 
-	# Increase the wait interval from the specified interval.
-	@staticmethod
-	def _increase_wait_interval(wait_interval):
-		if wait_interval <= 1:
-			return wait_interval + 1
-		elif wait_interval == 64:
-			return wait_interval
-		return wait_interval * 2
@@ -0,0 +1,119 @@
+#    ratelimiter.py
+#    ~~~~~~~~~
+#    This module implements the TokenBucket and RateLimiter classes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+import time
+from .utilities import _ensure_unicode
+
+# The TokenBucket class is used internally for limiting a rate to a number
+# of units per second while allowing bursts of up to the bucket capacity.
+# Tokens are reserved ahead of time rather than rejected: a reservation that
+# exceeds the available tokens puts the bucket into debt and returns the
+# time at which the reserved units may be sent.
+class TokenBucket(object):
+
+	# Initialize with the rate in units per second and the burst capacity,
+	# which defaults to one second worth of units.
+	def __init__(self, rate, burst=None):
+		if rate <= 0:
+			raise ValueError('rate must be greater than 0')
+		if burst is None:
+			burst = rate
+		if burst <= 0:
+			raise ValueError('burst must be greater than 0')
+		self.rate = float(rate)
+		self.burst = float(burst)
+		self._tokens = self.burst
+		self._last = None
+
+	# Reserve the specified number of units at the specified time and return
+	# the time at which they may be sent.
+	def reserve(self, amount, now):
+		if self._last is not None:
+			self._tokens = min(self.burst,
+					self._tokens + (now - self._last) * self.rate)
+		self._last = now
+		self._tokens -= amount
+		if self._tokens >= 0:
+			return now
+		return now - self._tokens / self.rate
+
+# The RateLimiter class is used internally by PubControlClient for smoothing
+# the publishing rate of an endpoint. Items are limited by an overall items
+# per second and bytes per second rate along with optional per-channel items
+# per second rates. The limiter keeps statistics about how much traffic had
+# to be delayed.
+class RateLimiter(object):
+
+	# Initialize with the optional overall items and bytes per second rates,
+	# an optional dict of channel to items per second rates and an optional
+	# burst duration in seconds, which defaults to one second worth of
+	# traffic for each rate.
+	def __init__(self, items_per_second=None, bytes_per_second=None,
+			channel_limits=None, burst=1.0):
+		if burst <= 0:
+			raise ValueError('burst must be greater than 0')
+		self._lock = threading.Lock()
+		self._items = None
+		self._bytes = None
+		self._channels = dict()
+		if items_per_second is not None:
+			self._items = TokenBucket(items_per_second,
+					max(1.0, items_per_second * burst))
+		if bytes_per_second is not None:
+			self._bytes = TokenBucket(bytes_per_second,
+					bytes_per_second * burst)
+		if channel_limits:
+			for channel, rate in channel_limits.items():
+				bucket = TokenBucket(rate, max(1.0, rate * burst))
+				self._channels[_ensure_unicode(channel)] = bucket
+		self._reset_stats()
+
+	# Reserve capacity for publishing an item of the specified size in bytes
+	# to the specified channel and return the time at which it may be sent.
+	# Items for different channels may become ready out of order since only
+	# the overall limits are shared between them.
+	def reserve(self, channel, size):
+		self._lock.acquire()
+		now = time.time()
+		ready = now
+		if self._items is not None:
+			ready = max(ready, self._items.reserve(1, now))
+		if self._bytes is not None:
+			ready = max(ready, self._bytes.reserve(size, now))
+		bucket = None
+		if self._channels:
+			bucket = self._channels.get(_ensure_unicode(channel))
+		if bucket is not None:
+			ready = max(ready, bucket.reserve(1, now))
+		self._stats['items'] += 1
+		self._stats['bytes'] += size
+		delay = ready - now
+		if delay > 0:
+			self._stats['delayed_items'] += 1
+			self._stats['delayed_bytes'] += size
+			self._stats['total_delay'] += delay
+			if delay > self._stats['max_delay']:
+				self._stats['max_delay'] = delay
+		self._lock.release()
+		return ready
+
+	# Get a dict of the number of items and bytes that passed through the
+	# limiter, how many of them were delayed, and the total and maximum delay
+	# in seconds. If reset is set to True then the statistics are cleared.
+	def get_stats(self, reset=False):
+		self._lock.acquire()
+		out = dict(self._stats)
+		if reset:
+			self._reset_stats()
+		self._lock.release()
+		return out
+
+	# An internal method for clearing the statistics.
+	def _reset_stats(self):
+		self._stats = {'items': 0, 'bytes': 0, 'delayed_items': 0,
+				'delayed_bytes': 0, 'total_delay': 0.0, 'max_delay': 0.0}
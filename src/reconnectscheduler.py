@@ -0,0 +1,109 @@
+#    reconnectscheduler.py
+#    ~~~~~~~~~
+#    This module implements the ReconnectScheduler class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import random
+import threading
+from collections import deque
+
+# The ReconnectScheduler class is used by the PubSubMonitor classes for
+# spreading out reconnections and historical fetches across all of the
+# monitors in the process, so that monitors which lose their connections at
+# the same time, such as when the server restarts, do not reconnect and
+# fetch in lockstep. Wait intervals between attempts use decorrelated
+# jitter, and the number of historical fetches that run at the same time is
+# limited, with further fetches waiting their turn in order. A single
+# instance is shared by all monitors (see PubSubMonitor.reconnect_scheduler).
+class ReconnectScheduler(object):
+
+	# Initialize with the maximum number of concurrent historical fetches,
+	# or None for no limit, and the base and maximum wait intervals in
+	# seconds.
+	def __init__(self, max_fetches=4, base_interval=1.0, max_interval=64.0):
+		if max_fetches is not None and max_fetches < 1:
+			raise ValueError('max_fetches must be at least 1')
+		if base_interval <= 0 or max_interval < base_interval:
+			raise ValueError('invalid wait intervals')
+		self._lock = threading.Lock()
+		self._max_fetches = max_fetches
+		self._base_interval = base_interval
+		self._max_interval = max_interval
+		self._fetches = 0
+		self._waiters = deque()
+
+	# Set the maximum number of concurrent historical fetches, or None for
+	# no limit. Waiting fetches are started if the limit was raised.
+	def set_max_fetches(self, max_fetches):
+		if max_fetches is not None and max_fetches < 1:
+			raise ValueError('max_fetches must be at least 1')
+		self._lock.acquire()
+		self._max_fetches = max_fetches
+		granted = self._take_waiters()
+		self._lock.release()
+		for callback in granted:
+			callback()
+
+	# Get the number of seconds to wait before the next attempt, given the
+	# wait interval before the previous attempt, or None if the previous
+	# attempt was the first. The first retry waits a random interval of up
+	# to the base interval, and each further retry waits a random interval
+	# between the base interval and three times the previous interval, up
+	# to the specified maximum interval, which defaults to the maximum
+	# interval of this instance.
+	def get_wait_interval(self, previous=None, max_interval=None):
+		if max_interval is None:
+			max_interval = self._max_interval
+		if previous is None:
+			return random.uniform(0, min(self._base_interval, max_interval))
+		return min(max_interval, random.uniform(self._base_interval,
+				max(self._base_interval, previous * 3)))
+
+	# Request to start a historical fetch. The specified callback is called
+	# once the fetch may start, which may be right away and from within this
+	# method, or later from the thread that completes another fetch. Every
+	# fetch that was started must be completed by calling the release_fetch
+	# method.
+	def request_fetch(self, callback):
+		self._lock.acquire()
+		self._waiters.append(callback)
+		granted = self._take_waiters()
+		self._lock.release()
+		for callback in granted:
+			callback()
+
+	# Block until a historical fetch may start (see the request_fetch
+	# method).
+	def acquire_fetch(self):
+		event = threading.Event()
+		self.request_fetch(event.set)
+		event.wait()
+
+	# Complete a historical fetch so that the next waiting fetch may start.
+	def release_fetch(self):
+		self._lock.acquire()
+		self._fetches -= 1
+		granted = self._take_waiters()
+		self._lock.release()
+		for callback in granted:
+			callback()
+
+	# Get a dict of the number of historical fetches that are 'running' and
+	# the number that are 'waiting' to start.
+	def get_stats(self):
+		self._lock.acquire()
+		out = {'running': self._fetches, 'waiting': len(self._waiters)}
+		self._lock.release()
+		return out
+
+	# An internal method for taking the callbacks of the waiting fetches
+	# that may start. Must be called while holding the lock.
+	def _take_waiters(self):
+		granted = list()
+		while self._waiters and (self._max_fetches is None or
+				self._fetches < self._max_fetches):
+			self._fetches += 1
+			granted.append(self._waiters.popleft())
+		return granted
@@ -0,0 +1,272 @@
+#    replicaclient.py
+#    ~~~~~~~~~
+#    This module implements the ReplicaPubControlClient class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import heapq
+import threading
+import time
+from collections import deque
+from .item import Item, PreparedItem
+
+# The ReplicaPubControlClient class publishes to one of several redundant
+# endpoints that serve the same cluster. Each publish is sent to the replica
+# with the fewest outstanding requests relative to its weight. If a replica
+# fails then the publish is retried on the next best replica that has not
+# been tried yet. Optionally, a publish that has not completed within a
+# percentile of the recently observed latencies is hedged by sending a
+# duplicate to another replica, and the first result wins. Duplicates are
+# only sent for items that have an ID so that the endpoint can discard
+# them. A ReplicaPubControlClient instance can be added to a PubControl
+# instance like any other client.
+class ReplicaPubControlClient(object):
+
+	# Initialize with a list of PubControlClient instances, one per replica,
+	# and an optional list of weights in the same order, defaulting to 1.
+	# Set hedge_percentile to a percentile between 0 and 100 to enable
+	# hedging. Hedged duplicates are sent no sooner than hedge_min_delay
+	# seconds after the original publish and only once at least min_samples
+	# latencies were observed. The latency_window parameter is the number of
+	# recent latencies that the percentile is computed from. Set failover to
+	# False to report failures without retrying on another replica.
+	def __init__(self, clients, weights=None, hedge_percentile=None,
+			hedge_min_delay=0.01, latency_window=200, min_samples=20,
+			failover=True):
+		if not clients:
+			raise ValueError('at least one replica must be specified')
+		if weights is None:
+			weights = [1] * len(clients)
+		if len(weights) != len(clients):
+			raise ValueError('a weight must be specified for each replica')
+		for weight in weights:
+			if weight <= 0:
+				raise ValueError('replica weights must be greater than 0')
+		if hedge_percentile is not None and not 0 < hedge_percentile <= 100:
+			raise ValueError('hedge_percentile must be between 0 and 100')
+		self.clients = list(clients)
+		self.uri = getattr(self.clients[0], 'uri', None)
+		self.sub_monitor = None
+		self.closed = False
+		self._weights = list(weights)
+		self._hedge_percentile = hedge_percentile
+		self._hedge_min_delay = hedge_min_delay
+		self._min_samples = min_samples
+		self._failover = failover
+		self._lock = threading.Lock()
+		self._outstanding = [0] * len(self.clients)
+		self._latencies = deque(maxlen=latency_window)
+		self._stats = {'publishes': 0, 'hedged': 0, 'failovers': 0}
+		self._hedge_cond = threading.Condition(self._lock)
+		self._hedge_queue = list()
+		self._hedge_seq = 0
+		self._hedge_thread = None
+
+	# The publish method for publishing the specified item to the specified
+	# channel on the best replica. Blocking publishes are sent through the
+	# same asynchronous path so that they also benefit from hedging and
+	# failover, and an error is raised if every attempt failed. The callback
+	# is called a single time with the first successful result or, if every
+	# attempt failed, with the last error.
+	def publish(self, channel, item, blocking=False, callback=None):
+		self._verify_not_closed()
+		if isinstance(item, Item) and not isinstance(item, PreparedItem):
+			# hedged and failed over attempts share the exported item
+			item = PreparedItem(item)
+		if blocking:
+			event = threading.Event()
+			result = list()
+			def done(success, message):
+				result.append((success, message))
+				event.set()
+			self._start(channel, item, done)
+			event.wait()
+			if not result[0][0]:
+				raise ValueError(result[0][1])
+		else:
+			self._start(channel, item, callback)
+
+	# Get a dict of the number of 'publishes', how many of them were
+	# 'hedged' and how many times a publish was retried on another replica
+	# ('failovers'), along with the current number of 'outstanding' requests
+	# of each replica and the 'hedge_delay' in seconds that is currently
+	# applied, or None if hedging is not active.
+	def get_stats(self):
+		self._lock.acquire()
+		out = dict(self._stats)
+		out['outstanding'] = list(self._outstanding)
+		out['hedge_delay'] = self._get_hedge_delay()
+		self._lock.release()
+		return out
+
+	# This method is a blocking method that ensures that all asynchronous
+	# publishing is complete prior to returning. Hedges that were not sent
+	# yet are dropped since their originals are completed here anyway, while
+	# publishes that fail over to another replica in the meantime are waited
+	# for as well.
+	def wait_all_sent(self):
+		self._lock.acquire()
+		self._hedge_queue = list()
+		self._lock.release()
+		while True:
+			for client in self.clients:
+				client.wait_all_sent()
+			self._lock.acquire()
+			outstanding = sum(self._outstanding)
+			self._lock.release()
+			if outstanding == 0:
+				break
+
+	# DEPRECATED: The finish method is now deprecated in favor of the more
+	# descriptive wait_all_sent() method.
+	def finish(self):
+		self.wait_all_sent()
+
+	# Close each of the replica clients after all asynchronous publishing is
+	# complete.
+	def close(self):
+		self._lock.acquire()
+		self.closed = True
+		self._hedge_cond.notify()
+		self._lock.release()
+		self.wait_all_sent()
+		for client in self.clients:
+			client.close()
+
+	# An internal method for verifying that the instance has not been closed.
+	def _verify_not_closed(self):
+		if self.closed:
+			raise ValueError('replicapubcontrolclient instance is closed')
+
+	# An internal method for starting the publish of the specified item and
+	# scheduling its hedge.
+	def _start(self, channel, item, callback):
+		attempt = {'channel': channel, 'item': item, 'callback': callback,
+				'tried': set(), 'in_flight': 0, 'done': False,
+				'start': time.time()}
+		self._lock.acquire()
+		self._stats['publishes'] += 1
+		index = self._select(attempt)
+		delay = None
+		if getattr(item, 'id', None) and len(self.clients) > 1:
+			delay = self._get_hedge_delay()
+		if delay is not None:
+			self._schedule_hedge(attempt, attempt['start'] + delay)
+		self._lock.release()
+		self._send(attempt, index)
+
+	# An internal method for selecting the replica with the fewest
+	# outstanding requests relative to its weight among the replicas that
+	# were not yet tried for the specified attempt. The selected replica is
+	# marked as tried and as having an outstanding request. Returns None if
+	# every replica was tried. Must be called while holding the lock.
+	def _select(self, attempt):
+		best = None
+		best_load = None
+		for index in range(0, len(self.clients)):
+			if index in attempt['tried']:
+				continue
+			load = (self._outstanding[index] + 1) / float(self._weights[index])
+			if best is None or load < best_load:
+				best = index
+				best_load = load
+		if best is not None:
+			attempt['tried'].add(best)
+			attempt['in_flight'] += 1
+			self._outstanding[best] += 1
+		return best
+
+	# An internal method for publishing the specified attempt on the replica
+	# with the specified index.
+	def _send(self, attempt, index):
+		def callback(success, message):
+			self._on_result(attempt, index, success, message)
+		try:
+			self.clients[index].publish(attempt['channel'], attempt['item'],
+					blocking=False, callback=callback)
+		except Exception as e:
+			callback(False, str(e))
+
+	# An internal method for handling the result of publishing the specified
+	# attempt on the replica with the specified index.
+	def _on_result(self, attempt, index, success, message):
+		retry = None
+		report = False
+		self._lock.acquire()
+		self._outstanding[index] -= 1
+		attempt['in_flight'] -= 1
+		if not attempt['done']:
+			if success:
+				self._latencies.append(time.time() - attempt['start'])
+				attempt['done'] = True
+				report = True
+			elif self._failover:
+				retry = self._select(attempt)
+				if retry is not None:
+					self._stats['failovers'] += 1
+			if not success and retry is None and attempt['in_flight'] == 0:
+				attempt['done'] = True
+				report = True
+		self._lock.release()
+		if retry is not None:
+			self._send(attempt, retry)
+		elif report and attempt['callback']:
+			attempt['callback'](success, message)
+
+	# An internal method for getting the delay after which publishes are
+	# hedged, or None if hedging is disabled or there are not enough latency
+	# samples yet. Must be called while holding the lock.
+	def _get_hedge_delay(self):
+		if (self._hedge_percentile is None or
+				len(self._latencies) < self._min_samples):
+			return None
+		latencies = sorted(self._latencies)
+		pos = int(len(latencies) * self._hedge_percentile / 100.0)
+		return max(self._hedge_min_delay,
+				latencies[min(pos, len(latencies) - 1)])
+
+	# An internal method for scheduling the hedge of the specified attempt
+	# at the specified time on the hedging thread, which is started on first
+	# use. Must be called while holding the lock.
+	def _schedule_hedge(self, attempt, deadline):
+		self._hedge_seq += 1
+		heapq.heappush(self._hedge_queue, (deadline, self._hedge_seq, attempt))
+		if self._hedge_thread is None:
+			self._hedge_thread = threading.Thread(target=self._hedge_worker)
+			self._hedge_thread.daemon = True
+			self._hedge_thread.start()
+		self._hedge_cond.notify()
+
+	# An internal method that is meant to run as a separate thread and send
+	# the hedges whose deadlines passed while their attempts are still in
+	# progress.
+	def _hedge_worker(self):
+		self._lock.acquire()
+		while not self.closed:
+			if not self._hedge_queue:
+				self._hedge_cond.wait()
+				continue
+			deadline = self._hedge_queue[0][0]
+			now = time.time()
+			if deadline > now:
+				self._hedge_cond.wait(deadline - now)
+				continue
+			attempt = heapq.heappop(self._hedge_queue)[2]
+			index = self._hedge(attempt)
+			if index is not None:
+				self._lock.release()
+				self._send(attempt, index)
+				self._lock.acquire()
+		self._lock.release()
+
+	# An internal method for selecting the replica that the specified attempt
+	# is hedged to, or None if the attempt no longer needs a hedge. Must be
+	# called while holding the lock.
+	def _hedge(self, attempt):
+		if attempt['done']:
+			return None
+		index = self._select(attempt)
+		if index is not None:
+			self._stats['hedged'] += 1
+		return index
@@ -0,0 +1,199 @@
+#    sharedpubsubmonitor.py
+#    ~~~~~~~~~
+#    This module implements the SharedPubSubMonitor class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import json
+import threading
+import logging
+from .pubsubmonitor import PubSubMonitor
+
+logger = logging.getLogger(__name__)
+
+# The process-wide registry of running monitors keyed by base stream URI and
+# credentials.
+_monitors = dict()
+_lock = threading.Lock()
+
+# The _MonitorEntry class is used internally for sharing a single
+# PubSubMonitor instance between the SharedPubSubMonitor instances that were
+# created with the same base stream URI and credentials. The subscription
+# events of the monitor are fanned out to each of them. The entry keeps the
+# set of channels that were announced so far, which is replayed to instances
+# that are registered while the monitor is already running.
+class _MonitorEntry(object):
+	def __init__(self, key):
+		self.key = key
+		self.monitor = None
+		self.refs = 0
+		self._handles = tuple()
+		self._channels = set()
+		self._delivery_lock = threading.RLock()
+
+	# Register the specified SharedPubSubMonitor instance and announce the
+	# channels that are currently subscribed to it.
+	def add(self, handle):
+		self._delivery_lock.acquire()
+		try:
+			self._handles = self._handles + (handle,)
+			events = [('sub', channel) for channel in self._channels]
+			if events:
+				handle._deliver_events(events)
+		finally:
+			self._delivery_lock.release()
+
+	# Unregister the specified SharedPubSubMonitor instance.
+	def remove(self, handle):
+		self._delivery_lock.acquire()
+		self._handles = tuple(h for h in self._handles if h is not handle)
+		self._delivery_lock.release()
+
+	# Fan the specified list of (event type, channel) tuples out to each of
+	# the registered instances. Used as the batch callback of the monitor.
+	def deliver(self, events):
+		self._delivery_lock.acquire()
+		try:
+			for event_type, channel in events:
+				if event_type == 'sub':
+					self._channels.add(channel)
+				else:
+					self._channels.discard(channel)
+			for handle in self._handles:
+				handle._deliver_events(events)
+		finally:
+			self._delivery_lock.release()
+
+# The SharedPubSubMonitor class monitors subscriptions to channels via an
+# HTTP interface like the PubSubMonitor class, except that all instances in
+# the process that are created with the same base stream URI and credentials
+# share a single PubSubMonitor instance along with its stream connection and
+# subscription state. The shared monitor is started by the first instance
+# and closed once the last instance using it is closed. An instance that is
+# created while the shared monitor is running is passed a 'sub' event for
+# each channel that is already subscribed to.
+class SharedPubSubMonitor(object):
+
+	# Initialize with the same parameters as the PubSubMonitor class. If an
+	# asyncio event loop is specified then the shared monitor is an
+	# AsyncPubSubMonitor instance running on that loop, and if loop is set to
+	# True then it runs on the loop that is shared by all such instances.
+	# Instances are only shared between instances that specify the same
+	# loop and the same state file (see the PubSubMonitor class).
+	def __init__(self, base_stream_uri, auth_jwt_claim=None, auth_jwt_key=None, callback=None, auth_bearer=None,
+			batch_callback=None, loop=None, state_file=None):
+		self._callback = callback
+		self._batch_callback = batch_callback
+		self._closed = False
+		key = SharedPubSubMonitor._get_key(base_stream_uri, auth_jwt_claim,
+				auth_jwt_key, auth_bearer) + (loop, state_file)
+		_lock.acquire()
+		try:
+			entry = _monitors.get(key)
+			if entry is None or entry.monitor.is_closed():
+				entry = _MonitorEntry(key)
+				if loop is None:
+					entry.monitor = PubSubMonitor(base_stream_uri,
+							auth_jwt_claim, auth_jwt_key, None, auth_bearer,
+							entry.deliver, state_file)
+				else:
+					# imported here since the module requires Python 3
+					from .asyncpubsubmonitor import AsyncPubSubMonitor
+					if loop is True:
+						loop = None
+					entry.monitor = AsyncPubSubMonitor(base_stream_uri,
+							auth_jwt_claim, auth_jwt_key, None, auth_bearer,
+							entry.deliver, loop, state_file)
+				_monitors[key] = entry
+				logger.debug('started shared monitor for %s', base_stream_uri)
+			entry.refs += 1
+			self._entry = entry
+		finally:
+			_lock.release()
+		# the registry lock is not held while the channels are replayed so
+		# that callbacks may create and close instances
+		entry.add(self)
+
+	# Determine if the specified channel has been subscribed to.
+	def is_channel_subscribed_to(self, channel):
+		return self._entry.monitor.is_channel_subscribed_to(channel)
+
+	# Determine if any channel that starts with the specified prefix has
+	# been subscribed to.
+	def is_prefix_subscribed_to(self, prefix):
+		return self._entry.monitor.is_prefix_subscribed_to(prefix)
+
+	# Get the number of subscribed channels that start with the specified
+	# prefix, or of all subscribed channels if no prefix is specified.
+	def count_subscribed_channels(self, prefix=None):
+		return self._entry.monitor.count_subscribed_channels(prefix)
+
+	# Get a sorted list of the subscribed channels that start with the
+	# specified prefix, or of all subscribed channels if no prefix is
+	# specified.
+	def get_subscribed_channels(self, prefix=None):
+		return self._entry.monitor.get_subscribed_channels(prefix)
+
+	# Get a sorted list of the subscribed channels that match the specified
+	# shell-style pattern (see the ChannelIndex class).
+	def get_subscribed_channels_matching(self, pattern):
+		return self._entry.monitor.get_subscribed_channels_matching(pattern)
+
+	# Close this instance. The shared monitor is closed once no other
+	# instance uses it, and blocking only applies in that case.
+	def close(self, blocking=False):
+		entry = self._entry
+		last = False
+		_lock.acquire()
+		if not self._closed:
+			self._closed = True
+			self._callback = None
+			self._batch_callback = None
+			entry.refs -= 1
+			if entry.refs == 0:
+				if _monitors.get(entry.key) is entry:
+					del _monitors[entry.key]
+				last = True
+		else:
+			entry = None
+		_lock.release()
+		if entry is not None:
+			entry.remove(self)
+		if last:
+			entry.monitor.close(blocking)
+
+	# Determine if this instance or the shared monitor is closed.
+	def is_closed(self):
+		return self._closed or self._entry.monitor.is_closed()
+
+	# An internal method for passing the specified list of (event type,
+	# channel) tuples to the batch callback and then to the callback one
+	# event at a time.
+	def _deliver_events(self, events):
+		batch_callback = self._batch_callback
+		if batch_callback:
+			try:
+				batch_callback(events)
+			except Exception:
+				logger.exception('error calling batch callback')
+		callback = self._callback
+		if callback:
+			for event_type, channel in events:
+				try:
+					callback(event_type, channel)
+				except Exception:
+					logger.exception('error calling callback')
+
+	# An internal method for getting the registry key for the specified base
+	# stream URI and credentials.
+	@staticmethod
+	def _get_key(base_stream_uri, auth_jwt_claim, auth_jwt_key, auth_bearer):
+		if base_stream_uri[-1:] != '/':
+			base_stream_uri += '/'
+		if auth_bearer:
+			return (base_stream_uri, None, None, auth_bearer)
+		if auth_jwt_claim:
+			return (base_stream_uri, json.dumps(auth_jwt_claim,
+					sort_keys=True, default=repr), auth_jwt_key, None)
+		return (base_stream_uri, None, None, None)
@@ -0,0 +1,231 @@
+#    tnetstringcodec.py
+#    ~~~~~~~~~
+#    This module implements the tnetstring encoding and decoding methods.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from .utilities import is_python3, collections
+
+if is_python3:
+	_text_type = str
+	_binary_types = (bytes, bytearray)
+	_integer_types = (int,)
+else:
+	_text_type = unicode
+	_binary_types = (str, bytearray)
+	_integer_types = (int, long)
+
+# The C-accelerated backend shipped with the tnetstring package (the
+# _tnetstring extension module). It is resolved on first use and is set to
+# False if it is not installed.
+_c_backend = None
+
+# Encode the specified value as a tnetstring and return it as bytes. Text
+# values (including dict keys) are encoded as UTF8 while serializing, so the
+# value does not need to be passed through _ensure_utf8 first. Byte strings
+# are written as-is. The C-accelerated backend is used when it is installed
+# and the value only contains the types that it supports.
+def dumps(value):
+	backend = _get_c_backend()
+	if backend:
+		try:
+			value = _to_binary_tree(value)
+		except ValueError:
+			pass
+		else:
+			return backend.dumps(value)
+	parts = list()
+	_encode(parts, value)
+	return b''.join(parts)
+
+# Encode the specified value as a tnetstring by appending it to the specified
+# bytearray.
+def dump_into(buf, value):
+	parts = list()
+	_encode(parts, value)
+	buf += b''.join(parts)
+
+# Decode the specified tnetstring. Strings are returned as bytes. The
+# C-accelerated backend is used when it is installed.
+def loads(data):
+	backend = _get_c_backend()
+	if backend:
+		return backend.loads(bytes(data))
+	value, end = _decode(memoryview(bytes(data)), 0)
+	return value
+
+# An internal method for resolving the C-accelerated backend.
+def _get_c_backend():
+	global _c_backend
+	if _c_backend is None:
+		try:
+			from tnetstring import _tnetstring
+			_c_backend = _tnetstring
+		except ImportError:
+			_c_backend = False
+	return _c_backend
+
+# An internal method for copying the specified value with its text values
+# (including dict keys) encoded as UTF8, which is the form accepted by the
+# C-accelerated backend. Only the exact types produced by Item.export are
+# handled; an error is raised for anything else, which is left to the pure
+# Python encoder.
+def _to_binary_tree(value):
+	t = type(value)
+	if t is _text_type:
+		return value.encode('utf-8')
+	if t is dict:
+		return dict((_to_binary_tree(k), _to_binary_tree(v))
+				for k, v in value.items())
+	if t is list or t is tuple:
+		return [_to_binary_tree(v) for v in value]
+	if (t is bytes or t is bool or t is float or t in _integer_types or
+			value is None):
+		return value
+	raise ValueError('type not supported by the c backend: %s' % t.__name__)
+
+# The encoders append the parts of the encoded value to the specified list
+# and return the number of bytes appended. The parts are only joined once
+# the whole value has been encoded.
+def _encode(parts, value):
+	encoder = _encoders.get(type(value))
+	if encoder is None:
+		encoder = _find_encoder(value)
+	return encoder(parts, value)
+
+def _encode_text(parts, value):
+	return _encode_binary(parts, value.encode('utf-8'))
+
+def _encode_binary(parts, value):
+	header = str(len(value)).encode('ascii') + b':'
+	parts.append(header)
+	parts.append(value)
+	parts.append(b',')
+	return len(header) + len(value) + 1
+
+def _encode_bool(parts, value):
+	if value:
+		parts.append(b'4:true!')
+		return 7
+	parts.append(b'5:false!')
+	return 8
+
+def _encode_integer(parts, value):
+	data = str(int(value)).encode('ascii')
+	data = str(len(data)).encode('ascii') + b':' + data + b'#'
+	parts.append(data)
+	return len(data)
+
+def _encode_float(parts, value):
+	data = repr(float(value)).encode('ascii')
+	data = str(len(data)).encode('ascii') + b':' + data + b'^'
+	parts.append(data)
+	return len(data)
+
+def _encode_none(parts, value):
+	parts.append(b'0:~')
+	return 3
+
+# The length of a container is only known after its elements have been
+# encoded, so a slot is reserved for its header and filled in afterwards.
+def _encode_dict(parts, value):
+	index = len(parts)
+	parts.append(None)
+	length = 0
+	for k, v in value.items():
+		length += _encode(parts, k)
+		length += _encode(parts, v)
+	header = str(length).encode('ascii') + b':'
+	parts[index] = header
+	parts.append(b'}')
+	return len(header) + length + 1
+
+def _encode_list(parts, value):
+	index = len(parts)
+	parts.append(None)
+	length = 0
+	for v in value:
+		length += _encode(parts, v)
+	header = str(length).encode('ascii') + b':'
+	parts[index] = header
+	parts.append(b']')
+	return len(header) + length + 1
+
+_encoders = {
+	_text_type: _encode_text,
+	bool: _encode_bool,
+	float: _encode_float,
+	type(None): _encode_none,
+	dict: _encode_dict,
+	list: _encode_list,
+	tuple: _encode_list
+}
+for t in _binary_types:
+	_encoders[t] = _encode_binary
+for t in _integer_types:
+	_encoders[t] = _encode_integer
+
+# An internal method for finding the encoder of a value whose exact type is
+# not registered, such as subclasses and other mapping or iterable types.
+def _find_encoder(value):
+	if isinstance(value, bool):
+		return _encode_bool
+	elif isinstance(value, _text_type):
+		return _encode_text
+	elif isinstance(value, _binary_types):
+		return _encode_binary
+	elif isinstance(value, _integer_types):
+		return _encode_integer
+	elif isinstance(value, float):
+		return _encode_float
+	elif isinstance(value, collections.Mapping):
+		return _encode_dict
+	elif isinstance(value, collections.Iterable):
+		return _encode_list
+	raise ValueError('type not serializable: %s' % type(value).__name__)
+
+# An internal method for decoding the tnetstring starting at the specified
+# offset. Returns a tuple of (value, offset after the value).
+def _decode(data, offset):
+	colon = offset
+	while data[colon:colon + 1] != b':':
+		if colon - offset > 9 or colon >= len(data):
+			raise ValueError('not a tnetstring: invalid length prefix')
+		colon += 1
+	length = int(data[offset:colon].tobytes())
+	start = colon + 1
+	end = start + length
+	if end >= len(data):
+		raise ValueError('not a tnetstring: invalid length prefix')
+	payload = data[start:end]
+	t = data[end:end + 1].tobytes()
+	if t == b',':
+		value = payload.tobytes()
+	elif t == b'#':
+		value = int(payload.tobytes())
+	elif t == b'^':
+		value = float(payload.tobytes())
+	elif t == b'!':
+		value = payload.tobytes() == b'true'
+	elif t == b'~':
+		if length != 0:
+			raise ValueError('not a tnetstring: invalid null literal')
+		value = None
+	elif t == b']':
+		value = []
+		pos = start
+		while pos < end:
+			item, pos = _decode(data, pos)
+			value.append(item)
+	elif t == b'}':
+		value = {}
+		pos = start
+		while pos < end:
+			key, pos = _decode(data, pos)
+			if pos >= end:
+				raise ValueError('not a tnetstring: unbalanced dict')
+			value[key], pos = _decode(data, pos)
+	else:
+		raise ValueError('not a tnetstring: invalid type tag')
+	return (value, end + 1)
@@ -6,35 +6,83 @@
 #    :license: MIT, see LICENSE for more details.
 
 import sys
-import jwt
 import calendar
 import copy
+import json
+import importlib
+import threading
 from datetime import datetime
 
-try:
-	import zmq
-except ImportError:
-	zmq = None
+is_python3 = sys.version_info >= (3,)
 
-try:
-	import tnetstring
-except ImportError:
-	tnetstring = None
+# The _LazyModule class is used internally for deferring the import of heavy
+# or optional dependencies (requests, jwt, zmq, aiohttp) until they are
+# first used. Attribute access on an instance imports the underlying module
+# and an instance evaluates to False if the module is not installed.
+class _LazyModule(object):
 
-is_python3 = sys.version_info >= (3,)
+	# Initialize with the name of the module to import on first use.
+	def __init__(self, name):
+		self._name = name
+		self._module = None
+		self._import_error = None
+		self._lock = threading.Lock()
+
+	# Return the imported module or raise an ImportError if the module
+	# is not available.
+	def _load(self):
+		if self._module is None:
+			self._lock.acquire()
+			try:
+				if self._module is None and self._import_error is None:
+					try:
+						self._module = importlib.import_module(self._name)
+					except ImportError as e:
+						self._import_error = e
+			finally:
+				self._lock.release()
+			if self._module is None:
+				raise self._import_error
+		return self._module
+
+	# Determine if the module has already been imported.
+	def _is_loaded(self):
+		return self._module is not None
+
+	def __getattr__(self, attr):
+		return getattr(self._load(), attr)
+
+	def __bool__(self):
+		try:
+			self._load()
+		except ImportError:
+			return False
+		return True
+
+	__nonzero__ = __bool__
+
+requests = _LazyModule('requests')
+jwt = _LazyModule('jwt')
+zmq = _LazyModule('zmq')
+aiohttp = _LazyModule('aiohttp')
 
 if is_python3:
 	import collections.abc as collections
 else:
 	import collections
 
-# An internal method to verify that the zmq and tnetstring packages are
-# available. If not an exception is raised.
+# An internal method to verify that the zmq package is available. If not an
+# exception is raised. Note that tnetstring encoding is built in and does not
+# require the tnetstring package.
 def _verify_zmq():
-	if zmq is None:
+	if not zmq:
 		raise ValueError('zmq package must be installed')
-	if tnetstring is None:
-		raise ValueError('tnetstring package must be installed')
+
+# An internal method to verify that the aiohttp package is available. If
+# not an exception is raised.
+def _verify_aiohttp():
+	if not aiohttp:
+		raise ValueError('aiohttp package must be installed')
 
 # An internal method for encoding the specified value as UTF8 only
 # if it is unicode. This method acts recursively and will process nested
@@ -74,6 +122,16 @@ def _ensure_unicode(value):
 		return type(value)(map(_ensure_unicode, value))
 	return value
 
+# An internal method for serializing the specified value as JSON and
+# returning the result encoded as UTF8.
+def _json_dumps_utf8(value):
+	out = json.dumps(value)
+	if is_python3:
+		return out.encode('utf-8')
+	if isinstance(out, unicode):
+		return out.encode('utf-8')
+	return out
+
 # An internal method for generating a JWT authorization header based on
 # the specified claim and key.
 def _gen_auth_jwt_header(claim, key):
@@ -86,3 +144,28 @@ def _gen_auth_jwt_header(claim, key):
 	token = _ensure_unicode(jwt.encode(claim, key))
 
 	return 'Bearer ' + token
+
+# An internal method for applying the specified list of ('sub' or 'unsub',
+# channel) events to the specified set of subscribed channels without
+# modifying it, so that the set can be read without a lock while the events
+# are applied. The set is copied on the first change. Returns a tuple of the
+# resulting set, which is the specified set if nothing changed, and the list
+# of events that changed it.
+def _apply_subscription_events(channels, events):
+	out = channels
+	applied = list()
+	for event_type, channel in events:
+		if event_type == 'sub':
+			if channel in out:
+				continue
+			if out is channels:
+				out = set(channels)
+			out.add(channel)
+		else:
+			if channel not in out:
+				continue
+			if out is channels:
+				out = set(channels)
+			out.remove(channel)
+		applied.append((event_type, channel))
+	return (out, applied)
@@ -0,0 +1,163 @@
+#    workerpool.py
+#    ~~~~~~~~~
+#    This module implements the WorkerPool class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+import time
+from collections import deque
+
+# The WorkerPool class is used internally for running blocking calls
+# concurrently on a shared set of daemon threads. Threads are started on
+# demand up to the configured maximum and are then kept around waiting for
+# further work. Calls that are still running when their timeout expires do
+# not count against the maximum, so that they cannot hold up later calls.
+class WorkerPool(object):
+
+	# Initialize with the maximum number of worker threads.
+	def __init__(self, max_threads=16):
+		self.max_threads = max_threads
+		self._cond = threading.Condition()
+		self._queue = deque()
+		self._threads = list()
+		self._running = dict()
+		self._detached = set()
+		self._idle = 0
+		self._starting = 0
+
+	# Run each of the specified methods on the pool and block until all of
+	# them are complete or until the optional timeout in seconds expires.
+	# Returns a list with an outcome for each method in the same order. Each
+	# outcome is a tuple of (True, return value) or (False, error message),
+	# or None if the method did not complete before the timeout. Methods
+	# that did not start before the timeout are not run at all, and the
+	# threads of the methods that are still running leave the pool once
+	# they complete while replacement threads are started as needed.
+	def run(self, funcs, timeout=None):
+		results = [None] * len(funcs)
+		state = {'pending': len(funcs)}
+		done_cond = threading.Condition()
+
+		def make_task(index, func):
+			def task():
+				try:
+					result = (True, func())
+				except Exception as e:
+					try:
+						result = (False, e.message)
+					except AttributeError:
+						result = (False, str(e))
+				done_cond.acquire()
+				results[index] = result
+				state['pending'] -= 1
+				if state['pending'] == 0:
+					done_cond.notify()
+				done_cond.release()
+			return task
+
+		tasks = [make_task(n, func) for n, func in enumerate(funcs)]
+		for task in tasks:
+			self._submit(task)
+
+		deadline = None
+		if timeout is not None:
+			deadline = time.time() + timeout
+		done_cond.acquire()
+		while state['pending'] > 0:
+			if deadline is None:
+				done_cond.wait()
+			else:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				done_cond.wait(remaining)
+		out = list(results)
+		done_cond.release()
+		if None in out:
+			self._abandon([tasks[n] for n, result in enumerate(out)
+					if result is None])
+		return out
+
+	# An internal method for abandoning the specified tasks after their
+	# timeout expired. Queued tasks are dropped, and the threads running the
+	# others are detached from the pool so that they exit once their task
+	# completes.
+	def _abandon(self, tasks):
+		self._cond.acquire()
+		for task in tasks:
+			thread = self._running.pop(task, None)
+			if thread is not None:
+				self._threads.remove(thread)
+				self._detached.add(thread)
+			else:
+				try:
+					self._queue.remove(task)
+				except ValueError:
+					# the task completed in the meantime
+					pass
+		self._start_threads()
+		self._cond.release()
+
+	# An internal method for queueing the specified task and starting a new
+	# worker thread if there are more queued tasks than idle threads and the
+	# maximum has not been reached.
+	def _submit(self, task):
+		self._cond.acquire()
+		self._queue.append(task)
+		if not self._start_threads():
+			self._cond.notify()
+		self._cond.release()
+
+	# An internal method for starting worker threads while there are more
+	# queued tasks than idle threads and the maximum has not been reached.
+	# Returns True if any thread was started. Must be called while holding
+	# the lock.
+	def _start_threads(self):
+		started = False
+		while (len(self._queue) > self._idle + self._starting and
+				len(self._threads) < self.max_threads):
+			thread = threading.Thread(target=self._worker)
+			thread.daemon = True
+			self._threads.append(thread)
+			self._starting += 1
+			thread.start()
+			started = True
+		return started
+
+	# An internal method that is meant to run as a separate thread and
+	# execute queued tasks. The thread exits if it was detached from the
+	# pool while running a task.
+	def _worker(self):
+		current = threading.current_thread()
+		self._cond.acquire()
+		self._starting -= 1
+		while True:
+			while len(self._queue) == 0:
+				self._idle += 1
+				self._cond.wait()
+				self._idle -= 1
+			task = self._queue.popleft()
+			self._running[task] = current
+			self._cond.release()
+			task()
+			self._cond.acquire()
+			self._running.pop(task, None)
+			if current in self._detached:
+				self._detached.discard(current)
+				self._cond.release()
+				return
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Get the process-wide WorkerPool instance, creating it on first use.
+def get_shared_pool():
+	global _pool
+	_pool_lock.acquire()
+	if _pool is None:
+		_pool = WorkerPool()
+	pool = _pool
+	_pool_lock.release()
+	return pool
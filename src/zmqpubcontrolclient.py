@@ -8,18 +8,10 @@
 import threading
 import atexit
 import timeit
-from .utilities import _ensure_utf8, _ensure_unicode, _verify_zmq
+from collections import deque
+from .utilities import _ensure_utf8, _ensure_unicode, _verify_zmq, zmq
 from .zmqpubcontroller import ZmqPubController
-
-try:
-	import zmq
-except ImportError:
-	zmq = None
-
-try:
-	import tnetstring
-except ImportError:
-	tnetstring = None
+from . import tnetstringcodec
 
 # The global list of ZmqPubControlClient instances used to ensure that each
 # instance is properly closed on exit.
@@ -56,10 +48,12 @@ class ZmqPubControlClient(object):
 	# Optionally specify a ZMQ context to use otherwise the global ZMQ context
 	# will be used. If a discovery callback is specified, then that callback
 	# will be executed with the PUSH / PUB URIs and require_subscribers setting
-	# when discovery successfully completes.
+	# when discovery successfully completes. The max_pending parameter limits
+	# the number of non-blocking publishes that can be queued while discovery
+	# is still in progress.
 	def __init__(self, uri, push_uri=None, pub_uri=None,
 			require_subscribers=False, disable_pub=False, sub_callback=None, 
-			context=None, discovery_callback=None):
+			context=None, discovery_callback=None, max_pending=1000):
 		_verify_zmq()
 		self.uri = uri
 		self.pub_uri = pub_uri
@@ -80,7 +74,10 @@ class ZmqPubControlClient(object):
 		self._push_sock = None
 		self._pub_controller = None
 		self._discovery_callback = discovery_callback
-		self._publish_threads = list()
+		self._max_pending = max_pending
+		self._pending = deque()
+		self._pending_lock = threading.Lock()
+		self._pending_thread = None
 		if ((self.push_uri and not require_subscribers) or
 				(self.pub_uri and require_subscribers)):
 			self.connect_zmq()
@@ -92,30 +89,39 @@ class ZmqPubControlClient(object):
 		_lock.release()
 
 	# The publish method for publishing the specified item to the specified
-	# channel on the configured ZMQ endpoint. A non-blocking publish is
-	# executed on a separate thread. Note that ZMQ publishes themselves are
-	# non-blocking and will always result in a successful result being
-	# sent to the callback (if a callback is specified). A failed publish
-	# can only result from a failure to discover the PUSH / PUB URIs from
-	# the command URI (if discovery occurs).
+	# channel on the configured ZMQ endpoint. Non-blocking publishes made
+	# before discovery completes are queued and published in order by a
+	# single thread once it completes, or all failed if it fails. Note that
+	# ZMQ publishes themselves are non-blocking and will always result in a
+	# successful result being sent to the callback (if a callback is
+	# specified). A failed publish can only result from a failure to discover
+	# the PUSH / PUB URIs from the command URI (if discovery occurs) or from
+	# the queue of pending publishes being full.
 	def publish(self, channel, item, blocking=False, callback=None):
 		self._verify_not_closed()
-		if self._discovery_completed or blocking:
+		if blocking or (self._discovery_completed and
+				self._pending_thread is None):
 			self._publish(channel, item, blocking, callback)
-		else:
-			thread = threading.Thread(target=self._publish,
-				args=(channel, item, blocking, callback))
+			return
+		self._pending_lock.acquire()
+		if self._discovery_completed and self._pending_thread is None:
+			self._pending_lock.release()
+			self._publish(channel, item, blocking, callback)
+			return
+		if len(self._pending) >= self._max_pending:
+			self._pending_lock.release()
+			if callback:
+				callback(False, 'failed to publish: too many pending publishes')
+			return
+		self._pending.append((channel, item, callback))
+		thread = None
+		if self._pending_thread is None:
+			thread = threading.Thread(target=self._publish_pending)
 			thread.daemon = True
+			self._pending_thread = thread
+		self._pending_lock.release()
+		if thread:
 			thread.start()
-			self._lock.acquire()
-			self._publish_threads.append(thread)
-			_threads_to_remove = list()
-			for thread in self._publish_threads:
-				if not thread.is_alive():
-					_threads_to_remove.append(thread)
-			for thread in _threads_to_remove:
-				self._publish_threads.remove(thread)
-			self._lock.release()
 
 	# The close method is a blocking call that closes all ZMQ sockets prior
 	# to returning and allowing the consumer to proceed. This method also
@@ -123,11 +129,13 @@ class ZmqPubControlClient(object):
 	# ZmqPubControlClient instance cannot be used after calling this method.
 	def close(self):
 		self._verify_not_closed()
+		self._pending_lock.acquire()
+		thread = self._pending_thread
+		self._pending_lock.release()
+		if thread:
+			thread.join()
 		self._lock.acquire()
 		self.closed = True
-		for thread in self._publish_threads:
-			if thread.is_alive():
-				thread.join()
 		if self._pub_controller:
 			self._pub_controller.stop()
 			self._pub_controller._thread.join()
@@ -176,9 +184,8 @@ class ZmqPubControlClient(object):
 				if callback:
 					callback(True, '')
 				return
-			i = item.export(True, True)
 			channel = _ensure_utf8(channel)
-			self._send_to_zmq(i, channel)
+			self._send_to_zmq(item, channel)
 			if not blocking and callback:
 				callback(True, '')
 		except Exception as e:
@@ -187,6 +194,52 @@ class ZmqPubControlClient(object):
 			elif blocking:
 				raise ValueError('failed to publish: ' + str(e))
 
+	# An internal method for publishing the queued publishes on a separate
+	# thread. Discovery is awaited (or retried if it previously failed) and
+	# then the queued publishes are published in order, or failed with the
+	# discovery error. Publishes queued in the meantime are handled in the
+	# same way before the thread ends, so that none of them can be overtaken
+	# by a publish made after the queue was emptied.
+	def _publish_pending(self):
+		while True:
+			error = None
+			try:
+				self._discover_uris()
+			except Exception as e:
+				error = e
+			pending = self._take_pending()
+			while pending:
+				channel, item, callback = pending.popleft()
+				if error is None:
+					self._publish(channel, item, False, callback)
+				elif callback:
+					callback(False, 'failed to publish: ' + str(error))
+			if not self._has_pending():
+				return
+
+	# An internal method for taking the queued publishes. Returns an empty
+	# deque if there are none left, in which case the thread publishing them
+	# is considered to have ended.
+	def _take_pending(self):
+		self._pending_lock.acquire()
+		pending = self._pending
+		self._pending = deque()
+		if not pending:
+			self._pending_thread = None
+		self._pending_lock.release()
+		return pending
+
+	# An internal method for determining if publishes were queued while the
+	# previously queued publishes were handled. If there are none then the
+	# thread publishing them is considered to have ended.
+	def _has_pending(self):
+		self._pending_lock.acquire()
+		if not self._pending:
+			self._pending_thread = None
+		out = self._pending_thread is not None
+		self._pending_lock.release()
+		return out
+
 	# An internal method for ensuring that the ZMQ URIs are properly set
 	# relative to the require_subscribers and disable_pub booleans.
 	def _verify_uri_config(self):
@@ -200,16 +253,19 @@ class ZmqPubControlClient(object):
 			raise ValueError('sub_callback can only be specified when ' +
 					' require_subscribers is set to true')
 
-	# An internal method for publishing a ZMQ message to either the ZMQ
-	# push socket or ZmqPubController.
-	def _send_to_zmq(self, content, channel):
+	# An internal method for publishing the specified item to either the ZMQ
+	# push socket or ZmqPubController. Messages sent to the push socket carry
+	# the channel within the serialized item.
+	def _send_to_zmq(self, item, channel):
+		if self._push_sock:
+			content = item._export_tnetstring(channel)
+		else:
+			content = item._export_tnetstring()
 		self._lock.acquire()
 		if self._push_sock:
-			content[_ensure_utf8('channel')] = channel
-			self._push_sock.send(tnetstring.dumps(content))
+			self._push_sock.send(content)
 		else:
-			self._pub_controller.publish(channel,
-					tnetstring.dumps(content))
+			self._pub_controller.publish(channel, content)
 		self._lock.release()
 
 	# An internal method for verifying that the ZmqPubControlClient instance
@@ -245,13 +301,13 @@ class ZmqPubControlClient(object):
 			self._end_discovery(False)
 			raise ValueError('uri discovery request failed: pollout timeout')
 		req = {_ensure_utf8('method'): _ensure_utf8('get-zmq-uris')}
-		sock.send(tnetstring.dumps(req))
+		sock.send(tnetstringcodec.dumps(req))
 		elapsed = max(int(timeit.default_timer() * 1000) - start, 0)
 		if not sock.poll(max(3000 - elapsed, 0), zmq.POLLIN):
 			sock.close()
 			self._end_discovery(False)
 			raise ValueError('uri discovery request failed: pollin timeout')
-		resp = tnetstring.loads(sock.recv())
+		resp = tnetstringcodec.loads(sock.recv())
 		sock.close()
 		if (not resp.get(_ensure_utf8('success')) or
 				not resp.get(_ensure_utf8('value'))):
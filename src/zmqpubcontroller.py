@@ -7,15 +7,12 @@
 
 import threading
 import logging
-from .utilities import is_python3, _verify_zmq, _ensure_utf8
+from .channelindex import ChannelIndex
+from .utilities import (is_python3, _verify_zmq, _ensure_utf8,
+		_apply_subscription_events, zmq)
 
 logger = logging.getLogger(__name__)
 
-try:
-	import zmq
-except ImportError:
-	zmq = None
-
 # The ZmqPubController class facilitates the publishing of messages and the
 # monitoring of subscriptions via ZMQ PUB sockets. It utilizes control and
 # PUB ZMQ sockets where the control sockets provide a command interface while
@@ -26,11 +23,16 @@ class ZmqPubController(object):
 	# Initialize with a ZMQ context to use and callback where the callback
 	# accepts two parameters: the first parameter a string containing 'sub'
 	# or 'unsub' and the second parameter containing the subscription name.
-	def __init__(self, callback, zmq_context=None):
+	# Optionally specify a batch callback that is passed a list of ('sub' or
+	# 'unsub', subscription name) tuples for all of the subscription events
+	# that were pending on the PUB socket at once.
+	def __init__(self, callback, zmq_context=None, batch_callback=None):
 		_verify_zmq()
 		self.subscriptions = set()
+		self._subscription_index = ChannelIndex()
 		self._lock = threading.Lock()
 		self._callback = callback
+		self._batch_callback = batch_callback
 		self._context = zmq_context
 		if self._context is None:
 			self._context = zmq.Context.instance()
@@ -66,14 +68,32 @@ class ZmqPubController(object):
 	def stop(self):
 		self._command_control_sock.send(_ensure_utf8('\x03'))
 
-	# Determine if the specified channel has been subscribed to.
+	# Determine if the specified channel has been subscribed to. The
+	# subscriptions set is replaced rather than modified when changes are
+	# applied, so it is read here without taking the lock.
 	def is_channel_subscribed_to(self, channel):
-		found_channel = False
-		self._lock.acquire()
-		if channel in self.subscriptions:
-			found_channel = True
-		self._lock.release()
-		return found_channel
+		return channel in self.subscriptions
+
+	# Determine if any channel that starts with the specified prefix has
+	# been subscribed to.
+	def is_prefix_subscribed_to(self, prefix):
+		return self._subscription_index.has_prefix(prefix)
+
+	# Get the number of subscribed channels that start with the specified
+	# prefix, or of all subscribed channels if no prefix is specified.
+	def count_subscribed_channels(self, prefix=None):
+		return self._subscription_index.count(prefix)
+
+	# Get a sorted list of the subscribed channels that start with the
+	# specified prefix, or of all subscribed channels if no prefix is
+	# specified.
+	def get_subscribed_channels(self, prefix=None):
+		return self._subscription_index.get(prefix)
+
+	# Get a sorted list of the subscribed channels that match the specified
+	# shell-style pattern (see the ChannelIndex class).
+	def get_subscribed_channels_matching(self, pattern):
+		return self._subscription_index.match(pattern)
 
 	# This method is meant to run a separate thread and poll the ZMQ control
 	# socket for control messages and the pub socket for subscribe and
@@ -136,45 +156,62 @@ class ZmqPubController(object):
 			elif mtype == 0x03:
 				self._stop_monitoring = True
 
-	# An internal method for processing the pub socket messages. A subscribe
-	# message appends the subscription to the subscriptions list and
-	# executes the callback with a 'sub' event type, while an unsubscribe
-	# message removes the subscription from the subscriptions list and executes
-	# the callback with an 'unsub' event type.
-	def _process_pub_sock_messages(self, socks):
+	# An internal method for processing the pub socket messages. All of the
+	# messages that are pending on the PUB socket (up to max_batch) are
+	# received at once and applied to a copy of the subscriptions set, which
+	# then replaces it. A subscribe message adds the subscription to the set
+	# and results in a 'sub' event, while an unsubscribe message removes the
+	# subscription from the set and results in an 'unsub' event. The events
+	# are then passed to the callbacks.
+	def _process_pub_sock_messages(self, socks, max_batch=10000):
 		if dict(socks).get(self._pub_sock) == zmq.POLLIN:
-			m = self._pub_sock.recv()
-			if is_python3:
-				mtype = m[0]
-				item = m[1:]
+			messages = [self._pub_sock.recv()]
+			while len(messages) < max_batch:
 				try:
-					item = item.decode('utf-8')
-				except UnicodeDecodeError:
-					logger.warning('ignoring non-utf8 channel')
-					return
-			else:
-				mtype = ord(m[0])
-				item = m[1:]
-
-			logger.debug('got pub packet: %d [%s]' % (mtype, item))
-
-			if mtype == 0x01:
-				if item not in self.subscriptions:
-					if self._callback:
-						try:
-							self._callback('sub', item)
-						except Exception:
-							logger.exception('error calling callback')
-					self._lock.acquire()
-					self.subscriptions.add(item)
-					self._lock.release()
-			elif mtype == 0x00:
-				if item in self.subscriptions:
-					if self._callback:
-						try:
-							self._callback('unsub', item)
-						except Exception:
-							logger.exception('error calling callback')
-					self._lock.acquire()
-					self.subscriptions.remove(item)
-					self._lock.release()
+					messages.append(self._pub_sock.recv(zmq.NOBLOCK))
+				except zmq.Again:
+					break
+			events = list()
+			for m in messages:
+				if is_python3:
+					mtype = m[0]
+					item = m[1:]
+					try:
+						item = item.decode('utf-8')
+					except UnicodeDecodeError:
+						logger.warning('ignoring non-utf8 channel')
+						continue
+				else:
+					mtype = ord(m[0])
+					item = m[1:]
+
+				logger.debug('got pub packet: %d [%s]', mtype, item)
+
+				if mtype == 0x01:
+					events.append(('sub', item))
+				elif mtype == 0x00:
+					events.append(('unsub', item))
+			self._lock.acquire()
+			self.subscriptions, events = _apply_subscription_events(
+					self.subscriptions, events)
+			self._subscription_index.apply(events)
+			self._lock.release()
+			self._deliver_events(events)
+
+	# An internal method for passing the specified list of (event type,
+	# subscription name) tuples to the batch callback and then to the
+	# callback one event at a time.
+	def _deliver_events(self, events):
+		if not events:
+			return
+		if self._batch_callback:
+			try:
+				self._batch_callback(events)
+			except Exception:
+				logger.exception('error calling batch callback')
+		if self._callback:
+			for event_type, item in events:
+				try:
+					self._callback(event_type, item)
+				except Exception:
+					logger.exception('error calling callback')
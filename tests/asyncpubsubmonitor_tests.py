@@ -0,0 +1,202 @@
+import sys
+import json
+import asyncio
+import threading
+import unittest
+from base64 import b64encode
+
+sys.path.append('../')
+from src import utilities
+from src import asyncpubsubmonitor
+from src.asyncpubsubmonitor import AsyncPubSubMonitor
+from src.reconnectscheduler import ReconnectScheduler
+
+def encode_cursor(n):
+	return b64encode(('instance_%d' % n).encode('ascii')).decode('ascii')
+
+class ContentTestClass(object):
+	def __init__(self, chunks):
+		self.chunks = list(chunks)
+
+	async def readany(self):
+		if self.chunks:
+			return self.chunks.pop(0)
+		return b''
+
+class AiohttpResponseTestClass(object):
+	def __init__(self, status, body=None, chunks=None):
+		self.status = status
+		self.body = json.dumps(body).encode('utf-8')
+		self.content = ContentTestClass(chunks or [])
+		self.closed = False
+
+	async def read(self):
+		return self.body
+
+	def close(self):
+		self.closed = True
+
+class AiohttpTestModule(object):
+	class ClientError(Exception):
+		pass
+
+	class ClientTimeout(object):
+		def __init__(self, **kwargs):
+			self.kwargs = kwargs
+
+	class ClientSession(object):
+		responses = list()
+		uris = list()
+		sessions = list()
+
+		def __init__(self):
+			self.closed = False
+			AiohttpTestModule.ClientSession.sessions.append(self)
+
+		async def get(self, uri, headers=None, timeout=None):
+			AiohttpTestModule.ClientSession.uris.append(uri)
+			responses = AiohttpTestModule.ClientSession.responses
+			# block until there is a response or until cancelled
+			while not responses:
+				await asyncio.sleep(0.01)
+			return responses.pop(0)
+
+		async def close(self):
+			self.closed = True
+
+def stream_chunks(events):
+	data = b''.join(json.dumps(e).encode('utf-8') + b'\n' for e in events)
+	# split the stream in the middle of a line
+	return [data[:10], data[10:]]
+
+class TestAsyncPubSubMonitor(unittest.TestCase):
+	def setUp(self):
+		self.aiohttp = utilities.aiohttp
+		utilities.aiohttp = AiohttpTestModule
+		asyncpubsubmonitor.aiohttp = AiohttpTestModule
+		AiohttpTestModule.ClientSession.responses = list()
+		AiohttpTestModule.ClientSession.uris = list()
+		AiohttpTestModule.ClientSession.sessions = list()
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread(target=self.loop.run_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def tearDown(self):
+		utilities.aiohttp = self.aiohttp
+		asyncpubsubmonitor.aiohttp = self.aiohttp
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.loop.close()
+
+	def wait_for_uris(self, count):
+		for n in range(0, 500):
+			if len(AiohttpTestModule.ClientSession.uris) >= count:
+				return
+			threading.Event().wait(0.01)
+		self.fail('requests not made')
+
+	def test_verify_aiohttp(self):
+		utilities.aiohttp = None
+		with self.assertRaises(ValueError):
+			AsyncPubSubMonitor('http://localhost/', loop=self.loop)
+
+	def test_monitor(self):
+		AiohttpTestModule.ClientSession.responses = [
+				AiohttpResponseTestClass(200, chunks=stream_chunks([
+				{'item': {'channel': 'old', 'state': 'subscribed'},
+				'cursor': encode_cursor(1), 'prev_cursor': encode_cursor(0)},
+				{'item': {'channel': 'b', 'state': 'subscribed'},
+				'cursor': encode_cursor(3), 'prev_cursor': encode_cursor(2)},
+				{'item': {'channel': 'a', 'state': 'unsubscribed'},
+				'cursor': encode_cursor(4), 'prev_cursor': encode_cursor(3)}])),
+				AiohttpResponseTestClass(200, {'items': [{'channel': 'a',
+				'state': 'subscribed'}], 'last_cursor': encode_cursor(2)}),
+				AiohttpResponseTestClass(200, {'items': [],
+				'last_cursor': encode_cursor(2)})]
+		events = list()
+		monitor = AsyncPubSubMonitor('http://localhost', auth_bearer='token',
+				callback=lambda event_type, channel: events.append(
+				(event_type, channel)), loop=self.loop)
+		# the stream is reconnected after it ended
+		self.wait_for_uris(4)
+		uris = AiohttpTestModule.ClientSession.uris
+		self.assertEqual(uris[0], 'http://localhost/subscriptions/stream/')
+		self.assertEqual(uris[1], 'http://localhost/subscriptions/items/')
+		self.assertTrue(uris[2].startswith(
+				'http://localhost/subscriptions/items/?since=cursor'))
+		# the event preceding the historical fetch was skipped
+		self.assertEqual(events, [('sub', 'a'), ('sub', 'b'), ('unsub', 'a')])
+		self.assertTrue(monitor.is_channel_subscribed_to('b'))
+		self.assertFalse(monitor.is_channel_subscribed_to('a'))
+		self.assertEqual(monitor._last_cursor, encode_cursor(4))
+		monitor.close(blocking=True)
+		self.assertTrue(monitor.is_closed())
+		self.assertTrue(AiohttpTestModule.ClientSession.sessions[0].closed)
+
+	def test_history_not_found(self):
+		monitor = AsyncPubSubMonitor('http://localhost/', loop=self.loop)
+		monitor._channels = set(['a'])
+		AiohttpTestModule.ClientSession.responses.extend([
+				AiohttpResponseTestClass(200),
+				AiohttpResponseTestClass(404)])
+		self.wait_for_uris(3)
+		self.assertEqual(monitor._channels, set())
+		self.assertEqual(monitor._last_cursor, None)
+		monitor.close(blocking=True)
+
+	def test_stream_error(self):
+		AiohttpTestModule.ClientSession.responses = [
+				AiohttpResponseTestClass(503),
+				AiohttpResponseTestClass(403)]
+		monitor = AsyncPubSubMonitor('http://localhost/', loop=self.loop)
+		monitor._stopped.wait(5)
+		self.assertTrue(monitor._stopped.is_set())
+		self.assertTrue(monitor.is_closed())
+		self.assertEqual(len(AiohttpTestModule.ClientSession.uris), 2)
+
+	def test_fetch_scheduled(self):
+		scheduler = ReconnectScheduler(1)
+		scheduler.acquire_fetch()
+		AsyncPubSubMonitor.reconnect_scheduler = scheduler
+		try:
+			AiohttpTestModule.ClientSession.responses = [
+					AiohttpResponseTestClass(200)]
+			monitor = AsyncPubSubMonitor('http://localhost/', loop=self.loop)
+			for n in range(0, 500):
+				if scheduler.get_stats()['waiting']:
+					break
+				threading.Event().wait(0.01)
+			self.assertEqual(scheduler.get_stats(), {'running': 1,
+					'waiting': 1})
+			# the fetch that was waiting when the monitor was closed is
+			# released once it is allowed to start
+			monitor.close(blocking=True)
+			scheduler.release_fetch()
+			for n in range(0, 500):
+				if not scheduler.get_stats()['running']:
+					break
+				threading.Event().wait(0.01)
+			self.assertEqual(scheduler.get_stats(), {'running': 0,
+					'waiting': 0})
+			self.assertEqual(len(AiohttpTestModule.ClientSession.uris), 1)
+		finally:
+			del AsyncPubSubMonitor.reconnect_scheduler
+
+	def test_aclose(self):
+		async def run():
+			monitor = AsyncPubSubMonitor('http://localhost/')
+			self.assertTrue(monitor._loop is asyncpubsubmonitor._get_shared_loop())
+			self.assertFalse(monitor._is_loop_thread())
+			monitor.close(blocking=True)
+			monitor = AsyncPubSubMonitor('http://localhost/',
+					loop=asyncio.get_running_loop())
+			await asyncio.sleep(0)
+			self.assertTrue(monitor._is_loop_thread())
+			await monitor.aclose()
+			return monitor
+		monitor = asyncio.run_coroutine_threadsafe(run(), self.loop).result(5)
+		self.assertTrue(monitor._stopped.is_set())
+
+if __name__ == '__main__':
+	unittest.main()
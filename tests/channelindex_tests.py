@@ -0,0 +1,53 @@
+import sys
+import unittest
+
+sys.path.append('../')
+from src.channelindex import ChannelIndex
+
+class TestChannelIndex(unittest.TestCase):
+	def test_add_remove(self):
+		index = ChannelIndex(['a/b', 'a/bc'])
+		self.assertTrue(index.add('a/c'))
+		self.assertFalse(index.add('a/b'))
+		self.assertTrue(index.add(''))
+		self.assertEqual(len(index), 4)
+		self.assertTrue('a/b' in index)
+		self.assertFalse('a/' in index)
+		self.assertFalse('a/bcd' in index)
+		self.assertTrue(index.remove('a/b'))
+		self.assertFalse(index.remove('a/b'))
+		self.assertFalse(index.remove('a'))
+		self.assertTrue(index.remove(''))
+		self.assertEqual(index.get(), ['a/bc', 'a/c'])
+		index.apply([('sub', 'x'), ('unsub', 'a/c'), ('unsub', 'a/bc')])
+		self.assertEqual(index.get(), ['x'])
+		# nodes that no longer lead to a channel are removed
+		self.assertEqual(list(index._root.children.keys()), ['x'])
+
+	def test_prefix(self):
+		index = ChannelIndex(['t1/r1/a', 't1/r1/b', 't1/r2', 't2/r1', 't10'])
+		self.assertTrue(index.has_prefix('t1/'))
+		self.assertTrue(index.has_prefix('t1/r'))
+		self.assertFalse(index.has_prefix('t3'))
+		self.assertFalse(index.has_prefix('t1/r1/a/'))
+		self.assertEqual(index.count(), 5)
+		self.assertEqual(index.count('t1'), 4)
+		self.assertEqual(index.count('t1/'), 3)
+		self.assertEqual(index.count('t1/r1/'), 2)
+		self.assertEqual(index.get('t1/r'), ['t1/r1/a', 't1/r1/b', 't1/r2'])
+		self.assertEqual(index.get('t2/r1'), ['t2/r1'])
+		self.assertEqual(index.get('t9'), [])
+		self.assertEqual(index.match('t?/r1*'), ['t1/r1/a', 't1/r1/b',
+				't2/r1'])
+		self.assertEqual(index.match('t1/*/b'), ['t1/r1/b'])
+		self.assertEqual(index.match('t10'), ['t10'])
+
+	def test_bytes(self):
+		index = ChannelIndex([b'a/b', b'a/c', b'x'])
+		self.assertEqual(index.get(), [b'a/b', b'a/c', b'x'])
+		self.assertEqual(index.get(b'a/'), [b'a/b', b'a/c'])
+		self.assertEqual(index.count(b'a'), 2)
+		self.assertEqual(index.match(b'*/[b]'), [b'a/b'])
+
+if __name__ == '__main__':
+	unittest.main()
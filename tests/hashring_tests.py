@@ -0,0 +1,110 @@
+import sys
+import threading
+import unittest
+
+sys.path.append('../')
+from src.hashring import HashRing
+
+class TestHashRing(unittest.TestCase):
+	def setUp(self):
+		self.channels = ['channel-%d' % n for n in range(0, 2000)]
+
+	def owners(self, ring):
+		out = dict()
+		for channel in self.channels:
+			out[channel] = ring.get_nodes(channel)[0]
+		return out
+
+	def test_empty(self):
+		ring = HashRing()
+		self.assertEqual(ring.get_nodes('chan'), [])
+		self.assertEqual(len(ring), 0)
+		with self.assertRaises(ValueError):
+			ring.add('a', 'a', 0)
+
+	def test_distribution(self):
+		ring = HashRing()
+		for node in ['a', 'b', 'c', 'd']:
+			ring.add(node, node)
+		counts = dict()
+		for owner in self.owners(ring).values():
+			counts[owner] = counts.get(owner, 0) + 1
+		self.assertEqual(len(counts), 4)
+		for count in counts.values():
+			self.assertTrue(count > 300 and count < 700)
+
+	def test_weights(self):
+		ring = HashRing()
+		ring.add('a', 'a', 1)
+		ring.add('b', 'b', 3)
+		owners = list(self.owners(ring).values())
+		self.assertTrue(owners.count('b') > 2 * owners.count('a'))
+
+	def test_minimal_movement(self):
+		ring = HashRing()
+		for node in ['a', 'b', 'c', 'd']:
+			ring.add(node, node)
+		before = self.owners(ring)
+		ring.add('e', 'e')
+		after = self.owners(ring)
+		for channel in self.channels:
+			if before[channel] != after[channel]:
+				self.assertEqual(after[channel], 'e')
+		ring.remove('e')
+		self.assertEqual(self.owners(ring), before)
+		ring.remove('b')
+		after = self.owners(ring)
+		for channel in self.channels:
+			if before[channel] != 'b':
+				self.assertEqual(before[channel], after[channel])
+
+	def test_stable_keys(self):
+		ring1 = HashRing()
+		ring2 = HashRing()
+		for n in range(0, 3):
+			ring1.add(object(), 'key%d' % n)
+		nodes = list()
+		for n in [2, 0, 1]:
+			node = 'node%d' % n
+			nodes.append(node)
+			ring2.add(node, 'key%d' % n)
+		keys1 = [ring1._nodes[ring1.get_nodes(c)[0]][0] for c in self.channels]
+		keys2 = [ring2._nodes[ring2.get_nodes(c)[0]][0] for c in self.channels]
+		self.assertEqual(keys1, keys2)
+
+	def test_concurrent_changes(self):
+		ring = HashRing(10)
+		for node in ['a', 'b']:
+			ring.add(node, node)
+		errors = list()
+		stop = threading.Event()
+		def lookup():
+			try:
+				while not stop.is_set():
+					for channel in self.channels[:50]:
+						nodes = ring.get_nodes(channel, 2)
+						if len(nodes) != len(set(nodes)) or not nodes:
+							errors.append(nodes)
+			except Exception as e:
+				errors.append(e)
+		thread = threading.Thread(target=lookup)
+		thread.start()
+		for n in range(0, 200):
+			ring.add('node%d' % (n % 10), 'node%d' % (n % 10))
+			ring.remove('node%d' % ((n + 5) % 10))
+		stop.set()
+		thread.join()
+		self.assertEqual(errors, [])
+
+	def test_replicas(self):
+		ring = HashRing()
+		for node in ['a', 'b', 'c']:
+			ring.add(node, node)
+		nodes = ring.get_nodes('chan', 2)
+		self.assertEqual(len(nodes), 2)
+		self.assertNotEqual(nodes[0], nodes[1])
+		self.assertEqual(nodes[0], ring.get_nodes('chan')[0])
+		self.assertEqual(len(ring.get_nodes('chan', 5)), 3)
+
+if __name__ == '__main__':
+	unittest.main()
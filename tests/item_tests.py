@@ -1,9 +1,11 @@
 import sys
+import json
 import unittest
 
 sys.path.append('../')
 from src.format import Format
-from src.item import Item
+from src.item import Item, PreparedItem
+from src import tnetstringcodec
 
 class TestFormatSubClass(Format):
 	def name(self):
@@ -19,6 +21,20 @@ class TestFormatSubClass2(Format):
 	def export(self):
 		return {'body': 'bodyvalue'}
 
+class CountingItem(Item):
+	def __init__(self, *args, **kwargs):
+		Item.__init__(self, *args, **kwargs)
+		self.json_count = 0
+		self.tnetstring_count = 0
+
+	def _export_json(self, channel):
+		self.json_count += 1
+		return Item._export_json(self, channel)
+
+	def _export_tnetstring(self, channel=None):
+		self.tnetstring_count += 1
+		return Item._export_tnetstring(self, channel)
+
 class TestItem(unittest.TestCase):
 	def test_initialize(self):
 		item = Item([0, 'format'], 'id', 'prev-id')
@@ -56,6 +72,37 @@ class TestItem(unittest.TestCase):
 		with self.assertRaises(ValueError):
 				item.export()
 
+	def test_export_json(self):
+		out = Item(TestFormatSubClass(), 'id')._export_json('chan')
+		self.assertEqual(json.loads(out.decode('utf-8')), {'id': 'id',
+				'name': {'body': 'bodyvalue'}, 'channel': 'chan'})
+
+	def test_export_tnetstring(self):
+		item = Item(TestFormatSubClass(), 'id')
+		self.assertEqual(tnetstringcodec.loads(item._export_tnetstring()),
+				item.export(True, True))
+		out = item.export(True, True)
+		out['channel'.encode('utf-8')] = 'chan'.encode('utf-8')
+		self.assertEqual(tnetstringcodec.loads(item._export_tnetstring(
+				'chan'.encode('utf-8'))), out)
+
+	def test_prepared_item(self):
+		item = CountingItem(TestFormatSubClass(), 'id')
+		prepared = PreparedItem(item)
+		self.assertEqual(prepared.id, 'id')
+		self.assertEqual(prepared.export(), item.export())
+		for n in range(0, 3):
+			self.assertEqual(prepared._export_json('chan'),
+					item._export_json('chan'))
+			self.assertEqual(prepared._export_tnetstring(),
+					item._export_tnetstring())
+			self.assertEqual(prepared._export_tnetstring(b'chan'),
+					item._export_tnetstring(b'chan'))
+		self.assertEqual(item.json_count, 4)
+		self.assertEqual(item.tnetstring_count, 8)
+		prepared._export_json('chan2')
+		self.assertEqual(item.json_count, 5)
+
 	def verify_unicode(self, prop, value):
 		is_encoded = True
 		try:
@@ -0,0 +1,94 @@
+import sys
+import json
+import unittest
+
+sys.path.append('../')
+from src.format import Format
+from src.item import Item
+from src.itemtemplate import ItemTemplate, TemplateItem
+from src import tnetstringcodec
+
+class TestFormatSubClass(Format):
+	def __init__(self, body):
+		self.body = body
+
+	def name(self):
+		return 'name'
+
+	def export(self):
+		return {'body': self.body, 'list': [1, self.body]}
+
+class TestFormatSubClass2(Format):
+	def name(self):
+		return 'name2'
+
+	def export(self):
+		return {'body': 'bodyvalue'}
+
+class TestItemTemplate(unittest.TestCase):
+	def setUp(self):
+		self.template = ItemTemplate([
+				TestFormatSubClass(ItemTemplate.Field('body')),
+				TestFormatSubClass2()],
+				meta={'user': ItemTemplate.Field('user'), 'static': 'value'})
+
+	def make_item(self, body, user, id=None, prev_id=None):
+		return Item([TestFormatSubClass(body), TestFormatSubClass2()],
+				id, prev_id, {'user': user, 'static': 'value'})
+
+	def test_initialize(self):
+		self.assertEqual(self.template.field_names, set(['body', 'user']))
+		self.assertEqual(len(self.template.formats), 2)
+		with self.assertRaises(ValueError):
+			ItemTemplate([TestFormatSubClass2(), TestFormatSubClass2()])
+
+	def test_fill(self):
+		item = self.template.fill({'body': 'b', 'user': 'u'}, 'id', 'prev-id')
+		self.assertTrue(isinstance(item, TemplateItem))
+		self.assertTrue(isinstance(item, Item))
+		self.assertEqual(item.id, 'id')
+		self.assertEqual(item.prev_id, 'prev-id')
+		with self.assertRaises(ValueError):
+			self.template.fill({'body': 'b'})
+		with self.assertRaises(ValueError):
+			self.template.fill({'body': 'b', 'user': 'u', 'other': 'o'})
+
+	def test_export(self):
+		item = self.template.fill({'body': u'bödy', 'user': 'u'}, 'id')
+		expected = self.make_item(u'bödy', 'u', 'id')
+		self.assertEqual(item.export(), expected.export())
+		self.assertEqual(item.export(True, True), expected.export(True, True))
+
+	def test_export_json(self):
+		for id, prev_id in [(None, None), ('id', None), ('id', 'prev-id')]:
+			item = self.template.fill({'body': u'bödy', 'user': 2},
+					id, prev_id)
+			expected = self.make_item(u'bödy', 2, id, prev_id)
+			self.assertEqual(item._export_json('chan'),
+					expected._export_json('chan'))
+		template = ItemTemplate([], meta={})
+		self.assertEqual(json.loads(template.fill({}, 'id')._export_json(
+				'chan').decode('utf-8')), {'id': 'id', 'channel': 'chan'})
+
+	def test_export_tnetstring(self):
+		item = self.template.fill({'body': u'bödy', 'user': [None]},
+				'id', 'prev-id')
+		expected = self.make_item(u'bödy', [None], 'id', 'prev-id')
+		self.assertEqual(tnetstringcodec.loads(item._export_tnetstring()),
+				tnetstringcodec.loads(expected._export_tnetstring()))
+		self.assertEqual(tnetstringcodec.loads(item._export_tnetstring(
+				'chan'.encode('utf-8'))), tnetstringcodec.loads(
+				expected._export_tnetstring('chan'.encode('utf-8'))))
+
+	def test_static_template(self):
+		template = ItemTemplate(TestFormatSubClass2())
+		self.assertEqual(template.field_names, set())
+		item = template.fill({})
+		expected = Item(TestFormatSubClass2())
+		self.assertEqual(item._export_json('chan'),
+				expected._export_json('chan'))
+		self.assertEqual(item._export_tnetstring(),
+				expected._export_tnetstring())
+
+if __name__ == '__main__':
+	unittest.main()
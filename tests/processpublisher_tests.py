@@ -0,0 +1,148 @@
+import sys
+import threading
+import unittest
+
+try:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.append('../')
+from src import processpublisher
+from src.processpublisher import ProcessPublisher, RingBuffer, ExportedItem
+from src.item import Item
+from src.format import Format
+
+class TestFormatSubClass(Format):
+	def name(self):
+		return 'http-stream'
+
+	def export(self):
+		return {'content': 'hello'}
+
+class HttpServerTestClass(object):
+	def __init__(self):
+		bodies = list()
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def do_POST(self):
+				length = int(self.headers.get('Content-Length', 0))
+				bodies.append(self.rfile.read(length))
+				self.send_response(200)
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+
+			def log_message(self, format, *args):
+				pass
+
+		self.bodies = bodies
+		self.server = HTTPServer(('127.0.0.1', 0), Handler)
+		self.uri = 'http://127.0.0.1:%d' % self.server.server_address[1]
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+class TestRingBuffer(unittest.TestCase):
+	def test_put_get(self):
+		ring = RingBuffer(64)
+		ring.put(b'a')
+		ring.put(b'bcd')
+		ring.put(b'')
+		self.assertEqual(ring.get_all(), [b'a', b'bcd', b''])
+
+	def test_wrap_around(self):
+		ring = RingBuffer(64)
+		for n in range(0, 100):
+			data = (b'%d-' % n) * (n % 15)
+			ring.put(data)
+			self.assertEqual(ring.get_all(), [data])
+
+	def test_too_large(self):
+		ring = RingBuffer(16)
+		with self.assertRaises(ValueError):
+			ring.put(b'x' * 13)
+		ring.put(b'x' * 12)
+
+	def test_blocking_put(self):
+		ring = RingBuffer(16)
+		ring.put(b'x' * 8)
+		out = list()
+		thread = threading.Thread(target=lambda: ring.put(b'y' * 8))
+		thread.start()
+		thread.join(0.1)
+		self.assertTrue(thread.is_alive())
+		out.extend(ring.get_all())
+		thread.join()
+		out.extend(ring.get_all())
+		self.assertEqual(out, [b'x' * 8, b'y' * 8])
+
+class TestProcessPublisher(unittest.TestCase):
+	def test_exported_item(self):
+		self.assertEqual(ExportedItem(b'data')._export_json('chan'), b'data')
+
+	def test_initialize(self):
+		with self.assertRaises(ValueError):
+			ProcessPublisher([{'uri': 'uri'}], 0)
+
+	def test_publish(self):
+		server = HttpServerTestClass()
+		pub = ProcessPublisher([{'uri': server.uri}], 2)
+		results = list()
+		event = threading.Event()
+		def callback(success, message):
+			results.append((success, message))
+			event.set()
+		item = Item(TestFormatSubClass())
+		pub.publish('chan1', item, callback=callback)
+		pub.publish('chan2', item, blocking=True)
+		event.wait(10)
+		pub.publish('chan3', item)
+		pub.close()
+		server.close()
+		self.assertEqual(results, [(True, None)])
+		bodies = b''.join(server.bodies)
+		self.assertEqual(bodies.count(b'"channel": '), 3)
+		self.assertTrue(b'"channel": "chan2"' in bodies)
+		with self.assertRaises(ValueError):
+			pub.publish('chan', item)
+
+	def test_reconfigure(self):
+		server1 = HttpServerTestClass()
+		server2 = HttpServerTestClass()
+		pub = ProcessPublisher([{'uri': server1.uri}], 1)
+		item = Item(TestFormatSubClass())
+		pub.publish('chan1', item, blocking=True)
+		pub.reconfigure([{'uri': server2.uri}])
+		pub.publish('chan2', item, blocking=True)
+		process = pub._processes[0]
+		pub.close()
+		server1.close()
+		server2.close()
+		self.assertEqual(pub.config, [{'uri': server2.uri}])
+		self.assertTrue(b'"channel": "chan1"' in b''.join(server1.bodies))
+		self.assertFalse(b'"channel": "chan2"' in b''.join(server1.bodies))
+		self.assertTrue(b'"channel": "chan2"' in b''.join(server2.bodies))
+		self.assertEqual(process.exitcode, 0)
+
+	def test_publish_failure(self):
+		pub = ProcessPublisher([{'uri': 'http://127.0.0.1:1'}], 1)
+		with self.assertRaises(ValueError):
+			pub.publish('chan', Item(TestFormatSubClass()), blocking=True)
+		pub.close()
+
+	def test_close_on_exit(self):
+		pub = ProcessPublisher([{'uri': 'http://127.0.0.1:1'}], 1)
+		self.assertTrue(pub in processpublisher._publishers)
+		processpublisher._close_publishers()
+		self.assertTrue(pub.closed)
+		# closed instances are no longer referenced by the exit hook
+		self.assertFalse(pub in processpublisher._publishers)
+		self.assertTrue(processpublisher._publishers_registered)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,5 +1,6 @@
 import zmq
 import sys
+import time
 import unittest
 
 try:
@@ -10,7 +11,9 @@ except ImportError:
 sys.path.append('../')
 import src.pubcontrol as pubcontroltest
 from src.pubcontrol import PubControl
-from src.item import Item
+from src.pubcontrolclient import PubControlClient
+from src.replicaclient import ReplicaPubControlClient
+from src.item import Item, PreparedItem
 from src.format import Format
 
 class ClientTestClass():
@@ -62,6 +65,36 @@ class PubControlClientTestClass():
 		self.publish_blocking = blocking
 		self.publish_callback = callback
 
+class SlowPubControlClientTestClass(PubControlClientTestClass):
+	def __init__(self, delay, error=None):
+		PubControlClientTestClass.__init__(self)
+		self.delay = delay
+		self.error = error
+
+	def publish(self, channel, item, blocking=False, callback=None):
+		time.sleep(self.delay)
+		if self.error:
+			raise ValueError(self.error)
+		PubControlClientTestClass.publish(self, channel, item, blocking,
+				callback)
+
+class PriorityPubControlClientTestClass(PubControlClient):
+	def publish(self, channel, item, blocking=False, callback=None,
+			priority=None):
+		self.publish_channel = channel
+		self.publish_priority = priority
+
+class SubMonitorTestClass():
+	def __init__(self, closed=False):
+		self.closed = closed
+		self.subscriptions = list()
+
+	def is_closed(self):
+		return self.closed
+
+	def is_channel_subscribed_to(self, channel):
+		return (channel in self.subscriptions)
+
 class ZmqPubControlClientTestClass():
 	def close(self):
 		self.closed = True
@@ -78,6 +111,32 @@ class ZmqPubControlClientTestClass2():
 		self.sub_callback = sub_callback
 		self.zmq_context = zmq_context
 		self.discovery_callback = discovery_callback
+		self._require_subscribers = require_subscribers
+
+	def close(self):
+		self.closed = True
+
+class PubControlClientTestClass2(PubControlClientTestClass):
+	def __init__(self, uri, auth_jwt_claim=None, auth_jwt_key=None,
+			require_subscribers=False, sub_callback=None, auth_bearer=None,
+			sub_monitor_loop=None, sub_state_file=None):
+		PubControlClientTestClass.__init__(self)
+		self.uri = uri
+		self.require_subscribers = require_subscribers
+		self.sub_monitor_loop = sub_monitor_loop
+		self.sub_state_file = sub_state_file
+
+class ProcessPublisherTestClass():
+	def __init__(self, config, processes=2):
+		self.config = config
+		self.processes = processes
+
+	def reconfigure(self, config):
+		self.config = config
+		self.reconfigured = True
+
+	def close(self):
+		self.closed = True
 
 class ThreadTestClass():
 	def join(self):
@@ -122,7 +181,7 @@ class TestPubControl(unittest.TestCase):
 		self.assertEqual(len(pc.clients), 0)
 		self.assertEqual(pc._sub_callback, None)
 		self.assertEqual(pc._zmq_pub_controller, None)
-		self.assertNotEqual(pc._zmq_ctx, None)
+		self.assertEqual(pc._zmq_ctx, None)
 		self.assertTrue(pc in pubcontroltest._pubcontrols)
 		pc = PubControl(None, 'subcallback', 'zmqcontext')
 		self.assertEqual(pc._sub_callback, 'subcallback')
@@ -135,6 +194,8 @@ class TestPubControl(unittest.TestCase):
 				{'uri': 'uri', 'iss': 'iss', 'key': 'key'}]
 		pc = PubControl(config)
 		self.assertEqual(len(pc.clients), 2)
+		self.assertEqual(pc._zmq_ctx, None)
+		self.assertEqual(pc._get_zmq_context(), zmq.Context.instance())
 		self.assertEqual(pc._zmq_ctx, zmq.Context.instance())
 
 	def test_add_client(self):
@@ -241,6 +302,391 @@ class TestPubControl(unittest.TestCase):
 			self.assertEqual(pccs[n].publish_item, 'item')
 			self.assertEqual(pccs[n].publish_blocking, True)
 
+	def test_publish_blocking_concurrent(self):
+		pc = PubControlTestClass()
+		pccs = []
+		for n in range(0, 3):
+			pcc = SlowPubControlClientTestClass(0.3)
+			pccs.append(pcc)
+			pc.add_client(pcc)
+		start = time.time()
+		pc.publish('channel', 'item', True)
+		self.assertTrue(time.time() - start < 0.8)
+		for n in range(0, 3):
+			self.assertEqual(pccs[n].publish_channel, 'channel')
+			self.assertEqual(pccs[n].publish_blocking, True)
+
+	def test_publish_blocking_failure(self):
+		pc = PubControlTestClass()
+		pcc1 = SlowPubControlClientTestClass(0.1, 'error1')
+		pcc2 = SlowPubControlClientTestClass(0, 'error2')
+		pcc3 = SlowPubControlClientTestClass(0)
+		pc.add_client(pcc1)
+		pc.add_client(pcc2)
+		pc.add_client(pcc3)
+		with self.assertRaises(ValueError) as cm:
+			pc.publish('channel', 'item', True)
+		self.assertEqual(str(cm.exception), 'error1')
+		self.assertEqual(pcc3.publish_channel, 'channel')
+
+	def test_publish_blocking_timeout(self):
+		pc = PubControlTestClass()
+		pc.add_client(SlowPubControlClientTestClass(0))
+		pc.add_client(SlowPubControlClientTestClass(1))
+		start = time.time()
+		with self.assertRaises(ValueError) as cm:
+			pc.publish('channel', 'item', True, timeout=0.2)
+		self.assertTrue(time.time() - start < 0.8)
+		self.assertTrue('1 of 2 clients' in str(cm.exception))
+
+	def test_publish_prepared_item(self):
+		pc = PubControlTestClass()
+		pcc = PubControlClientTestClass()
+		pc.add_client(pcc)
+		item = Item(TestFormatSubClass())
+		pc.publish('channel', item)
+		self.assertTrue(pcc.publish_item is item)
+		pcc2 = PubControlClientTestClass()
+		pc.add_client(pcc2)
+		pc.publish('channel', item)
+		self.assertTrue(isinstance(pcc.publish_item, PreparedItem))
+		self.assertTrue(pcc.publish_item is pcc2.publish_item)
+		self.assertTrue(pcc.publish_item.item is item)
+		self.assertTrue(pc.item is pcc.publish_item)
+
+	def test_apply_config_processes(self):
+		pc = PubControlTestClass()
+		process_publisher = pubcontroltest.ProcessPublisher
+		pubcontrol_client = pubcontroltest.PubControlClient
+		pubcontroltest.ProcessPublisher = ProcessPublisherTestClass
+		pubcontroltest.PubControlClient = PubControlClientTestClass2
+		try:
+			pc.apply_config([{'uri': 'uri1'},
+					{'uri': 'uri2', 'require_subscribers': True},
+					{'uri': 'uri3', 'iss': 'iss3', 'key': 'key3'}],
+					processes=3)
+		finally:
+			pubcontroltest.ProcessPublisher = process_publisher
+			pubcontroltest.PubControlClient = pubcontrol_client
+		self.assertEqual(len(pc.clients), 2)
+		self.assertEqual(pc.clients[0].uri, 'uri2')
+		self.assertEqual(pc.clients[0].require_subscribers, True)
+		self.assertEqual(pc.clients[0].sub_monitor_loop, None)
+		self.assertEqual(pc.clients[1].config, [{'uri': 'uri1'},
+				{'uri': 'uri3', 'iss': 'iss3', 'key': 'key3'}])
+		self.assertEqual(pc.clients[1].processes, 3)
+		pc.remove_all_clients()
+		with self.assertRaises(ValueError):
+			pc.apply_config({'uri': 'uri'}, routing='consistent-hash',
+					processes=2)
+
+	def test_apply_config_sub_monitor_loop(self):
+		pc = PubControl(sub_monitor_loop=True)
+		pubcontrol_client = pubcontroltest.PubControlClient
+		pubcontroltest.PubControlClient = PubControlClientTestClass2
+		try:
+			pc.apply_config({'uri': 'uri', 'require_subscribers': True,
+					'sub_state_file': 'state.json'})
+		finally:
+			pubcontroltest.PubControlClient = pubcontrol_client
+		self.assertEqual(pc.clients[0].sub_monitor_loop, True)
+		self.assertEqual(pc.clients[0].sub_state_file, 'state.json')
+
+	def test_apply_config_replicas(self):
+		pc = PubControl()
+		pc.apply_config({'replicas': [{'uri': 'uri1', 'weight': 2},
+				{'uri': 'uri2', 'iss': 'iss2', 'key': 'key2'}],
+				'key': 'bearer', 'hedge_percentile': 95})
+		self.assertEqual(len(pc.clients), 1)
+		client = pc.clients[0]
+		self.assertTrue(isinstance(client, ReplicaPubControlClient))
+		self.assertEqual([c.uri for c in client.clients], ['uri1', 'uri2'])
+		self.assertEqual(client._weights, [2, 1])
+		self.assertEqual(client._hedge_percentile, 95)
+		self.assertEqual(client.clients[0].auth_bearer, 'bearer')
+		self.assertEqual(client.clients[1].auth_jwt_claim, {'iss': 'iss2'})
+		with self.assertRaises(ValueError):
+			pc.apply_config({'replicas': [{'uri': 'uri1'}],
+					'require_subscribers': True})
+		pc.close()
+
+	def test_reconfigure(self):
+		pc = PubControlTestClass()
+		pubcontrol_client = pubcontroltest.PubControlClient
+		pubcontroltest.PubControlClient = PubControlClientTestClass2
+		try:
+			manual = PubControlClientTestClass()
+			pc.add_client(manual)
+			pc.apply_config([{'uri': 'uri1'}, {'uri': 'uri2'},
+					{'uri': 'uri3', 'iss': 'iss', 'key': 'key'}])
+			client1, client2, client3 = pc.clients[1:]
+			pc.reconfigure([{'uri': 'uri3', 'iss': 'iss', 'key': 'key'},
+					{'uri': 'uri1'}, {'uri': 'uri4'}])
+		finally:
+			pubcontroltest.PubControlClient = pubcontrol_client
+		self.assertEqual(len(pc.clients), 4)
+		self.assertTrue(pc.clients[0] is manual)
+		self.assertTrue(pc.clients[1] is client1)
+		self.assertTrue(pc.clients[2] is client3)
+		self.assertEqual(pc.clients[3].uri, 'uri4')
+		self.assertTrue(client2.close_called)
+		self.assertFalse(hasattr(client1, 'close_called'))
+		self.assertFalse(hasattr(manual, 'close_called'))
+		self.assertFalse(client2 in pc._client_entries)
+
+	def test_reconfigure_zmq_pub_uri(self):
+		pc = PubControlTestClass()
+		zmq_client = pubcontroltest.ZmqPubControlClient
+		pubcontroltest.ZmqPubControlClient = ZmqPubControlClientTestClass2
+		disconnect_uris = list()
+		pc._disconnect_zmq_pub_uri = disconnect_uris.append
+		try:
+			pc.apply_config([{'zmq_pub_uri': 'pub_uri',
+					'require_subscribers': True}])
+			client = pc.clients[0]
+			# the new client connects to the same PUB socket as the one
+			# it replaces, which must stay connected
+			pc.reconfigure([{'zmq_pub_uri': 'pub_uri',
+					'zmq_push_uri': 'push_uri', 'require_subscribers': True}])
+			self.assertTrue(client.closed)
+			self.assertEqual(pc.connect_uris, ['pub_uri', 'pub_uri'])
+			self.assertEqual(disconnect_uris, [])
+			pc.reconfigure([])
+			self.assertEqual(disconnect_uris, ['pub_uri'])
+		finally:
+			pubcontroltest.ZmqPubControlClient = zmq_client
+
+	def test_reconfigure_routing(self):
+		pc = PubControlTestClass()
+		events = list()
+		pc._sub_callback = lambda event_type, channel: events.append(
+				(event_type, channel))
+		pubcontrol_client = pubcontroltest.PubControlClient
+		pubcontroltest.PubControlClient = PubControlClientTestClass2
+		try:
+			pc.apply_config([{'uri': 'uri1'}, {'uri': 'uri2'}],
+					routing='consistent-hash')
+			client1, client2 = pc.clients
+			pc._client_sub_callback(client1, 'sub', 'chan1')
+			pc._client_sub_callback(client2, 'sub', 'chan1')
+			pc._client_sub_callback(client2, 'sub', 'chan2')
+			pc.reconfigure([{'uri': 'uri1', 'weight': 3}])
+		finally:
+			pubcontroltest.PubControlClient = pubcontrol_client
+		self.assertEqual(pc.clients, [client1])
+		self.assertEqual(pc._ring._nodes, {client1: ('uri1', 3)})
+		self.assertTrue(pc.is_channel_subscribed_to('chan1'))
+		self.assertFalse(pc.is_channel_subscribed_to('chan2'))
+		# only the channel left without subscribers is unsubscribed
+		self.assertEqual(events, [('sub', 'chan1'), ('sub', 'chan2'),
+				('unsub', 'chan2')])
+		with self.assertRaises(ValueError):
+			pc.reconfigure([{'uri': 'uri1'}], processes=2)
+
+	def test_reconfigure_processes(self):
+		pc = PubControlTestClass()
+		process_publisher = pubcontroltest.ProcessPublisher
+		pubcontroltest.ProcessPublisher = ProcessPublisherTestClass
+		try:
+			pc.apply_config([{'uri': 'uri1'}, {'uri': 'uri2'}], processes=2)
+			publisher = pc.clients[0]
+			pc.reconfigure([{'uri': 'uri1'}, {'uri': 'uri2'}], processes=2)
+			self.assertEqual(pc.clients, [publisher])
+			# the worker processes are reconfigured rather than restarted
+			pc.reconfigure([{'uri': 'uri1'}], processes=2)
+			self.assertEqual(pc.clients, [publisher])
+			self.assertTrue(publisher.reconfigured)
+			self.assertEqual(publisher.config, [{'uri': 'uri1'}])
+			self.assertEqual(pc._client_entries[publisher],
+					{'processes': 2, 'entries': [{'uri': 'uri1'}]})
+			pc.reconfigure([{'uri': 'uri1'}], processes=3)
+		finally:
+			pubcontroltest.ProcessPublisher = process_publisher
+		self.assertEqual(len(pc.clients), 1)
+		self.assertTrue(publisher.closed)
+		self.assertEqual(pc.clients[0].config, [{'uri': 'uri1'}])
+		self.assertEqual(pc.clients[0].processes, 3)
+
+	def test_routing(self):
+		pc = PubControlTestClass()
+		pccs = []
+		for n in range(0, 3):
+			pcc = PubControlClientTestClass()
+			pcc.uri = 'uri%d' % n
+			pccs.append(pcc)
+			pc.add_client(pcc)
+		pc.enable_routing()
+		for n in range(0, 20):
+			pc.publish('chan%d' % n, 'item', True)
+			published = [pcc for pcc in pccs
+					if pcc.publish_channel == 'chan%d' % n]
+			self.assertEqual(len(published), 1)
+			self.assertTrue(published[0] is pc._get_clients('chan%d' % n)[0])
+		pc.enable_routing(2)
+		pc.publish('chan', 'item')
+		published = [pcc for pcc in pccs if pcc.publish_channel == 'chan']
+		self.assertEqual(len(published), 2)
+		with self.assertRaises(ValueError):
+			pc.enable_routing(0)
+
+	def test_enable_routing_weights(self):
+		pc = PubControlTestClass()
+		pcc1 = PubControlClientTestClass()
+		pcc1.uri = 'uri1'
+		pcc2 = PubControlClientTestClass()
+		pcc2.uri = 'uri2'
+		pc.add_client(pcc1)
+		pc.add_client(pcc2, 3)
+		pc.apply_config({'uri': 'uri3', 'weight': 2, 'shard_key': 'shard3'})
+		pc.enable_routing()
+		self.assertEqual(pc._ring._nodes[pcc1], ('uri1', 1))
+		self.assertEqual(pc._ring._nodes[pcc2], ('uri2', 3))
+		self.assertEqual(pc._ring._nodes[pc.clients[2]], ('shard3', 2))
+
+	def test_apply_config_routing(self):
+		pc = PubControlTestClass()
+		with self.assertRaises(ValueError):
+			pc.apply_config({'uri': 'uri'}, routing='unknown')
+		pc.apply_config([{'uri': 'uri1'}, {'uri': 'uri2', 'weight': 2},
+				{'uri': 'uri3', 'shard_key': 'shard3'}],
+				routing='consistent-hash', replicas=2)
+		self.assertEqual(pc._replicas, 2)
+		self.assertEqual(pc._ring._nodes[pc.clients[0]], ('uri1', 1))
+		self.assertEqual(pc._ring._nodes[pc.clients[1]], ('uri2', 2))
+		self.assertEqual(pc._ring._nodes[pc.clients[2]], ('shard3', 1))
+		pc.remove_all_clients()
+		self.assertEqual(len(pc._ring), 0)
+
+	def test_publish_many(self):
+		pc = PubControlTestClass()
+		pccs = []
+		for n in range(0, 2):
+			pcc = PubControlClientTestClass()
+			pccs.append(pcc)
+			pc.add_client(pcc)
+		pc.publish_many([('chan1', 'item1'), ('chan2', 'item2')], True)
+		for pcc in pccs:
+			self.assertEqual(pcc.publish_channel, 'chan2')
+			self.assertEqual(pcc.publish_item, 'item2')
+			self.assertEqual(pcc.publish_blocking, True)
+		self.assertEqual(pc.channel, 'chan2')
+		pc.publish_many([('chan1', 'item1'), ('chan2', 'item2')],
+				callback='callback')
+		for pcc in pccs:
+			self.assertEqual(pcc.publish_blocking, False)
+			self.assertEqual(pcc.publish_callback.__self__.num_calls, 4)
+
+	def test_publish_priority(self):
+		pc = PubControlTestClass()
+		pcc1 = PriorityPubControlClientTestClass('uri')
+		pcc2 = PubControlClientTestClass()
+		pc.add_client(pcc1)
+		pc.add_client(pcc2)
+		pc.publish('chan', 'item', priority='high')
+		self.assertEqual(pcc1.publish_priority, 'high')
+		self.assertEqual(pcc2.publish_channel, 'chan')
+		pc.publish_many([('chan2', 'item')], priority='low')
+		self.assertEqual(pcc1.publish_channel, 'chan2')
+		self.assertEqual(pcc1.publish_priority, 'low')
+		pc.publish('chan3', 'item')
+		self.assertEqual(pcc1.publish_priority, None)
+		with self.assertRaises(ValueError):
+			pc.publish('chan', 'item', priority='urgent')
+		with self.assertRaises(ValueError):
+			pc.publish_many([('chan', 'item')], priority='urgent')
+
+	def test_publish_no_subscribers(self):
+		pc = PubControlTestClass()
+		pcc1 = PubControlClientTestClass()
+		pcc1.sub_monitor = SubMonitorTestClass()
+		pcc2 = PubControlClientTestClass()
+		pcc2.sub_monitor = SubMonitorTestClass()
+		pc.add_client(pcc1)
+		pc.add_client(pcc2)
+		pc.item = None
+		self.callback_result = None
+		pc.publish('chan', 'item', callback=self.callback_for_testing)
+		self.assertEqual(self.callback_result, (True, ''))
+		self.assertEqual(pcc1.publish_channel, None)
+		self.assertEqual(pcc2.publish_channel, None)
+		self.assertEqual(pc.item, None)
+		pc.publish_many([('chan', 'item')], True)
+		self.assertEqual(pcc1.publish_channel, None)
+		pcc2.sub_monitor.subscriptions.append('chan')
+		pc.publish('chan', 'item', True)
+		self.assertEqual(pcc1.publish_channel, 'chan')
+		self.assertEqual(pcc2.publish_channel, 'chan')
+		pc.publish('chan2', 'item')
+		self.assertEqual(pcc1.publish_channel, 'chan')
+		pc._indexed_clients.add(pcc1)
+		pc._indexed_clients.add(pcc2)
+		pc.publish('chan', 'item2', True)
+		self.assertEqual(pcc1.publish_item, 'item')
+		pc._client_sub_callback(pcc1, 'sub', 'chan')
+		pc.publish('chan', 'item2', True)
+		self.assertEqual(pcc1.publish_item, 'item2')
+		pcc2.sub_monitor.closed = True
+		pc.publish('chan2', 'item', True)
+		self.assertEqual(pcc2.publish_channel, 'chan2')
+		pc = PubControlTestClass()
+		pc.add_client(pcc1)
+		pc.add_client(PubControlClientTestClass())
+		pc.publish('chan3', 'item', True)
+		self.assertEqual(pc.item, 'item')
+
+	def test_publish_binary_channel(self):
+		pc = PubControlTestClass()
+		pcc = PubControlClientTestClass()
+		pcc.sub_monitor = SubMonitorTestClass()
+		pc.add_client(pcc)
+		pc._indexed_clients.add(pcc)
+		pc._client_sub_callback(pcc, 'sub', u'chan\xe9')
+		pc.publish(u'chan\xe9'.encode('utf-8'), 'item', True)
+		self.assertEqual(pcc.publish_channel, u'chan\xe9'.encode('utf-8'))
+		pc.publish(b'chan2', 'item', True)
+		self.assertEqual(pcc.publish_channel, u'chan\xe9'.encode('utf-8'))
+		# channels that cannot be decoded are not dropped
+		pc.publish(b'\xff', 'item', True)
+		self.assertEqual(pcc.publish_channel, b'\xff')
+
+	def test_publish_item_factory(self):
+		pc = PubControlTestClass()
+		pcc1 = PubControlClientTestClass()
+		pcc1.sub_monitor = SubMonitorTestClass()
+		pcc2 = PubControlClientTestClass()
+		pcc2.sub_monitor = SubMonitorTestClass()
+		pc.add_client(pcc1)
+		pc.add_client(pcc2)
+		calls = list()
+		def factory():
+			calls.append(True)
+			return Item(TestFormatSubClass())
+		pc.publish('chan', factory, True)
+		pc.publish_many([('chan', factory)])
+		self.assertEqual(len(calls), 0)
+		pcc1.sub_monitor.subscriptions.append('chan')
+		pcc2.sub_monitor.subscriptions.append('chan')
+		pc.publish('chan', factory, True)
+		self.assertEqual(len(calls), 1)
+		self.assertTrue(isinstance(pcc1.publish_item, PreparedItem))
+		self.assertTrue(pcc1.publish_item is pcc2.publish_item)
+		pc.publish_many([('chan', factory), ('chan2', factory)], True)
+		self.assertEqual(len(calls), 2)
+		def failing_factory():
+			raise ValueError('factory error')
+		with self.assertRaises(ValueError):
+			pc.publish('chan', failing_factory)
+		self.callback_result = None
+		pcc1.publish_channel = None
+		pc.publish_many([('chan', factory), ('chan', failing_factory)],
+				callback=self.callback_for_testing)
+		self.assertEqual(self.callback_result,
+				(False, 'failed to build item: factory error'))
+		self.assertEqual(pcc1.publish_channel, None)
+
+	def callback_for_testing(self, result, message):
+		self.callback_result = (result, message)
+
 	def test_publish_send_to_zmq_test(self):
 		pc = PubControlTestClass()
 		pc.publish('chan', 'item')
@@ -283,6 +729,38 @@ class TestPubControl(unittest.TestCase):
 		pc._pub_controller_callback('sub', 'chan')
 		self.assertFalse(self.sub_callback_executed)
 
+	def test_client_sub_callback(self):
+		pc = PubControl()
+		pc._sub_callback = self.sub_callback_for_testing
+		client1 = ClientTestClass()
+		client2 = ClientTestClass()
+		pc.add_client(client1)
+		pc.add_client(client2)
+		self.clear_sub_callback_for_testing()
+		self.assertFalse(pc.is_channel_subscribed_to('chan'))
+		pc._client_sub_callback(client1, 'sub', 'chan')
+		self.assertTrue(self.sub_callback_executed)
+		self.assertEqual(self.sub_event_type, 'sub')
+		self.assertTrue(pc.is_channel_subscribed_to('chan'))
+		self.clear_sub_callback_for_testing()
+		pc._client_sub_callback(client2, 'sub', 'chan')
+		pc._client_sub_callback(client1, 'unsub', 'chan')
+		pc._client_sub_callback(client1, 'unsub', 'chan')
+		self.assertFalse(self.sub_callback_executed)
+		self.assertTrue(pc.is_channel_subscribed_to('chan'))
+		pc._client_sub_callback(client2, 'unsub', 'chan')
+		self.assertTrue(self.sub_callback_executed)
+		self.assertEqual(self.sub_event_type, 'unsub')
+		self.assertFalse(pc.is_channel_subscribed_to('chan'))
+		self.clear_sub_callback_for_testing()
+		pc._client_sub_callback(client2, 'unsub', 'chan')
+		self.assertFalse(self.sub_callback_executed)
+		pc._client_sub_callback(client1, 'sub', 'chan1')
+		pc._pub_controller_callback('sub', 'chan2')
+		pc.remove_all_clients()
+		self.assertFalse(pc.is_channel_subscribed_to('chan1'))
+		self.assertTrue(pc.is_channel_subscribed_to('chan2'))
+
 	def sub_callback_for_testing(self, event_type, chan):
 		self.sub_event_type = event_type
 		self.sub_chan = chan
@@ -17,7 +17,7 @@ sys.path.append('../')
 from src.pubcontrolclient import PubControlClient
 from src.item import Item
 from src.format import Format
-from src.utilities import _ensure_unicode
+from src.utilities import _ensure_unicode, _json_dumps_utf8
 
 class TestServer(object):
 	def __init__(self):
@@ -99,7 +99,8 @@ class PccForPublishTesting(PubControlClientForTesting):
 		self.test_instance.assertEqual(uri, 'uri')
 		self.test_instance.assertEqual(auth_header, 'Basic ' + str(b64encode(
 				'user:pass'.encode('ascii'))))
-		self.test_instance.assertEqual(items, [{'name': {'body': 'bodyvalue'},
+		self.test_instance.assertEqual([json.loads(_ensure_unicode(i))
+				for i in items], [{'name': {'body': 'bodyvalue'},
 				'channel': 'chann'}])
 
 	def _queue_req(self, req):
@@ -107,8 +108,8 @@ class PccForPublishTesting(PubControlClientForTesting):
 		self.test_instance.assertEqual(req[1], 'uri')
 		self.test_instance.assertEqual(req[2], 'Basic ' + str(b64encode(
 				'user:pass'.encode('ascii'))))
-		self.test_instance.assertEqual(req[3], {'name': {'body': 'bodyvalue'},
-				'channel': 'chann'})
+		self.test_instance.assertEqual(json.loads(_ensure_unicode(req[3])),
+				{'name': {'body': 'bodyvalue'}, 'channel': 'chann'})
 		self.test_instance.assertEqual(req[4], 'callback')
 
 	def _ensure_thread(self):
@@ -165,6 +166,17 @@ class PccForPubWorkerTesting(PubControlClientForTesting):
 			self.test_instance.assertEqual(req[3], 'callback')
 			self.req_index += 1
 
+class PccForPriorityTesting(PubControlClientForTesting):
+	def set_params(self):
+		self.published = list()
+
+	def _pubbatch(self, reqs):
+		self.published.append([req[2] for req in reqs])
+
+	def _ensure_thread(self):
+		if self.thread_cond is None:
+			self.thread_cond = threading.Condition()
+
 class TestPubControlClient(unittest.TestCase):
 	def test_initialize(self):
 		pcc = PubControlClient('uri')
@@ -285,8 +297,8 @@ class TestPubControlClient(unittest.TestCase):
 				'Content-Type': 'application/json' })
 		pcc.set_test_instance(self)
 		pcc._pubcall('http://localhost:8080', 'Basic ' + str(
-				b64encode('user:pass'.encode('ascii'))), [{'name': {'body': 'bodyvalue'},
-				'channel': 'chann'}])
+				b64encode('user:pass'.encode('ascii'))), [_json_dumps_utf8(
+				{'name': {'body': 'bodyvalue'}, 'channel': 'chann'})])
 
 	def test_pubcall_success_https(self):
 		pcc = PccForPubCallTesting('uri')
@@ -302,8 +314,8 @@ class TestPubControlClient(unittest.TestCase):
 		pcc._pubcall('https://localhost:8080', 'Bearer eyJhbGciOiJIU' +
 				'zI1NiIsInR5cCI6IkpXVCJ9.eyJpc3MiOiJoZWxsbyIsImV4cCI6MTQyNjEwN' +
 				'jYwMX0.qmFVZ3iS041fAhqHno0vYLykNycT40ntBuD3G7ISDJw',
-				[{'name': {'body': 'bodyvalue'},
-				'channel': 'chann'}])
+				[_json_dumps_utf8({'name': {'body': 'bodyvalue'},
+				'channel': 'chann'})])
 
 	def test_pubcall_failure(self):
 		pcc = PccForPubCallTesting('uri')
@@ -312,8 +324,8 @@ class TestPubControlClient(unittest.TestCase):
 				{ 'Content-Type': 'application/json' }, True)
 		pcc.set_test_instance(self)
 		try:
-			pcc._pubcall('https://localhost:8080', None, [{'name':
-					{'body': 'bodyvalue'}, 'channel': 'chann'}])
+			pcc._pubcall('https://localhost:8080', None, [_json_dumps_utf8(
+					{'name': {'body': 'bodyvalue'}, 'channel': 'chann'})])
 			self.assertTrue(False)
 		except ValueError as e:
 			self.assertTrue(str(e).index('test failure'))
@@ -388,6 +400,122 @@ class TestPubControlClient(unittest.TestCase):
 		pcc.finish()
 		self.assertEqual(pcc.req_index, 250)
 
+	def fill_lanes(self, pcc, count):
+		for lane in ('low', 'normal', 'high'):
+			for n in range(0, count):
+				pcc._lanes[lane].append(('pub', 'uri', None,
+						'%s%d' % (lane, n), None, lane, time.time()))
+
+	def test_publish_priority(self):
+		pcc = PccForPriorityTesting('uri')
+		pcc.publish('chann', Item(TestFormatSubClass()), priority='high')
+		pcc.publish('chann', Item(TestFormatSubClass()))
+		pcc.publish('chann', Item(TestFormatSubClass()), priority='low')
+		self.assertEqual(len(pcc._lanes['high']), 1)
+		self.assertEqual(len(pcc.req_queue), 1)
+		self.assertEqual(len(pcc._lanes['low']), 1)
+		self.assertEqual(pcc._lanes['high'][0][5], 'high')
+		with self.assertRaises(ValueError):
+			pcc.publish('chann', Item(TestFormatSubClass()),
+					priority='urgent')
+
+	def test_take_batch_strict(self):
+		pcc = PccForPriorityTesting('uri')
+		self.fill_lanes(pcc, 6)
+		batch, stopping = pcc._take_batch(False)
+		self.assertFalse(stopping)
+		self.assertEqual([m[3] for lane, m in batch], ['high0', 'high1',
+				'high2', 'high3', 'high4', 'high5', 'normal0', 'normal1',
+				'normal2', 'normal3'])
+		self.assertEqual([lane for lane, m in batch],
+				['high'] * 6 + ['normal'] * 4)
+
+	def test_take_batch_weighted(self):
+		pcc = PccForPriorityTesting('uri')
+		pcc.set_priority_draining({'high': 6, 'normal': 3, 'low': 1}, 10)
+		self.fill_lanes(pcc, 20)
+		batch, stopping = pcc._take_batch(False)
+		self.assertEqual([m[3] for lane, m in batch], ['high0', 'high1',
+				'high2', 'high3', 'high4', 'high5', 'normal0', 'normal1',
+				'normal2', 'low0'])
+		# the unused quota of an empty lane is filled in priority order
+		pcc._lanes['high'].clear()
+		batch, stopping = pcc._take_batch(False)
+		self.assertEqual([m[3] for lane, m in batch], ['normal3', 'normal4',
+				'normal5', 'normal6', 'normal7', 'normal8', 'normal9',
+				'low1', 'low2', 'normal10'])
+		with self.assertRaises(ValueError):
+			pcc.set_priority_draining({'urgent': 1})
+		with self.assertRaises(ValueError):
+			pcc.set_priority_draining({'high': -1})
+		with self.assertRaises(ValueError):
+			pcc.set_priority_draining(batch_size=0)
+
+	def test_pubworker_priority_stop(self):
+		pcc = PccForPriorityTesting('uri')
+		pcc.set_params()
+		pcc.set_priority_draining(batch_size=2)
+		pcc._ensure_thread()
+		pcc.req_queue.append(('pub', 'uri', None, 'normal0', None))
+		pcc.req_queue.append(('stop',))
+		pcc.req_queue.append(('pub', 'uri', None, 'normal1', None))
+		pcc._lanes['high'].append(('pub', 'uri', None, 'high0', None,
+				'high', time.time()))
+		pcc._lanes['low'].append(('pub', 'uri', None, 'low0', None,
+				'low', time.time()))
+		pcc._pubworker()
+		self.assertEqual(pcc.published, [['high0', 'normal0'], ['low0']])
+		self.assertEqual(list(pcc.req_queue), [('pub', 'uri', None,
+				'normal1', None)])
+
+	def test_get_lane_stats(self):
+		pcc = PubControlClient('uri')
+		now = time.time()
+		pcc._record_latency([('high', ('pub', 'uri', None, 'i', None,
+				'high', now - 2.0)), ('high', ('pub', 'uri', None, 'i', None,
+				'high', now - 1.0)), ('normal', ('pub', 'uri', None, 'i',
+				None))])
+		stats = pcc.get_lane_stats(reset=True)
+		self.assertEqual(stats['high']['count'], 2)
+		self.assertTrue(1.5 <= stats['high']['avg_latency'] < 2.0)
+		self.assertTrue(2.0 <= stats['high']['max_latency'] < 2.5)
+		self.assertEqual(stats['normal'], {'count': 0, 'avg_latency': 0.0,
+				'max_latency': 0.0})
+		self.assertEqual(pcc.get_lane_stats()['high']['count'], 0)
+
+	def test_wait_all_sent_priority(self):
+		pcc = PccForPriorityTesting('uri')
+		pcc.set_params()
+		pcc._ensure_thread = lambda: PubControlClient._ensure_thread(pcc)
+		pcc.publish('chann', Item(TestFormatSubClass()), priority='low')
+		pcc.publish('chann', Item(TestFormatSubClass()), priority='high')
+		pcc.wait_all_sent()
+		self.assertEqual(sum(len(b) for b in pcc.published), 2)
+		self.assertEqual(pcc.get_lane_stats()['low']['count'], 1)
+
+	def test_rate_limit(self):
+		pcc = PccForPriorityTesting('uri')
+		pcc.set_params()
+		self.assertEqual(pcc.get_rate_limit_stats(), None)
+		pcc.set_rate_limit(channel_limits={'slow': 5}, burst=0.2)
+		batch = list()
+		for n in range(0, 3):
+			for channel in ('fast', 'slow'):
+				batch.append(('normal', ('pub', 'uri', None,
+						'%s%d' % (channel, n), None, None, time.time(),
+						channel)))
+		start = time.time()
+		pcc._pubbatch_limited(batch)
+		# the batch is split ahead of each delayed item
+		self.assertEqual(pcc.published, [['fast0', 'slow0', 'fast1'],
+				['slow1', 'fast2'], ['slow2']])
+		self.assertTrue(time.time() - start >= 0.35)
+		stats = pcc.get_rate_limit_stats(reset=True)
+		self.assertEqual(stats['items'], 6)
+		self.assertEqual(stats['delayed_items'], 2)
+		pcc.set_rate_limit()
+		self.assertEqual(pcc.get_rate_limit_stats(), None)
+
 	def test_verify_status_code(self):
 		pcc = PubControlClient('uri')
 		pcc._verify_status_code(200, '')
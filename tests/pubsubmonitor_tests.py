@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import time
+import threading
+import unittest
+from base64 import b64encode
+
+sys.path.append('../')
+from src.pubsubmonitor import PubSubMonitor, _LineSplitter, _iter_stream_lines
+from src.reconnectscheduler import ReconnectScheduler
+from src.utilities import requests
+
+class RawTestClass(object):
+	def __init__(self, chunks, error=None):
+		self.chunks = list(chunks)
+		self.error = error
+		self.reads = list()
+
+	def read1(self, amt):
+		self.reads.append(amt)
+		if self.chunks:
+			return self.chunks.pop(0)
+		if self.error:
+			raise self.error
+		return b''
+
+class ResponseTestClass(object):
+	def __init__(self, raw):
+		self.raw = raw
+
+	def iter_lines(self, chunk_size=512):
+		self.iter_lines_chunk_size = chunk_size
+		return iter([b'line'])
+
+class TestLineSplitter(unittest.TestCase):
+	def test_feed(self):
+		splitter = _LineSplitter()
+		self.assertEqual(splitter.feed(b'one\ntw'), [b'one'])
+		self.assertEqual(splitter.feed(b'o\r'), [])
+		self.assertEqual(splitter.feed(b'\n\nthree\r\nfo'), [b'two', b'',
+				b'three'])
+		self.assertEqual(splitter.flush(), [b'fo'])
+		self.assertEqual(splitter.flush(), [])
+
+class TestIterStreamLines(unittest.TestCase):
+	def test_iter_stream_lines(self):
+		raw = RawTestClass([b'{"a": 1}\n{"b"', b': 2}\n\n', b'{"c": 3}'])
+		lines = list(_iter_stream_lines(ResponseTestClass(raw), 1024))
+		self.assertEqual(lines, [b'{"a": 1}', b'{"b": 2}', b'', b'{"c": 3}'])
+		self.assertEqual(raw.reads, [1024] * 4)
+
+	def test_iter_stream_lines_prompt(self):
+		# each line is delivered before the next read
+		raw = RawTestClass([b'one\n', b'two\n'])
+		lines = _iter_stream_lines(ResponseTestClass(raw))
+		self.assertEqual(next(lines), b'one')
+		self.assertEqual(len(raw.reads), 1)
+
+	def test_iter_stream_lines_timeout(self):
+		from requests.packages.urllib3.exceptions import ReadTimeoutError
+		raw = RawTestClass([b'one\n'], ReadTimeoutError(None, None,
+				'Read timed out.'))
+		lines = _iter_stream_lines(ResponseTestClass(raw))
+		self.assertEqual(next(lines), b'one')
+		with self.assertRaises(requests.exceptions.ConnectionError) as cm:
+			next(lines)
+		self.assertTrue('timed out' in str(cm.exception))
+
+	def test_iter_stream_lines_fallback(self):
+		response = ResponseTestClass(object())
+		self.assertEqual(list(_iter_stream_lines(response)), [b'line'])
+		self.assertEqual(response.iter_lines_chunk_size, 1)
+
+def encode_cursor(n):
+	return b64encode(('instance_%d' % n).encode('ascii')).decode('ascii')
+
+class PubSubMonitorTestClass(PubSubMonitor):
+	def __init__(self, lines):
+		self._init_state('http://localhost/', None, None, None, None, None)
+		self._last_cursor = encode_cursor(0)
+		self._stream_response = ResponseTestClass(RawTestClass(
+				[b'\n'.join(json.dumps(line).encode('utf-8')
+				for line in lines) + b'\n']))
+		self._thread_event = threading.Event()
+		self._thread_event.set()
+		self._historical_fetch_thread_result = False
+		self.historical_fetches = 0
+
+	def _try_historical_fetch(self):
+		self.historical_fetches += 1
+
+class HistoryResponseTestClass(object):
+	def __init__(self, status_code, content=None):
+		self.status_code = status_code
+		self.content = json.dumps(content).encode('utf-8')
+
+class HistorySessionTestClass(object):
+	def __init__(self, responses):
+		self.responses = responses
+		self.uris = list()
+		self.requested = threading.Condition()
+
+	def get(self, uri, headers=None, timeout=None):
+		self.requested.acquire()
+		self.uris.append(uri)
+		self.requested.notify_all()
+		self.requested.release()
+		return self.responses.pop(0)
+
+	def wait_requests(self, count):
+		self.requested.acquire()
+		end = time.time() + 5
+		while len(self.uris) < count and time.time() < end:
+			self.requested.wait(0.1)
+		self.requested.release()
+		return len(self.uris)
+
+class TestPubSubMonitor(unittest.TestCase):
+	def create_history_monitor(self, responses):
+		monitor = PubSubMonitorTestClass([])
+		monitor._auth_bearer = 'token'
+		monitor._requests_session = HistorySessionTestClass(responses)
+		return monitor
+
+	def test_run_historical_fetch(self):
+		monitor = self.create_history_monitor([
+				HistoryResponseTestClass(200, {'items': [{'channel': 'a',
+				'state': 'subscribed'}], 'last_cursor': encode_cursor(1)}),
+				HistoryResponseTestClass(200, {'items': [{'channel': 'b',
+				'state': 'subscribed'}], 'last_cursor': encode_cursor(2)}),
+				HistoryResponseTestClass(200, {'items': [],
+				'last_cursor': encode_cursor(2)})])
+		session = monitor._requests_session
+		applied = list()
+		def batch_callback(events):
+			# the next page is fetched while this one is applied
+			applied.append((events, session.wait_requests(len(applied) + 2),
+					monitor._last_cursor))
+		monitor._batch_callback = batch_callback
+		monitor._run_historical_fetch()
+		self.assertTrue(monitor._historical_fetch_thread_result)
+		self.assertTrue(monitor._catch_stream_up_to_last_cursor)
+		self.assertEqual(applied, [([('sub', 'a')], 2, encode_cursor(0)),
+				([('sub', 'b')], 3, encode_cursor(1))])
+		self.assertEqual(monitor._channels, set(['a', 'b']))
+		self.assertEqual(monitor._last_cursor, encode_cursor(2))
+		self.assertTrue(session.uris[0].endswith('?since=cursor%3A' +
+				encode_cursor(0).replace('=', '%3D')))
+		self.assertTrue(monitor._thread_event.is_set())
+		self.assertEqual(monitor.reconnect_scheduler.get_stats()['running'], 0)
+
+	def test_run_historical_fetch_scheduled(self):
+		monitor = self.create_history_monitor([
+				HistoryResponseTestClass(200, {'items': [],
+				'last_cursor': encode_cursor(1)})])
+		monitor.reconnect_scheduler = ReconnectScheduler(1)
+		monitor.reconnect_scheduler.acquire_fetch()
+		monitor._thread_event.clear()
+		thread = threading.Thread(target=monitor._run_historical_fetch)
+		thread.daemon = True
+		thread.start()
+		# the fetch waits until the running fetch completes
+		self.assertFalse(monitor._thread_event.wait(0.1))
+		self.assertEqual(monitor._requests_session.uris, [])
+		monitor.reconnect_scheduler.release_fetch()
+		self.assertTrue(monitor._thread_event.wait(5))
+		self.assertTrue(monitor._historical_fetch_thread_result)
+		self.assertEqual(monitor.reconnect_scheduler.get_stats(),
+				{'running': 0, 'waiting': 0})
+
+	def test_run_historical_fetch_not_found(self):
+		monitor = self.create_history_monitor([
+				HistoryResponseTestClass(200, {'items': [{'channel': 'a',
+				'state': 'subscribed'}], 'last_cursor': encode_cursor(1)}),
+				HistoryResponseTestClass(404)])
+		monitor._channels = set(['b'])
+		monitor._run_historical_fetch()
+		self.assertFalse(monitor._historical_fetch_thread_result)
+		self.assertEqual(monitor._channels, set())
+		self.assertEqual(monitor._last_cursor, None)
+
+	def test_run_historical_fetch_error(self):
+		monitor = self.create_history_monitor([HistoryResponseTestClass(403)])
+		monitor._stream_thread = None
+		with self.assertRaises(ValueError):
+			monitor._run_historical_fetch()
+		self.assertFalse(monitor._historical_fetch_thread_result)
+		self.assertTrue(monitor.is_closed())
+
+	def test_state_file(self):
+		state_dir = tempfile.mkdtemp()
+		try:
+			state_file = os.path.join(state_dir, 'state.json')
+			monitor = PubSubMonitorTestClass([
+					{'item': {'channel': 'a', 'state': 'subscribed'},
+					'cursor': encode_cursor(1), 'prev_cursor': encode_cursor(0)}])
+			monitor._state_file = state_file
+			monitor._monitor()
+			with open(state_file) as f:
+				state = json.load(f)
+			self.assertEqual(state, {'uri':
+					'http://localhost/subscriptions/stream/',
+					'cursor': encode_cursor(1), 'channels': ['a']})
+			self.assertEqual(os.listdir(state_dir), ['state.json'])
+			# changes within the interval are only saved when forced
+			monitor._parse_items([{'channel': 'b', 'state': 'subscribed'}])
+			monitor._save_state()
+			with open(state_file) as f:
+				self.assertEqual(json.load(f)['channels'], ['a'])
+			monitor._save_state(True)
+			with open(state_file) as f:
+				self.assertEqual(sorted(json.load(f)['channels']), ['a', 'b'])
+
+			# a new instance resumes from the saved state
+			events = list()
+			monitor = PubSubMonitorTestClass([])
+			monitor._init_state('http://localhost/', None, None,
+					lambda event_type, channel: events.append(
+					(event_type, channel)), None, None, state_file)
+			self.assertEqual(monitor._channels, set(['a', 'b']))
+			self.assertEqual(monitor.get_subscribed_channels(), ['a', 'b'])
+			self.assertEqual(monitor._last_cursor, encode_cursor(1))
+			self.assertEqual(sorted(events), [('sub', 'a'), ('sub', 'b')])
+			self.assertEqual(monitor._get_history_uri(monitor._last_cursor),
+					'http://localhost/subscriptions/items/?since=cursor%3A' +
+					encode_cursor(1).replace('=', '%3D'))
+
+			# clearing the channels saves right away
+			monitor._unsub_and_clear_channels()
+			monitor._init_state('http://localhost/', None, None, None, None,
+					None, state_file)
+			self.assertEqual(monitor._channels, set())
+			self.assertEqual(monitor._last_cursor, None)
+
+			# state saved for another URI or unreadable state is ignored
+			monitor._init_state('http://other/', None, None, None, None,
+					None, state_file)
+			self.assertEqual(monitor._last_cursor, None)
+			with open(state_file, 'w') as f:
+				f.write('{')
+			monitor._init_state('http://localhost/', None, None, None, None,
+					None, state_file)
+			self.assertEqual(monitor._last_cursor, None)
+		finally:
+			shutil.rmtree(state_dir)
+
+	def test_parse_last_cursor(self):
+		monitor = PubSubMonitorTestClass([])
+		self.assertEqual(monitor._parse_last_cursor(), '0')
+		cache = monitor._last_cursor_cache
+		self.assertEqual(monitor._parse_last_cursor(), '0')
+		self.assertTrue(monitor._last_cursor_cache is cache)
+		monitor._last_cursor = encode_cursor(1)
+		self.assertEqual(monitor._parse_last_cursor(), '1')
+		monitor._last_cursor = None
+		self.assertEqual(monitor._parse_last_cursor(), None)
+
+	def test_parse_items(self):
+		monitor = PubSubMonitorTestClass([])
+		events = list()
+		batches = list()
+		monitor._callback = lambda event_type, channel: events.append(
+				(event_type, channel))
+		monitor._batch_callback = batches.append
+		monitor._parse_items([{'channel': 'a', 'state': 'subscribed'},
+				{'channel': 'b', 'state': 'subscribed'},
+				{'channel': 'a', 'state': 'subscribed'},
+				{'channel': 'c', 'state': 'unsubscribed'},
+				{'channel': 'a', 'state': 'unsubscribed'}])
+		self.assertEqual(batches, [[('sub', 'a'), ('sub', 'b'),
+				('unsub', 'a')]])
+		self.assertEqual(events, batches[0])
+		self.assertEqual(monitor._channels, set(['b']))
+		monitor._parse_items([{'channel': 'b', 'state': 'subscribed'}])
+		self.assertEqual(len(batches), 1)
+		monitor._parse_items([{'channel': 't/r/1', 'state': 'subscribed'},
+				{'channel': 't/r/2', 'state': 'subscribed'},
+				{'channel': 't/s', 'state': 'subscribed'}])
+		self.assertTrue(monitor.is_prefix_subscribed_to('t/r'))
+		self.assertFalse(monitor.is_prefix_subscribed_to('t/x'))
+		self.assertEqual(monitor.count_subscribed_channels('t/'), 3)
+		self.assertEqual(monitor.get_subscribed_channels('t/r/'),
+				['t/r/1', 't/r/2'])
+		self.assertEqual(monitor.get_subscribed_channels_matching('t/*/1'),
+				['t/r/1'])
+		monitor._parse_items([{'channel': 't/r/1', 'state': 'unsubscribed'},
+				{'channel': 't/r/2', 'state': 'unsubscribed'},
+				{'channel': 't/s', 'state': 'unsubscribed'}])
+		self.assertEqual(monitor.get_subscribed_channels(), ['b'])
+		monitor._unsub_and_clear_channels()
+		self.assertEqual(batches[-1], [('unsub', 'b')])
+		self.assertEqual(monitor._channels, set())
+		self.assertEqual(monitor.count_subscribed_channels(), 0)
+		self.assertEqual(monitor._last_cursor, None)
+
+	def test_parse_items_snapshot(self):
+		monitor = PubSubMonitorTestClass([])
+		monitor._channels = set(['a'])
+		snapshot = monitor._channels
+		monitor._parse_items([{'channel': 'a', 'state': 'subscribed'}])
+		self.assertTrue(monitor._channels is snapshot)
+		monitor._parse_items([{'channel': 'b', 'state': 'subscribed'}])
+		# readers holding the previous set are not affected by the change
+		self.assertEqual(snapshot, set(['a']))
+		self.assertTrue(monitor.is_channel_subscribed_to('b'))
+		self.assertFalse(monitor.is_channel_subscribed_to('c'))
+
+	def test_monitor(self):
+		monitor = PubSubMonitorTestClass([
+				{'item': {'channel': 'a', 'state': 'subscribed'},
+				'cursor': encode_cursor(1), 'prev_cursor': encode_cursor(0)},
+				{'item': {'channel': 'b', 'state': 'subscribed'},
+				'cursor': encode_cursor(2), 'prev_cursor': encode_cursor(1)},
+				{'item': {'channel': 'a', 'state': 'unsubscribed'},
+				'cursor': encode_cursor(3)},
+				{'item': {'channel': 'c', 'state': 'subscribed'},
+				'cursor': encode_cursor(5), 'prev_cursor': encode_cursor(4)}])
+		parse_cursor = PubSubMonitor._parse_cursor
+		parsed = list()
+		def counting_parse_cursor(raw_cursor):
+			parsed.append(raw_cursor)
+			return parse_cursor(raw_cursor)
+		PubSubMonitor._parse_cursor = staticmethod(counting_parse_cursor)
+		try:
+			monitor._monitor()
+		finally:
+			PubSubMonitor._parse_cursor = staticmethod(parse_cursor)
+		self.assertEqual(monitor._channels, set(['b']))
+		# only the mismatched cursors were decoded
+		self.assertEqual(parsed, [encode_cursor(4), encode_cursor(3)])
+		self.assertEqual(monitor.historical_fetches, 1)
+		self.assertEqual(monitor._last_cursor, encode_cursor(3))
+
+if __name__ == '__main__':
+	unittest.main()
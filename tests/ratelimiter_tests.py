@@ -0,0 +1,70 @@
+import sys
+import time
+import unittest
+
+sys.path.append('../')
+from src.ratelimiter import TokenBucket, RateLimiter
+
+class TestTokenBucket(unittest.TestCase):
+	def test_reserve(self):
+		bucket = TokenBucket(10, 2)
+		self.assertEqual(bucket.reserve(1, 100.0), 100.0)
+		self.assertEqual(bucket.reserve(1, 100.0), 100.0)
+		self.assertAlmostEqual(bucket.reserve(1, 100.0), 100.1)
+		self.assertAlmostEqual(bucket.reserve(1, 100.0), 100.2)
+		# refilling pays off the debt before tokens are available again
+		self.assertAlmostEqual(bucket.reserve(1, 100.2), 100.3)
+		self.assertEqual(bucket.reserve(1, 101.0), 101.0)
+
+	def test_burst_capacity(self):
+		bucket = TokenBucket(10)
+		self.assertEqual(bucket.burst, 10.0)
+		bucket.reserve(10, 100.0)
+		self.assertEqual(bucket.reserve(5, 200.0), 200.0)
+		self.assertEqual(bucket._tokens, 5.0)
+
+	def test_invalid(self):
+		with self.assertRaises(ValueError):
+			TokenBucket(0)
+		with self.assertRaises(ValueError):
+			TokenBucket(1, 0)
+
+class TestRateLimiter(unittest.TestCase):
+	def test_items_per_second(self):
+		limiter = RateLimiter(items_per_second=10)
+		start = time.time()
+		for n in range(0, 10):
+			self.assertTrue(limiter.reserve('chan', 100) <= time.time())
+		ready = limiter.reserve('chan', 100)
+		self.assertTrue(ready - start >= 0.09)
+		stats = limiter.get_stats()
+		self.assertEqual(stats['items'], 11)
+		self.assertEqual(stats['bytes'], 1100)
+		self.assertEqual(stats['delayed_items'], 1)
+		self.assertEqual(stats['delayed_bytes'], 100)
+		self.assertTrue(stats['total_delay'] > 0.05)
+		self.assertEqual(stats['max_delay'], stats['total_delay'])
+
+	def test_bytes_per_second(self):
+		limiter = RateLimiter(bytes_per_second=1000)
+		start = time.time()
+		limiter.reserve('chan', 1000)
+		ready = limiter.reserve('chan', 500)
+		self.assertTrue(ready - start >= 0.45)
+
+	def test_channel_limits(self):
+		limiter = RateLimiter(channel_limits={'slow': 2, b'bytes': 2})
+		now = time.time()
+		for n in range(0, 10):
+			self.assertTrue(limiter.reserve('fast', 10) <= time.time())
+		limiter.reserve('slow', 10)
+		limiter.reserve(b'slow', 10)
+		self.assertTrue(limiter.reserve('slow', 10) - now >= 0.45)
+		limiter.reserve('bytes', 10)
+		limiter.reserve('bytes', 10)
+		self.assertTrue(limiter.reserve('bytes', 10) - now >= 0.45)
+		self.assertEqual(limiter.get_stats(reset=True)['delayed_items'], 2)
+		self.assertEqual(limiter.get_stats()['items'], 0)
+
+if __name__ == '__main__':
+	unittest.main()
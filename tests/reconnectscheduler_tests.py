@@ -0,0 +1,73 @@
+import sys
+import threading
+import unittest
+
+sys.path.append('../')
+from src.reconnectscheduler import ReconnectScheduler
+
+class TestReconnectScheduler(unittest.TestCase):
+	def test_initialize(self):
+		with self.assertRaises(ValueError):
+			ReconnectScheduler(0)
+		with self.assertRaises(ValueError):
+			ReconnectScheduler(base_interval=2.0, max_interval=1.0)
+		scheduler = ReconnectScheduler(None)
+		for n in range(0, 10):
+			scheduler.acquire_fetch()
+		self.assertEqual(scheduler.get_stats(), {'running': 10, 'waiting': 0})
+
+	def test_get_wait_interval(self):
+		scheduler = ReconnectScheduler(base_interval=1.0, max_interval=10.0)
+		intervals = set()
+		for n in range(0, 100):
+			interval = scheduler.get_wait_interval()
+			self.assertTrue(0 <= interval <= 1.0)
+			intervals.add(interval)
+			interval = scheduler.get_wait_interval(0.1)
+			self.assertTrue(1.0 <= interval <= 1.0)
+			interval = scheduler.get_wait_interval(2.0)
+			self.assertTrue(1.0 <= interval <= 6.0)
+			interval = scheduler.get_wait_interval(8.0)
+			self.assertTrue(1.0 <= interval <= 10.0)
+			interval = scheduler.get_wait_interval(8.0, 5.0)
+			self.assertTrue(1.0 <= interval <= 5.0)
+		# the intervals are jittered
+		self.assertTrue(len(intervals) > 1)
+
+	def test_fetch_limit(self):
+		scheduler = ReconnectScheduler(2)
+		started = list()
+		for n in range(0, 5):
+			scheduler.request_fetch(lambda n=n: started.append(n))
+		self.assertEqual(started, [0, 1])
+		self.assertEqual(scheduler.get_stats(), {'running': 2, 'waiting': 3})
+		scheduler.release_fetch()
+		self.assertEqual(started, [0, 1, 2])
+		scheduler.set_max_fetches(3)
+		self.assertEqual(started, [0, 1, 2, 3])
+		with self.assertRaises(ValueError):
+			scheduler.set_max_fetches(0)
+		scheduler.set_max_fetches(1)
+		scheduler.release_fetch()
+		scheduler.release_fetch()
+		self.assertEqual(started, [0, 1, 2, 3])
+		scheduler.release_fetch()
+		self.assertEqual(started, [0, 1, 2, 3, 4])
+		self.assertEqual(scheduler.get_stats(), {'running': 1, 'waiting': 0})
+
+	def test_acquire_fetch(self):
+		scheduler = ReconnectScheduler(1)
+		scheduler.acquire_fetch()
+		acquired = threading.Event()
+		def acquire():
+			scheduler.acquire_fetch()
+			acquired.set()
+		thread = threading.Thread(target=acquire)
+		thread.daemon = True
+		thread.start()
+		self.assertFalse(acquired.wait(0.1))
+		scheduler.release_fetch()
+		self.assertTrue(acquired.wait(5))
+
+if __name__ == '__main__':
+	unittest.main()
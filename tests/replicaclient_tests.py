@@ -0,0 +1,139 @@
+import sys
+import time
+import threading
+import unittest
+
+sys.path.append('../')
+from src.replicaclient import ReplicaPubControlClient
+from src.item import Item, PreparedItem
+from src.format import Format
+
+class TestFormatSubClass(Format):
+	def name(self):
+		return 'name'
+
+	def export(self):
+		return {'body': 'bodyvalue'}
+
+# Keeps the callbacks of the publishes until they are completed by the test,
+# or completes them right away if a result is set.
+class ReplicaTestClass(object):
+	def __init__(self, uri, result=None):
+		self.uri = uri
+		self.result = result
+		self.published = list()
+		self.callbacks = list()
+		self.closed = False
+
+	def publish(self, channel, item, blocking=False, callback=None):
+		self.published.append((channel, item))
+		if self.result is not None:
+			callback(self.result[0], self.result[1])
+		else:
+			self.callbacks.append(callback)
+
+	def complete(self, success=True, message=''):
+		callbacks = self.callbacks
+		self.callbacks = list()
+		for callback in callbacks:
+			callback(success, message)
+
+	def wait_all_sent(self):
+		self.complete()
+
+	def close(self):
+		self.closed = True
+
+class TestReplicaPubControlClient(unittest.TestCase):
+	def callback(self, success, message):
+		self.results.append((success, message))
+
+	def test_initialize(self):
+		with self.assertRaises(ValueError):
+			ReplicaPubControlClient([])
+		with self.assertRaises(ValueError):
+			ReplicaPubControlClient([ReplicaTestClass('a')], [1, 2])
+		with self.assertRaises(ValueError):
+			ReplicaPubControlClient([ReplicaTestClass('a')], [0])
+		with self.assertRaises(ValueError):
+			ReplicaPubControlClient([ReplicaTestClass('a')],
+					hedge_percentile=0)
+		client = ReplicaPubControlClient([ReplicaTestClass('a'),
+				ReplicaTestClass('b')])
+		self.assertEqual(client.uri, 'a')
+		self.assertEqual(client.sub_monitor, None)
+
+	def test_least_outstanding(self):
+		replicas = [ReplicaTestClass('a'), ReplicaTestClass('b')]
+		client = ReplicaPubControlClient(replicas, [2, 1])
+		for n in range(0, 6):
+			client.publish('chan', 'item')
+		self.assertEqual(len(replicas[0].callbacks), 4)
+		self.assertEqual(len(replicas[1].callbacks), 2)
+		self.assertEqual(client.get_stats()['outstanding'], [4, 2])
+		replicas[0].complete()
+		client.publish('chan', 'item')
+		self.assertEqual(len(replicas[0].callbacks), 1)
+		client.wait_all_sent()
+		self.assertEqual(client.get_stats()['outstanding'], [0, 0])
+
+	def test_failover(self):
+		replicas = [ReplicaTestClass('a', (False, 'error a')),
+				ReplicaTestClass('b', (True, ''))]
+		client = ReplicaPubControlClient(replicas)
+		self.results = list()
+		client.publish('chan', 'item', callback=self.callback)
+		self.assertEqual(self.results, [(True, '')])
+		self.assertEqual(len(replicas[1].published), 1)
+		self.assertEqual(client.get_stats()['failovers'], 1)
+		replicas[1].result = (False, 'error b')
+		client.publish('chan', 'item', callback=self.callback)
+		self.assertEqual(self.results[1], (False, 'error b'))
+		with self.assertRaises(ValueError):
+			client.publish('chan', 'item', blocking=True)
+		client = ReplicaPubControlClient(replicas, failover=False)
+		replicas[1].result = (True, '')
+		client.publish('chan', 'item', callback=self.callback)
+		self.assertEqual(self.results[2], (False, 'error a'))
+
+	def test_blocking(self):
+		replicas = [ReplicaTestClass('a', (True, ''))]
+		client = ReplicaPubControlClient(replicas)
+		client.publish('chan', Item(TestFormatSubClass()), blocking=True)
+		self.assertTrue(isinstance(replicas[0].published[0][1],
+				PreparedItem))
+
+	def test_hedge(self):
+		replicas = [ReplicaTestClass('a'), ReplicaTestClass('b')]
+		client = ReplicaPubControlClient(replicas, hedge_percentile=90,
+				hedge_min_delay=0.05, min_samples=5)
+		self.assertEqual(client.get_stats()['hedge_delay'], None)
+		client._latencies.extend([0.01] * 5)
+		self.assertEqual(client.get_stats()['hedge_delay'], 0.05)
+		self.results = list()
+		item = Item(TestFormatSubClass(), id='1')
+		client.publish('chan', item, callback=self.callback)
+		self.assertEqual(len(replicas[0].published), 1)
+		start = time.time()
+		while not replicas[1].published and time.time() - start < 5:
+			time.sleep(0.01)
+		self.assertTrue(time.time() - start >= 0.04)
+		# the hedge carries the same item and ID
+		self.assertTrue(replicas[1].published[0][1] is
+				replicas[0].published[0][1])
+		replicas[1].complete()
+		replicas[0].complete()
+		self.assertEqual(self.results, [(True, '')])
+		self.assertEqual(client.get_stats()['hedged'], 1)
+		# items without an ID are never duplicated
+		client.publish('chan', Item(TestFormatSubClass()),
+				callback=self.callback)
+		time.sleep(0.15)
+		self.assertEqual(len(replicas[0].published) +
+				len(replicas[1].published), 3)
+		client.close()
+		self.assertTrue(replicas[0].closed and replicas[1].closed)
+		self.assertEqual(len(self.results), 2)
+
+if __name__ == '__main__':
+	unittest.main()
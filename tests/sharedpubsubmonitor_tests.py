@@ -0,0 +1,111 @@
+import sys
+import unittest
+
+sys.path.append('../')
+from src import sharedpubsubmonitor
+from src.sharedpubsubmonitor import SharedPubSubMonitor
+
+class PubSubMonitorTestClass(object):
+	instances = list()
+
+	def __init__(self, base_stream_uri, auth_jwt_claim=None, auth_jwt_key=None,
+			callback=None, auth_bearer=None, batch_callback=None,
+			state_file=None):
+		self.base_stream_uri = base_stream_uri
+		self.state_file = state_file
+		self.batch_callback = batch_callback
+		self.channels = set()
+		self.closed = False
+		PubSubMonitorTestClass.instances.append(self)
+
+	def is_channel_subscribed_to(self, channel):
+		return channel in self.channels
+
+	def close(self, blocking=False):
+		self.closed = True
+
+	def is_closed(self):
+		return self.closed
+
+	def deliver(self, events):
+		for event_type, channel in events:
+			if event_type == 'sub':
+				self.channels.add(channel)
+			else:
+				self.channels.discard(channel)
+		self.batch_callback(events)
+
+class TestSharedPubSubMonitor(unittest.TestCase):
+	def setUp(self):
+		self.pubsubmonitor = sharedpubsubmonitor.PubSubMonitor
+		sharedpubsubmonitor.PubSubMonitor = PubSubMonitorTestClass
+		PubSubMonitorTestClass.instances = list()
+
+	def tearDown(self):
+		sharedpubsubmonitor.PubSubMonitor = self.pubsubmonitor
+		sharedpubsubmonitor._monitors.clear()
+
+	def test_share(self):
+		m1 = SharedPubSubMonitor('uri', {'iss': 'a'}, 'key')
+		m2 = SharedPubSubMonitor('uri/', {'iss': 'a'}, 'key')
+		m3 = SharedPubSubMonitor('uri', {'iss': 'b'}, 'key')
+		m4 = SharedPubSubMonitor('uri', auth_bearer='token')
+		m6 = SharedPubSubMonitor('uri', auth_bearer='token',
+				state_file='state.json')
+		self.assertEqual(len(PubSubMonitorTestClass.instances), 4)
+		self.assertEqual(m6._entry.monitor.state_file, 'state.json')
+		self.assertFalse(m4._entry is m6._entry)
+		self.assertTrue(m1._entry is m2._entry)
+		self.assertFalse(m1._entry is m3._entry)
+		self.assertFalse(m3._entry is m4._entry)
+		monitor = m1._entry.monitor
+		m1.close()
+		self.assertTrue(m1.is_closed())
+		self.assertFalse(monitor.closed)
+		self.assertFalse(m2.is_closed())
+		m2.close()
+		m2.close()
+		self.assertTrue(monitor.closed)
+		self.assertEqual(m3._entry.refs, 1)
+		# a new instance starts a new monitor once the last one is closed
+		m5 = SharedPubSubMonitor('uri', {'iss': 'a'}, 'key')
+		self.assertFalse(m5._entry.monitor is monitor)
+
+	def test_fan_out(self):
+		events1 = list()
+		batches2 = list()
+		m1 = SharedPubSubMonitor('uri', callback=lambda event_type, channel:
+				events1.append((event_type, channel)))
+		m2 = SharedPubSubMonitor('uri', batch_callback=batches2.append)
+		monitor = m1._entry.monitor
+		monitor.deliver([('sub', 'a'), ('sub', 'b')])
+		self.assertEqual(events1, [('sub', 'a'), ('sub', 'b')])
+		self.assertEqual(batches2, [[('sub', 'a'), ('sub', 'b')]])
+		self.assertTrue(m2.is_channel_subscribed_to('a'))
+		monitor.deliver([('unsub', 'a')])
+		self.assertFalse(m1.is_channel_subscribed_to('a'))
+		# instances created later are passed the current subscriptions
+		batches3 = list()
+		m3 = SharedPubSubMonitor('uri', batch_callback=batches3.append)
+		self.assertEqual(batches3, [[('sub', 'b')]])
+		m1.close()
+		monitor.deliver([('unsub', 'b')])
+		self.assertEqual(len(events1), 3)
+		self.assertEqual(batches2[-1], [('unsub', 'b')])
+		self.assertEqual(batches3[-1], [('unsub', 'b')])
+
+	def test_closed_monitor(self):
+		m1 = SharedPubSubMonitor('uri')
+		m1._entry.monitor.closed = True
+		self.assertTrue(m1.is_closed())
+		m2 = SharedPubSubMonitor('uri')
+		self.assertFalse(m2.is_closed())
+		self.assertFalse(m1._entry is m2._entry)
+		m1.close()
+		self.assertFalse(m2._entry.monitor.closed)
+		self.assertTrue(sharedpubsubmonitor._monitors)
+		m2.close()
+		self.assertFalse(sharedpubsubmonitor._monitors)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,100 @@
+import sys
+import unittest
+
+sys.path.append('../')
+from src import tnetstringcodec
+from src.utilities import _ensure_utf8
+from src.item import Item
+from src.format import Format
+
+class TestFormatSubClass(Format):
+	def name(self):
+		return 'name'
+
+	def export(self):
+		return {'body': u'b\xf6dy'}
+
+class TestTnetstringCodec(unittest.TestCase):
+	def setUp(self):
+		self.c_backend = tnetstringcodec._c_backend
+
+	def tearDown(self):
+		tnetstringcodec._c_backend = self.c_backend
+
+	def test_dumps_scalars(self):
+		self.assertEqual(tnetstringcodec.dumps('text'), b'4:text,')
+		self.assertEqual(tnetstringcodec.dumps(b'text'), b'4:text,')
+		self.assertEqual(tnetstringcodec.dumps(u'é'), b'2:\xc3\xa9,')
+		self.assertEqual(tnetstringcodec.dumps(12), b'2:12#')
+		self.assertEqual(tnetstringcodec.dumps(1.5), b'3:1.5^')
+		self.assertEqual(tnetstringcodec.dumps(True), b'4:true!')
+		self.assertEqual(tnetstringcodec.dumps(False), b'5:false!')
+		self.assertEqual(tnetstringcodec.dumps(None), b'0:~')
+
+	def test_dumps_containers(self):
+		tnetstringcodec._c_backend = False
+		self.assertEqual(tnetstringcodec.dumps([]), b'0:]')
+		self.assertEqual(tnetstringcodec.dumps({}), b'0:}')
+		self.assertEqual(tnetstringcodec.dumps(['a', [1]]),
+				b'11:1:a,4:1:1#]]')
+		self.assertEqual(tnetstringcodec.dumps({'k': 'v'}),
+				b'8:1:k,1:v,}')
+		with self.assertRaises(ValueError):
+			tnetstringcodec.dumps(object())
+
+	def test_dumps_text_matches_utf8(self):
+		value = {'formats': {'name': {'body': u'bödy'}},
+				'id': 'id', 'meta': {'n': 1, 'list': ['a', None]}}
+		tnetstringcodec._c_backend = False
+		self.assertEqual(tnetstringcodec.loads(tnetstringcodec.dumps(value)),
+				_ensure_utf8(value))
+		self.assertEqual(tnetstringcodec.dumps(value),
+				tnetstringcodec.dumps(_ensure_utf8(value)))
+
+	def test_dump_into(self):
+		buf = bytearray(b'prefix')
+		tnetstringcodec.dump_into(buf, {'k': [1]})
+		self.assertEqual(bytes(buf), b'prefix11:1:k,4:1:1#]}')
+
+	def test_loads(self):
+		tnetstringcodec._c_backend = False
+		data = b'37:1:a,1:b,1:n,4:1:1#]1:f,0:~1:t,4:true!}'
+		self.assertEqual(tnetstringcodec.loads(data), {b'a': b'b',
+				b'n': [1], b'f': None, b't': True})
+		self.assertEqual(tnetstringcodec.loads(b'3:2.5^'), 2.5)
+		with self.assertRaises(ValueError):
+			tnetstringcodec.loads(b'5:abc,')
+		with self.assertRaises(ValueError):
+			tnetstringcodec.loads(b'3:abc?')
+
+	def test_c_backend(self):
+		tnetstringcodec._c_backend = None
+		backend = tnetstringcodec._get_c_backend()
+		if not backend:
+			return
+		value = {b'a': [b'b', 1, None]}
+		self.assertEqual(tnetstringcodec.dumps(value), backend.dumps(value))
+		self.assertEqual(tnetstringcodec.loads(backend.dumps(value)), value)
+
+	def test_c_backend_item_export(self):
+		class BackendTestClass(object):
+			def dumps(self, value):
+				self.value = value
+				return b'encoded'
+		backend = BackendTestClass()
+		tnetstringcodec._c_backend = backend
+		item = Item(TestFormatSubClass(), 'id')
+		self.assertEqual(item._export_tnetstring('chan'), b'encoded')
+		self.assertEqual(backend.value, {b'id': b'id', b'channel': b'chan',
+				b'formats': {b'name': {b'body': b'b\xc3\xb6dy'}}})
+		# values the backend does not support are encoded in python
+		self.assertEqual(tnetstringcodec.dumps(bytearray(b'a')), b'1:a,')
+		tnetstringcodec._c_backend = None
+		if tnetstringcodec._get_c_backend():
+			data = item._export_tnetstring('chan')
+			tnetstringcodec._c_backend = False
+			self.assertEqual(tnetstringcodec.loads(data),
+					tnetstringcodec.loads(item._export_tnetstring('chan')))
+
+if __name__ == '__main__':
+	unittest.main()
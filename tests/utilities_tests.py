@@ -11,9 +11,29 @@ class TestUtilities(unittest.TestCase):
 				utilities._verify_zmq()
 		utilities.zmq = 'zmq'
 		utilities._verify_zmq()
-		utilities.tnetstring = None
-		with self.assertRaises(ValueError):
-				utilities._verify_zmq()
+
+	def test_lazy_module(self):
+		module = utilities._LazyModule('json')
+		self.assertFalse(module._is_loaded())
+		self.assertEqual(module.dumps(1), '1')
+		self.assertTrue(module._is_loaded())
+		self.assertTrue(module)
+		module = utilities._LazyModule('nonexistentmodule')
+		self.assertFalse(module)
+		with self.assertRaises(ImportError):
+			module.dumps(1)
+
+	def test_apply_subscription_events(self):
+		channels = set(['a'])
+		out, events = utilities._apply_subscription_events(channels,
+				[('sub', 'a'), ('unsub', 'b')])
+		self.assertTrue(out is channels)
+		self.assertEqual(events, [])
+		out, events = utilities._apply_subscription_events(channels,
+				[('sub', 'b'), ('unsub', 'a'), ('sub', 'b')])
+		self.assertEqual(out, set(['b']))
+		self.assertEqual(events, [('sub', 'b'), ('unsub', 'a')])
+		self.assertEqual(channels, set(['a']))
 
 	def test_ensure_utf8(self):
 		text = 'text'
@@ -0,0 +1,68 @@
+import sys
+import time
+import threading
+import unittest
+
+sys.path.append('../')
+from src import workerpool
+from src.workerpool import WorkerPool
+
+class TestWorkerPool(unittest.TestCase):
+	def test_run(self):
+		pool = WorkerPool()
+		def fail():
+			raise ValueError('error message')
+		results = pool.run([lambda: 1, fail, lambda: 3])
+		self.assertEqual(results, [(True, 1), (False, 'error message'),
+				(True, 3)])
+
+	def test_run_concurrently(self):
+		pool = WorkerPool()
+		start = time.time()
+		results = pool.run([lambda: time.sleep(0.3)] * 4)
+		self.assertTrue(time.time() - start < 0.9)
+		self.assertEqual(len(results), 4)
+		self.assertEqual(len(pool._threads), 4)
+		pool.run([lambda: time.sleep(0.1)] * 2)
+		self.assertEqual(len(pool._threads), 4)
+
+	def test_run_timeout(self):
+		pool = WorkerPool()
+		event = threading.Event()
+		results = pool.run([lambda: 1, event.wait], 0.2)
+		self.assertEqual(results, [(True, 1), None])
+		event.set()
+
+	def test_max_threads(self):
+		pool = WorkerPool(2)
+		results = pool.run([lambda: time.sleep(0.05)] * 6)
+		self.assertEqual(len(results), 6)
+		self.assertEqual(len(pool._threads), 2)
+
+	def test_timed_out_tasks(self):
+		pool = WorkerPool(1)
+		event = threading.Event()
+		calls = list()
+		results = pool.run([event.wait, lambda: calls.append(1)], 0.2)
+		self.assertEqual(results, [None, None])
+		# the task that did not start is dropped and the thread of the task
+		# that is still running no longer counts against the maximum
+		self.assertEqual(len(pool._threads), 0)
+		detached = list(pool._detached)
+		self.assertEqual(len(detached), 1)
+		start = time.time()
+		self.assertEqual(pool.run([lambda: 2], 5), [(True, 2)])
+		self.assertTrue(time.time() - start < 1)
+		self.assertEqual(len(pool._threads), 1)
+		event.set()
+		detached[0].join(5)
+		self.assertFalse(detached[0].is_alive())
+		self.assertEqual(pool._detached, set())
+		self.assertEqual(calls, [])
+
+	def test_get_shared_pool(self):
+		self.assertTrue(workerpool.get_shared_pool() is
+				workerpool.get_shared_pool())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -3,6 +3,7 @@ import zmq
 import tnetstring
 import unittest
 import time
+import threading
 sys.path.append('../')
 from src.item import Item
 from src.format import Format
@@ -150,6 +151,25 @@ class ZmqPubControlClientTestClass6(zmqpcc.ZmqPubControlClient):
 		self.publish_blocking = blocking
 		self.publish_callback = callback
 
+class ZmqPubControlClientTestClass7(zmqpcc.ZmqPubControlClient):
+	def _verify_not_closed(self):
+		pass
+
+	def connect_zmq(self):
+		pass
+
+	def _verify_uri_config(self):
+		pass
+
+	def _discover_uris(self):
+		self.discovery_event.wait(5)
+		if self.discovery_error:
+			raise ValueError('discovery error')
+		self._discovery_completed = True
+
+	def _send_to_zmq(self, item, channel):
+		self.published.append((channel, item))
+
 class ZmqContextTestClass():
 	def socket(self, socket_type):
 		self.socket_type = socket_type
@@ -256,6 +276,52 @@ class TestZmqPubControlClient(unittest.TestCase):
 		self.assertEqual(client.publish_blocking, False)
 		self.assertEqual(client.publish_callback, 'callback')
 
+	def create_pending_client(self, discovery_error=False, max_pending=1000):
+		client = ZmqPubControlClientTestClass7.__new__(
+				ZmqPubControlClientTestClass7)
+		client.discovery_event = threading.Event()
+		client.discovery_error = discovery_error
+		client.published = list()
+		zmqpcc.ZmqPubControlClient.__init__(client, 'uri', 'push_uri',
+				max_pending=max_pending)
+		client._push_sock = ZmqSocketTestClass()
+		return client
+
+	def test_publish_pending(self):
+		client = self.create_pending_client(max_pending=3)
+		results = list()
+		for n in range(0, 4):
+			client.publish('chan%d' % n, Item(TestFormatSubClass()),
+					callback=lambda result, message, n=n:
+					results.append((n, result)))
+		# the publish that did not fit in the queue failed right away
+		self.assertEqual(results, [(3, False)])
+		self.assertEqual(client.published, list())
+		client.discovery_event.set()
+		client._pending_thread.join(5)
+		self.assertEqual([c for c, i in client.published],
+				[b'chan0', b'chan1', b'chan2'])
+		self.assertEqual(results, [(3, False), (0, True), (1, True),
+				(2, True)])
+		self.assertEqual(client._pending_thread, None)
+		client.publish('chan4', Item(TestFormatSubClass()))
+		self.assertEqual(client.published[-1][0], b'chan4')
+		client.close()
+
+	def test_publish_pending_failed(self):
+		client = self.create_pending_client(discovery_error=True)
+		results = list()
+		for n in range(0, 3):
+			client.publish('chan', Item(TestFormatSubClass()),
+					callback=lambda result, message: results.append(
+					(result, message)))
+		client.discovery_event.set()
+		client._pending_thread.join(5)
+		self.assertEqual(results, [(False,
+				'failed to publish: discovery error')] * 3)
+		self.assertEqual(client.published, list())
+		client.close()
+
 	def test_publish_internal(self):
 		client = ZmqPubControlClientTestClass('uri', 'push_uri',
 				'pub_uri', True, True, 'callback', 'context')
@@ -292,8 +358,8 @@ class TestZmqPubControlClient(unittest.TestCase):
 				is_encoded = True
 		self.assertEqual(client.send_channel, 'channel'.encode('utf-8'))
 		self.assertTrue(is_encoded)
-		self.assertEqual(client.send_item,
-				Item(TestFormatSubClass()).export(True, True))
+		self.assertEqual(client.send_item._export_tnetstring(),
+				Item(TestFormatSubClass())._export_tnetstring())
 		self.assertEqual(self.callback_result, True)
 		self.assertEqual(self.callback_message, '')
 		self.callback_result = None
@@ -315,8 +381,8 @@ class TestZmqPubControlClient(unittest.TestCase):
 				is_encoded = True
 		self.assertEqual(client.send_channel, 'channel'.encode('utf-8'))
 		self.assertTrue(is_encoded)
-		self.assertEqual(client.send_item,
-				Item(TestFormatSubClass()).export(True, True))
+		self.assertEqual(client.send_item._export_tnetstring(),
+				Item(TestFormatSubClass())._export_tnetstring())
 		self.assertEqual(self.callback_result, False)
 		self.assertNotEqual(self.callback_message, '')
 		client = ZmqPubControlClientTestClass('uri', 'push_uri',
@@ -400,20 +466,19 @@ class TestZmqPubControlClient(unittest.TestCase):
 	def test_send_to_zmq(self):
 		client = ZmqPubControlClientTestClass2('uri')
 		client._push_sock = ZmqSocketTestClass()
-		client._send_to_zmq({'content'.encode('utf-8'):
-				'content'.encode('utf-8')}, 'chan'.encode('utf-8'))
-		self.assertEqual(client._push_sock.send_data, tnetstring.dumps(
-				{'content'.encode('utf-8'): 'content'.encode('utf-8'),
-				'channel'.encode('utf-8'): 'chan'.encode('utf-8')}))
+		client._send_to_zmq(Item(TestFormatSubClass()), 'chan'.encode('utf-8'))
+		self.assertEqual(tnetstring.loads(client._push_sock.send_data),
+				{'formats'.encode('utf-8'): {'name'.encode('utf-8'):
+				{'body'.encode('utf-8'): 'bodyvalue'.encode('utf-8')}},
+				'channel'.encode('utf-8'): 'chan'.encode('utf-8')})
 		client = ZmqPubControlClientTestClass2('uri')
 		client._pub_controller = ZmqPubControllerTestClass()
-		client._send_to_zmq({'content'.encode('utf-8'):
-				'content'.encode('utf-8')}, 'chan'.encode('utf-8'))
+		client._send_to_zmq(Item(TestFormatSubClass()), 'chan'.encode('utf-8'))
 		self.assertEqual(client._pub_controller.publish_channel,
 				'chan'.encode('utf-8'))
-		self.assertEqual(client._pub_controller.publish_content,
-				tnetstring.dumps({'content'.encode('utf-8'):
-				'content'.encode('utf-8')}))
+		self.assertEqual(tnetstring.loads(
+				client._pub_controller.publish_content),
+				Item(TestFormatSubClass()).export(True, True))
 
 	def test_verify_not_closed(self):
 		client = ZmqPubControlClientTestClass3('uri')
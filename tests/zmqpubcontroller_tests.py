@@ -17,13 +17,20 @@ class ZmqPollerTestClass(object):
 		self.register_data.append((socket, pollType))
 
 	def poll(self):
-		return {control_socket: 'pollin', pub_socket: 'pollin'}
+		if pub_socket.messages:
+			return {control_socket: 'pollin', pub_socket: 'pollin'}
+		return {control_socket: 'pollin'}
+
+class ZmqAgainTestClass(Exception):
+	pass
 
 class ZmqTestClass(object):
 	def __init__(self):
 		self.PAIR = 1
 		self.XPUB = 2
 		self.POLLIN = 'pollin'
+		self.NOBLOCK = 1
+		self.Again = ZmqAgainTestClass
 
 	def Poller(self):
 		return ZmqPollerTestClass()
@@ -36,6 +43,7 @@ class PubSocketTestClass(object):
 	def __init__(self):
 		self.count = 0
 		self.closed = False
+		self.messages = [b'\x01chan', b'\x01chan2', b'\x01chan', b'\x00chan']
 
 	def disconnect(self, uri):
 		self.disconnect_uri = uri
@@ -49,17 +57,11 @@ class PubSocketTestClass(object):
 	def close(self):
 		self.close_called = True
 
-	def recv(self):
+	def recv(self, flags=0):
+		if not self.messages:
+			raise ZmqAgainTestClass()
 		self.count += 1
-		if self.count == 1:
-			return b'\x01chan'
-		if self.count == 2:
-			return b'\x01chan2'
-		if self.count == 3:
-			return b'\x01chan'
-		if self.count == 4:
-			self.closed = True
-			return b'\x00chan'
+		return self.messages.pop(0)
 
 class ControlSocketTestClass(object):
 	def __init__(self):
@@ -149,6 +151,31 @@ class TestZmqPubController(unittest.TestCase):
 		self.assertEqual(next(iter(mon.subscriptions)), 'chan2')
 		self.assertEqual(self.eventCount, 3)
 
+	def test_process_pub_sock_messages_batch(self):
+		zmqpubcontroller.zmq = ZmqTestClass()
+		mon = ZmqPubControllerTestClass(self.sub_callback,
+				ZmqContextTestClass(), self.batch_callback)
+		mon._pub_sock = PubSocketTestClass()
+		mon._pub_sock.messages.append(b'\x00chan3')
+		self.batches = list()
+		mon._process_pub_sock_messages({mon._pub_sock: 'pollin'})
+		self.assertEqual(mon._pub_sock.count, 5)
+		self.assertEqual(self.batches, [[('sub', 'chan'), ('sub', 'chan2'),
+				('unsub', 'chan')]])
+		self.assertEqual(self.eventCount, 3)
+		self.assertEqual(mon.subscriptions, set(['chan2']))
+		mon._pub_sock.messages = [b'\x01a', b'\x01b', b'\x01c']
+		mon._process_pub_sock_messages({mon._pub_sock: 'pollin'}, 2)
+		self.assertEqual(self.batches[1], [('sub', 'a'), ('sub', 'b')])
+		self.assertEqual(mon._pub_sock.messages, [b'\x01c'])
+		self.assertTrue(mon.is_prefix_subscribed_to('chan'))
+		self.assertEqual(mon.count_subscribed_channels(), 3)
+		self.assertEqual(mon.get_subscribed_channels('c'), ['chan2'])
+		self.assertEqual(mon.get_subscribed_channels_matching('?'), ['a', 'b'])
+
+	def batch_callback(self, events):
+		self.batches.append(events)
+
 	def sub_callback(self, eventType, item):
 		self.eventCount += 1
 		if self.eventCount == 1: